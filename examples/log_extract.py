@@ -1,18 +1,10 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 
-from coffee.data import DataPoint, DataAggregator, RegexPattern
+from coffee.data import ColumnarDataAggregator, RegexPattern
 from coffee.logkit import LogFileDataLoader
 
-class DataAggregator1(DataAggregator):
-    def on_data(self, datapoint: DataPoint) -> DataPoint:
-        value = datapoint.value
-        value['datetime'] = datapoint.timestamp
-        self.all_points.append(value)
-        return datapoint
 
-
-agg = DataAggregator1()
+agg = ColumnarDataAggregator()
 
 
 LogFileDataLoader("simple.log").add_pattern(
@@ -26,7 +18,8 @@ LogFileDataLoader("simple.log").add_pattern(
                  version='1.0')
 ).add_sink(agg).start()
 
-df = pd.DataFrame(agg.all_points)
+# columns are not copied when converted to DataFrame
+df = agg.to_pandas('a_pattern')
 print(df)
-df.plot(x='datetime', y=['a', 'b'], kind='line')
+df.plot(x='timestamp', y=['a', 'b'], kind='line')
 plt.show()
@@ -12,19 +12,19 @@ if __name__ == "__main__":
 
 
 from coffee.core.settings import DEF_CFG
-from coffee.core.playbook import PlaybookCommandLoader
+from coffee.core.playbook import PlaybookCommandLoader, PlaybookManifest, LazyPlaybookGroup
 
 
 CWD = os.path.split(os.path.realpath(__file__))[0]
 
 
-@click.group(help="Coffee - coffee time!")
+@click.group(cls=LazyPlaybookGroup, help="Coffee - coffee time!")
 @click.version_option(package_name='pycoffee')
 def coffee():
     pass
 
 
-@click.group('play', help='[in] custom playbooks')
+@click.group('play', cls=LazyPlaybookGroup, help='[in] custom playbooks')
 def coffee_play():
     pass
 
@@ -110,6 +110,9 @@ if not os.path.exists(DEF_CFG.plays_path):
 if not os.path.exists(DEF_CFG.data_store_path):
     os.mkdir(DEF_CFG.data_store_path)
 
+# commands of playbooks are cached in the manifest, playbooks are imported when their commands run
+coffee.manifest = coffee_play.manifest = PlaybookManifest(os.path.join(DEF_CFG.storage_path, 'playbooks.json'))
+
 # load internal playbooks
 PlaybookCommandLoader(coffee).load_multi([
     'coffee.playbook.powertoys'
@@ -1,9 +1,13 @@
 # Copyright 2022 tkorays. All Rights Reserved.
 # Licensed to MIT under a Contributor Agreement.
 import abc
+import hashlib
+import json
 import os
 import sys
 import importlib
+import importlib.util
+import click
 
 
 class Playbook(metaclass=abc.ABCMeta):
@@ -26,14 +30,126 @@ class Playbook(metaclass=abc.ABCMeta):
         pass
 
 
+def playbook_signature(path: str) -> str:
+    """
+    signature of files of a playbook, changed when any file is added, removed or modified.
+    """
+    entries = []
+    if os.path.isfile(path):
+        st = os.stat(path)
+        entries.append(f'{path}:{st.st_mtime_ns}:{st.st_size}')
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
+        for f in files:
+            st = os.stat(os.path.join(root, f))
+            entries.append(f'{os.path.relpath(os.path.join(root, f), path)}:{st.st_mtime_ns}:{st.st_size}')
+    return hashlib.sha1('\n'.join(sorted(entries)).encode()).hexdigest()
+
+
+def module_path(module_name: str) -> str:
+    spec = importlib.util.find_spec(module_name)
+    if not spec:
+        return ''
+    if spec.submodule_search_locations:
+        return list(spec.submodule_search_locations)[0]
+    return spec.origin or ''
+
+
+class PlaybookManifest:
+    """
+    names and help of commands of playbooks cached in a json file, so playbooks are not imported to list
+    commands. the commands of a playbook are read again when its files are changed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def commands(self, module_name: str, path: str) -> dict:
+        """
+        :return command name => {'help': ..., 'short_help': ..., 'hidden': ...} of a playbook module.
+        """
+        signature = playbook_signature(path) if path else ''
+        entry = self.entries.get(module_name)
+        if entry and signature and entry['signature'] == signature:
+            return entry['commands']
+
+        m = importlib.import_module(module_name)
+        commands = {c.name: {'help': c.help, 'short_help': c.short_help, 'hidden': c.hidden} for c in m.commands}
+        self.entries[module_name] = {'signature': signature, 'commands': commands}
+        self.save()
+        return commands
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+class LazyPlaybookGroup(click.Group):
+    """
+    click group which imports a playbook only when its command is run, help of commands is taken from
+    the manifest.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = PlaybookManifest('')
+        # command name => (module name, info in manifest)
+        self.lazy_commands = {}
+
+    def add_playbook(self, module_name: str, path: str = ''):
+        for name, info in self.manifest.commands(module_name, path).items():
+            self.lazy_commands[name] = (module_name, info)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands.keys()) | set(self.lazy_commands.keys()))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            m = importlib.import_module(self.lazy_commands[cmd_name][0])
+            for c in m.commands:
+                self.add_command(c)
+        return self.commands.get(cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        commands = []
+        for name in self.list_commands(ctx):
+            cmd = self.commands.get(name)
+            if not cmd:
+                # placeholder with help in the manifest
+                info = self.lazy_commands[name][1]
+                cmd = click.Command(name, help=info['help'], short_help=info['short_help'], hidden=info['hidden'])
+            if not cmd.hidden:
+                commands.append((name, cmd))
+        if not commands:
+            return
+
+        limit = formatter.width - 6 - max(len(name) for name, _ in commands)
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, cmd.get_short_help_str(limit)) for name, cmd in commands])
+
+
 class PlaybookCommandLoader:
     """
     寻找一群可爱的人，去扮演剧本中的角色吧。
+
+    playbooks are loaded lazily if the group is a `LazyPlaybookGroup`.
     """
     def __init__(self, click_group):
         self.click_group = click_group
 
-    def load(self, module_name):
+    def load(self, module_name, path=''):
+        if isinstance(self.click_group, LazyPlaybookGroup):
+            self.click_group.add_playbook(module_name, path or module_path(module_name))
+            return self
         m = importlib.import_module(module_name)
         m = importlib.reload(m)
         for c in m.commands:
@@ -54,8 +170,10 @@ class PlaybookCommandLoader:
             self.load(playbook_module + '.' + f)
 
     def load_custom_plays(self, path):
+        if not os.path.isdir(path):
+            return
         sys.path.insert(0, path)
         for f in os.listdir(path):
             if f.startswith('__') or f.startswith('.') or not f.endswith('Playbook'):
                 continue
-            self.load(f)
+            self.load(f, os.path.join(path, f))
@@ -28,6 +28,9 @@ class Setting(yaml.YAMLObject):
     storage_path: str = os.path.join(os.path.expanduser('~'), '.coffee')
     plays_path: str = os.path.join(os.path.expanduser('~'), '.coffee', 'CustomPlays')
     data_store_path: str = os.path.join(os.path.expanduser('~'), '.coffee', 'datastore')
+    # bytes and seconds limits of the data store, 0 for no limit
+    data_store_max_size: int = 0
+    data_store_ttl: float = 0
 
     @staticmethod
     def load(path: str):
@@ -43,4 +46,18 @@ class Setting(yaml.YAMLObject):
         self.__setattr__(key, value)
 
 
-DEF_CFG = Setting.load(DEF_SETTING_PATH)
+def load_config() -> Setting:
+    """
+    load settings from `DEF_SETTING_PATH`, default settings if it doesn't exist.
+    """
+    if not os.path.exists(DEF_SETTING_PATH):
+        return Setting()
+    return Setting.load(DEF_SETTING_PATH)
+
+
+def __getattr__(name):
+    # DEF_CFG is loaded on first use
+    if name == 'DEF_CFG':
+        globals()[name] = load_config()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
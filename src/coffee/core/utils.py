@@ -3,7 +3,7 @@
 import os
 from datetime import datetime
 import getpass
-from coffee.core.settings import DEF_CFG
+from coffee.core import settings
 import click
 import random
 import platform
@@ -33,7 +33,7 @@ def merge_datetime(base_dt, diff_kv):
 
 
 def get_local_user():
-    my_name = DEF_CFG.local_user
+    my_name = settings.DEF_CFG.local_user
     return my_name or getpass.getuser()
 
 
@@ -1,23 +1,54 @@
-from .database import (
-    TimeSeriesDatabase,
-    InfluxDBV1,
-    DEF_TSDB
-)
-from .datamodel import DataModel
-from .dataextractor import (
-    PatternInterface, RegexPattern,
-    PatternGroup, PatternGroupBuilder
-)
-from .dataflow import DataPoint, DataSink, DataSource, DataLoader
-from .processor import (
-    DataAggregator, DatapointTimeTracker,
-    InfluxDBDataSink, PatternMatchReporter
-)
-from .datastore import (
-    DataStorable, DataStore, FileSystemDataStore, HDF5DataStore, DEF_DATA_STORE
-)
-from .dataviz import (
-    GrafanaDashboardBuilder,
-    InfluxDBTarget, InfluxQLBuilder, grafana_var
-)
-from .patterns import DEFAULT_TS_PATTERNS
+"""
+names are imported from submodules on first use, importing this package doesn't load influxdb, h5py,
+numpy or grafanalib, and DEF_TSDB and DEF_DATA_STORE are created when they are used.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'database': [
+        'TimeSeriesDatabase',
+        'TimeRange',
+        'InfluxDBV1',
+        'DEF_TSDB',
+    ],
+    'datamodel': ['DataModel'],
+    'dataextractor': [
+        'PatternInterface', 'RegexPattern',
+        'PatternGroup', 'PatternGroupBuilder', 'CompiledPatternGroup',
+    ],
+    'dataflow': ['DataPoint', 'DataSink', 'DataSource', 'DataLoader'],
+    'processor': [
+        'DataAggregator', 'ColumnarDataAggregator', 'DatapointTimeTracker',
+        'InfluxDBDataSink', 'PatternMatchReporter', 'RollupDataSink',
+    ],
+    'columnar': ['ColumnarBatch', 'ColumnarBatchBuilder'],
+    'spool': ['LineSpool', 'SpoolDrainer'],
+    'querycache': ['CachedTimeSeriesDatabase'],
+    'columnardb': ['ColumnarTimeSeriesDatabase'],
+    'datastore': [
+        'DataStorable', 'DataStore', 'FileSystemDataStore', 'HDF5DataStore', 'HDF5SWMRDataStore', 'SQLiteDataStore',
+        'LRUDataStore', 'BoundedDataStore', 'DEF_DATA_STORE',
+    ],
+    'dataviz': [
+        'GrafanaDashboardBuilder',
+        'InfluxDBTarget', 'InfluxQLBuilder', 'grafana_var',
+    ],
+    'patterns': ['DEFAULT_TS_PATTERNS'],
+    'timestamp': ['TimestampRecognizer'],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+__all__ = list(_MODULES.keys())
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
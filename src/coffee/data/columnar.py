@@ -0,0 +1,222 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+columnar batch of datapoints.
+
+datapoints with the same name are kept column by column: timestamps in an int64 array, numbers in typed
+arrays and other values (and tags) dictionary encoded, so a long capture doesn't hold a dict per point.
+"""
+
+import array
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+
+class ColumnBuilder:
+    """
+    growable column, int and float values are kept in typed arrays, others are dictionary encoded.
+    """
+    def __init__(self, typecode: str, rows: int = 0):
+        # 'q' for int, 'd' for float and '' for dictionary encoded values
+        self.typecode = typecode
+        self.data = array.array(typecode or 'i')
+        # value => code of dictionary encoded column
+        self.categories = {}
+        for _ in range(rows):
+            self.append_missing()
+
+    @staticmethod
+    def create(value, rows: int = 0, dictionary: bool = False):
+        if dictionary:
+            return ColumnBuilder('', rows)
+        if type(value) is int:
+            return ColumnBuilder('q', rows)
+        if type(value) is float:
+            return ColumnBuilder('d', rows)
+        return ColumnBuilder('', rows)
+
+    def append(self, value):
+        if self.typecode == 'q':
+            if type(value) is int:
+                self.data.append(value)
+                return
+            self.to_float() if type(value) is float else self.to_dictionary()
+        if self.typecode == 'd':
+            if type(value) is float or type(value) is int:
+                self.data.append(value)
+                return
+            self.to_dictionary()
+
+        code = self.categories.get(value)
+        if code is None:
+            code = self.categories[value] = len(self.categories)
+        self.data.append(code)
+
+    def append_missing(self):
+        if self.typecode == 'q':
+            self.to_float()
+        self.data.append(math.nan if self.typecode == 'd' else -1)
+
+    def to_float(self):
+        self.typecode = 'd'
+        self.data = array.array('d', self.data)
+
+    def to_dictionary(self):
+        values = list(self.data)
+        self.typecode = ''
+        self.data = array.array('i')
+        self.categories = {}
+        for v in values:
+            if isinstance(v, float) and math.isnan(v):
+                self.data.append(-1)
+            else:
+                self.append(v)
+
+    def build(self):
+        """
+        :return numpy array, or (codes, categories) for dictionary encoded column.
+        """
+        if self.typecode == 'q':
+            return np.frombuffer(self.data, dtype=np.int64)
+        if self.typecode == 'd':
+            return np.frombuffer(self.data, dtype=np.float64)
+        return np.frombuffer(self.data, dtype=np.int32), list(self.categories.keys())
+
+
+class ColumnarBatch:
+    """
+    columns of datapoints with the same name.
+    """
+    def __init__(self, name: str, timestamps: np.ndarray, columns: dict, tags: list):
+        self.name = name
+        # microseconds since 1970-01-01 of the datetime in logs, no timezone is applied
+        self.timestamps = timestamps
+        # field name => numpy array, or (codes, categories) for dictionary encoded field
+        self.columns = columns
+        self.tags = tags
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def datetimes(self) -> np.ndarray:
+        return self.timestamps.view('datetime64[us]')
+
+    def column(self, key: str) -> np.ndarray:
+        """
+        values of a field, dictionary encoded field is decoded.
+        """
+        col = self.columns[key]
+        if not isinstance(col, tuple):
+            return col
+        codes, categories = col
+        values = np.array(categories + [None], dtype=object)
+        return values[codes]
+
+    def time_slice(self, begin: int, end: int):
+        """
+        rows with timestamp in [begin, end), timestamps should be sorted.
+        """
+        b, e = np.searchsorted(self.timestamps, [begin, end])
+        columns = {}
+        for k, col in self.columns.items():
+            columns[k] = (col[0][b:e], col[1]) if isinstance(col, tuple) else col[b:e]
+        return ColumnarBatch(self.name, self.timestamps[b:e], columns, self.tags)
+
+    def nbytes(self) -> int:
+        """
+        approximate memory size.
+        """
+        size = self.timestamps.nbytes
+        for col in self.columns.values():
+            arr = col[0] if isinstance(col, tuple) else col
+            # pointers and small objects of object array
+            size += arr.nbytes * (8 if arr.dtype.kind == 'O' else 1)
+        return size
+
+    @staticmethod
+    def concat(batches: list):
+        """
+        concatenate batches of the same name, dictionary encoded fields are decoded,
+        missing fields are NaN. None if there is no batch.
+        """
+        if not batches:
+            return None
+        if len(batches) == 1:
+            return batches[0]
+        keys = list(dict.fromkeys(k for b in batches for k in b.columns.keys()))
+        columns = {}
+        for k in keys:
+            columns[k] = np.concatenate([
+                b.column(k) if k in b.columns else np.full(len(b), np.nan) for b in batches
+            ])
+        return ColumnarBatch(
+            batches[0].name,
+            np.concatenate([b.timestamps for b in batches]),
+            columns,
+            batches[0].tags
+        )
+
+    def to_pandas(self, timestamp_column: str = 'timestamp'):
+        """
+        convert to pandas DataFrame without copying the columns.
+        """
+        import pandas as pd
+        data = {timestamp_column: self.datetimes()}
+        for k, col in self.columns.items():
+            data[k] = pd.Categorical.from_codes(*col) if isinstance(col, tuple) else col
+        return pd.DataFrame(data, copy=False)
+
+
+class ColumnarBatchBuilder:
+    """
+    build a columnar batch from datapoints or pattern matches.
+    """
+    def __init__(self, name: str, tags: list = None):
+        self.name = name
+        self.tags = tags if tags else []
+        self.tag_keys = set(t[0] for t in self.tags)
+        self.reset()
+
+    def reset(self):
+        self.rows = 0
+        self.timestamps = array.array('q')
+        self.columns = {}
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, dt: datetime, value: dict):
+        """
+        :param dt: datetime without timezone.
+        :param value: data values in key-value format.
+        """
+        self.timestamps.append((dt - _EPOCH) // _US)
+        for k, v in value.items():
+            col = self.columns.get(k)
+            if not col:
+                col = self.columns[k] = ColumnBuilder.create(v, self.rows, k in self.tag_keys)
+            col.append(v)
+        self.rows += 1
+        if len(value) < len(self.columns):
+            for k, col in self.columns.items():
+                if k not in value:
+                    col.append_missing()
+
+    def build(self) -> ColumnarBatch:
+        """
+        build the batch, columns are handed over to the batch and this builder is reset.
+        """
+        batch = ColumnarBatch(
+            self.name,
+            np.frombuffer(self.timestamps, dtype=np.int64),
+            {k: col.build() for k, col in self.columns.items()},
+            self.tags
+        )
+        self.reset()
+        return batch
@@ -0,0 +1,371 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+embedded time series database without server, for offline analysis.
+
+each measurement is a directory of time partitions, and each partition keeps append-only column files:
+* time.i8: int64 microseconds of local time like `ColumnarBatch`
+* blocks.i8: sparse time index, (first row, rows, min time, max time) of each appended block
+* f_<field>.f8: numbers in float64, NaN for missing
+* f_<field>.i4 and t_<tag>.i4: codes of dictionary encoded strings and tags, -1 for missing,
+  with categories in .json
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import numpy as np
+
+from coffee.data.columnar import ColumnarBatch
+from coffee.data.database import TimeSeriesDatabase, columnar_to_points
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+_CONDITION = re.compile(
+    r"""\s*(?:"((?:[^"\\]|\\.)*)"|(\w+))\s*(=|!=|<>)\s*"""
+    r"""(?:'((?:[^'\\]|\\.)*)'|(true|false)\b|([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?))"""
+    r"""\s*(and\b|$)""",
+    re.IGNORECASE
+)
+
+
+def read_array(path: str, dtype) -> np.ndarray:
+    """
+    memory-mapped column, empty array if the file is empty or missing.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def parse_filters(filters: str) -> list:
+    """
+    parse InfluxQL conditions like `"name"='x' and v!=1` into (key, equal, value).
+
+    only equality and inequality of a tag or field to a string, number or boolean joined by `and` are supported,
+    ValueError is raised for others.
+    """
+    conditions = []
+    pos = 0
+    while True:
+        m = _CONDITION.match(filters, pos)
+        if not m:
+            raise ValueError(f'unsupported filters: {filters}')
+        quoted, key, op, string, boolean, number, joined = m.groups()
+        if string is not None:
+            value = re.sub(r'\\(.)', r'\1', string)
+        elif boolean is not None:
+            value = boolean.lower() == 'true'
+        elif re.fullmatch(r'[-+]?\d+', number):
+            value = int(number)
+        else:
+            value = float(number)
+        key = re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else key
+        conditions.append((key, op == '=', value))
+        if not joined:
+            return conditions
+        pos = m.end()
+
+
+def write_json(path: str, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ColumnarPartition:
+    """
+    column files of a time partition.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # field => 'f8' or 'str'
+        self.schema = read_json(self.file('schema.json'), {'fields': {}, 'tags': []})
+        self.rows = os.path.getsize(self.file('time.i8')) // 8 if os.path.exists(self.file('time.i8')) else 0
+        # files are repaired by the first append, reading never changes them
+        self.repaired = False
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def column_file(self, prefix: str, key: str, ext: str) -> str:
+        return self.file(f'{prefix}_{quote(key, safe="")}.{ext}')
+
+    def truncate(self):
+        """
+        drop rows of an interrupted append, which are written to some files but not to time.i8.
+        columns not in the schema are emptied, they are filled again when the key is appended.
+        """
+        self.schema = read_json(self.file('schema.json'), {'fields': {}, 'tags': []})
+        self.rows = os.path.getsize(self.file('time.i8')) // 8 if os.path.exists(self.file('time.i8')) else 0
+        sizes = {'time.i8': self.rows * 8}
+        for key, kind in self.schema['fields'].items():
+            ext = 'f8' if kind == 'f8' else 'i4'
+            sizes[os.path.basename(self.column_file('f', key, ext))] = self.rows * (8 if kind == 'f8' else 4)
+        for key in self.schema['tags']:
+            sizes[os.path.basename(self.column_file('t', key, 'i4'))] = self.rows * 4
+        for name in os.listdir(self.path):
+            if name.endswith(('.f8', '.i4')) or name == 'time.i8':
+                if os.path.getsize(self.file(name)) > sizes.get(name, 0):
+                    os.truncate(self.file(name), sizes.get(name, 0))
+
+        if os.path.exists(self.file('blocks.i8')):
+            blocks = np.fromfile(self.file('blocks.i8'), dtype=np.int64)
+            blocks = blocks[:len(blocks) // 4 * 4].reshape(-1, 4)
+            # blocks are appended in order of rows
+            valid = int(np.sum(blocks[:, 0] + blocks[:, 1] <= self.rows))
+            if valid * 32 < os.path.getsize(self.file('blocks.i8')):
+                os.truncate(self.file('blocks.i8'), valid * 32)
+
+    def append(self, timestamps: np.ndarray, fields: list, tags: list):
+        """
+        append a block of rows sorted by time.
+
+        :param fields: values of fields in dict for each row.
+        :param tags: values of tags in dict for each row.
+        """
+        if not self.repaired:
+            self.truncate()
+            self.repaired = True
+        count = len(timestamps)
+        for key in set(k for row in fields for k in row.keys()):
+            if key not in self.schema['fields']:
+                v = next(row[key] for row in fields if key in row)
+                self.schema['fields'][key] = 'f8' if isinstance(v, (int, float)) else 'str'
+                self.fill_missing('f', key, self.schema['fields'][key], self.rows)
+        for key in set(k for row in tags for k in row.keys()):
+            if key not in self.schema['tags']:
+                self.schema['tags'].append(key)
+                self.fill_missing('t', key, 'str', self.rows)
+
+        for key, kind in self.schema['fields'].items():
+            self.append_column('f', key, kind, [row.get(key) for row in fields])
+        for key in self.schema['tags']:
+            self.append_column('t', key, 'str', [row.get(key) for row in tags])
+
+        # schema is written before time, so columns of the schema are never shorter than time
+        write_json(self.file('schema.json'), self.schema)
+        with open(self.file('blocks.i8'), 'ab') as f:
+            f.write(np.array([self.rows, count, timestamps[0], timestamps[-1]], dtype=np.int64).tobytes())
+        # time is written at last, rows are visible after all columns are written
+        with open(self.file('time.i8'), 'ab') as f:
+            f.write(timestamps.astype(np.int64).tobytes())
+        self.rows += count
+
+    def fill_missing(self, prefix: str, key: str, kind: str, rows: int):
+        self.append_column(prefix, key, kind, [None] * rows)
+
+    def append_column(self, prefix: str, key: str, kind: str, values: list):
+        if kind == 'f8':
+            data = np.array([float(v) if isinstance(v, (int, float)) else math.nan for v in values],
+                            dtype=np.float64)
+            with open(self.column_file(prefix, key, 'f8'), 'ab') as f:
+                f.write(data.tobytes())
+            return
+
+        categories_path = self.column_file(prefix, key, 'json')
+        categories = read_json(categories_path, [])
+        codes = {c: i for i, c in enumerate(categories)}
+        data = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            if v is None:
+                data[i] = -1
+                continue
+            v = str(v)
+            code = codes.get(v)
+            if code is None:
+                code = codes[v] = len(categories)
+                categories.append(v)
+            data[i] = code
+        with open(self.column_file(prefix, key, 'i4'), 'ab') as f:
+            f.write(data.tobytes())
+        write_json(categories_path, categories)
+
+    def equal(self, prefix: str, key: str, value, index: np.ndarray) -> np.ndarray:
+        """
+        mask of rows in `index` whose tag or field equals to `value`, missing values equal to nothing.
+        """
+        kind = 'str' if prefix == 't' else self.schema['fields'].get(key)
+        if kind == 'f8' and isinstance(value, (int, float)):
+            return read_array(self.column_file(prefix, key, 'f8'), np.float64)[index] == float(value)
+        if kind == 'str' and (prefix == 'f' or key in self.schema['tags']):
+            categories = read_json(self.column_file(prefix, key, 'json'), [])
+            if str(value) in categories:
+                codes = read_array(self.column_file(prefix, key, 'i4'), np.int32)
+                return codes[index] == categories.index(str(value))
+        return np.zeros(len(index), dtype=bool)
+
+    def select(self, fields: list, tags: dict, begin: int, end: int, conditions: list = ()):
+        """
+        :param conditions: (key, equal, value) of tags or fields parsed by `parse_filters`.
+        :return (timestamps, {field: values}) of rows in [begin, end) with the tags.
+        """
+        timestamps = read_array(self.file('time.i8'), np.int64)
+        blocks = read_array(self.file('blocks.i8'), np.int64).reshape(-1, 4)
+        rows = len(timestamps)
+        # sparse index: only blocks overlapped with the range are searched
+        ranges = []
+        for first, count, min_ts, max_ts in blocks:
+            if max_ts < begin or min_ts >= end or first + count > rows:
+                continue
+            b, e = np.searchsorted(timestamps[first:first + count], [begin, end])
+            if b < e:
+                ranges.append(np.arange(first + b, first + e))
+        if not ranges:
+            return None
+        index = np.concatenate(ranges)
+
+        for key, value in tags.items():
+            index = index[self.equal('t', key, value, index)]
+        for key, equal, value in conditions:
+            mask = self.equal('t' if key in self.schema['tags'] else 'f', key, value, index)
+            index = index[mask if equal else ~mask]
+        if not len(index):
+            return None
+
+        columns = {}
+        for key in fields:
+            kind = self.schema['fields'].get(key)
+            if kind == 'f8':
+                columns[key] = np.array(read_array(self.column_file('f', key, 'f8'), np.float64)[index])
+            elif kind == 'str':
+                categories = read_json(self.column_file('f', key, 'json'), [])
+                codes = np.array(read_array(self.column_file('f', key, 'i4'), np.int32)[index])
+                columns[key] = np.array(categories + [None], dtype=object)[codes]
+            else:
+                columns[key] = np.full(len(index), np.nan)
+        return np.array(timestamps[index]), columns
+
+
+class ColumnarTimeSeriesDatabase(TimeSeriesDatabase):
+    """
+    embedded time series database in `path`, measurements are partitioned by `partition` of time.
+
+    inserted points are buffered and written every `batch_size` points or by `finish`.
+    numbers (int, float and bool) are stored in float64, other values of fields are stored as strings.
+    """
+    def __init__(self, path: str, partition: timedelta = timedelta(days=1), batch_size: int = 10000):
+        self.path = path
+        self.partition = partition
+        self.batch_size = batch_size
+        self.batch_record = []
+        self.lock = threading.Lock()
+        self.partitions = {}
+
+    def connect(self):
+        os.makedirs(self.path, exist_ok=True)
+        return True
+
+    def disconnect(self):
+        self.finish()
+        self.partitions = {}
+
+    def insert(self, fields, table, tags, dt):
+        self.insert_batch([(fields, table, tags, dt)])
+
+    def insert_batch(self, records):
+        with self.lock:
+            self.batch_record.extend(records)
+            full = len(self.batch_record) >= self.batch_size
+        if full:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            batch, self.batch_record = self.batch_record, []
+            self.write(batch)
+
+    def table_path(self, table: str) -> str:
+        return os.path.join(self.path, quote(table, safe=''))
+
+    def partition_size(self, table: str) -> int:
+        """
+        partition size of a measurement in microseconds, fixed when the measurement is created.
+        """
+        meta_path = os.path.join(self.table_path(table), 'meta.json')
+        meta = read_json(meta_path, None)
+        if not meta:
+            os.makedirs(self.table_path(table), exist_ok=True)
+            meta = {'partition': self.partition // _US}
+            write_json(meta_path, meta)
+        return meta['partition']
+
+    def get_partition(self, table: str, idx: int) -> ColumnarPartition:
+        key = (table, idx)
+        if key not in self.partitions:
+            self.partitions[key] = ColumnarPartition(os.path.join(self.table_path(table), str(idx)))
+        return self.partitions[key]
+
+    def write(self, records: list):
+        groups = {}
+        for fields, table, tags, dt in records:
+            groups.setdefault(table, []).append(((dt - _EPOCH) // _US, fields, tags))
+        for table, rows in groups.items():
+            size = self.partition_size(table)
+            rows.sort(key=lambda r: r[0])
+            parts = {}
+            for r in rows:
+                parts.setdefault(r[0] // size, []).append(r)
+            for idx, part in parts.items():
+                self.get_partition(table, idx).append(
+                    np.array([r[0] for r in part], dtype=np.int64),
+                    [r[1] for r in part],
+                    [{k: v for k, v in r[2].items() if v is not None} for r in part]
+                )
+
+    def select_numpy(self, fields, table, tags, time_range, filters=''):
+        """
+        :param filters: equality (`=`) and inequality (`!=` or `<>`) conditions of tags or fields joined by
+            `and` in InfluxQL, e.g. `"name"='x' and v!=1`, ValueError is raised for other conditions.
+        :return columnar batch of fields sorted by time, None if nothing is found.
+        """
+        conditions = parse_filters(filters) if filters else []
+        if not os.path.isdir(self.table_path(table)):
+            return None
+        self.finish()
+
+        size = self.partition_size(table)
+        begin = (time_range.begin - _EPOCH) // _US if time_range and time_range.begin else -2 ** 63
+        end = (time_range.end - _EPOCH) // _US if time_range and time_range.end else 2 ** 63 - 1
+        fields = [fields, ] if type(fields) == str else list(fields)
+
+        results = []
+        for name in os.listdir(self.table_path(table)):
+            if not name.lstrip('-').isdigit():
+                continue
+            idx = int(name)
+            if (idx + 1) * size <= begin or idx * size >= end:
+                continue
+            partition = self.get_partition(table, idx)
+            keys = list(partition.schema['fields'].keys()) if fields == ['*'] else fields
+            r = partition.select(keys, tags, begin, end, conditions)
+            if r:
+                results.append(ColumnarBatch(table, r[0], r[1], []))
+        batch = ColumnarBatch.concat(results)
+        if batch is None:
+            return None
+
+        order = np.argsort(batch.timestamps, kind='stable')
+        return ColumnarBatch(table, batch.timestamps[order], {k: v[order] for k, v in batch.columns.items()}, [])
+
+    def select(self, fields, table, tags, time_range, filters=''):
+        """
+        rows in dict with time in RFC3339 like InfluxDB.
+        """
+        return columnar_to_points(self.select_numpy(fields, table, tags, time_range, filters))
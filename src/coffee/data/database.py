@@ -4,9 +4,46 @@
 """正如历史总是要进入教科书，数据也是需要'永久'保存。"""
 
 
-from influxdb import InfluxDBClient
-from datetime import timedelta
-from coffee.core.settings import DEF_CFG
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from coffee.core import settings
+from coffee.data.dbwriter import BackgroundBatchWriter, BulkLineWriter
+from coffee.data.lineprotocol import encode_line, encode_timestamp, LOCAL_UTC_OFFSET, PRECISIONS
+
+
+class TimeRange:
+    """
+    time range of [begin, end), an empty side is not limited.
+    datetimes without timezone are local time of UTC+8, the same as inserting.
+    """
+    def __init__(self, begin: datetime = None, end: datetime = None):
+        self.begin = begin
+        self.end = end
+
+    def get_selector(self) -> str:
+        """
+        InfluxQL condition of time, empty string if not limited.
+        """
+        conditions = []
+        if self.begin:
+            conditions.append(f'time >= {encode_timestamp(self.begin, "u") * 1000}')
+        if self.end:
+            conditions.append(f'time < {encode_timestamp(self.end, "u") * 1000}')
+        return ' and '.join(conditions)
+
+
+def columnar_to_points(batch):
+    """
+    rows of a columnar batch in dict like InfluxDB results, time is in RFC3339 of UTC.
+    """
+    import numpy as np
+    if batch is None or not len(batch):
+        return iter([])
+    times = np.datetime_as_string(batch.datetimes() - np.timedelta64(LOCAL_UTC_OFFSET), unit='us')
+    columns = {k: batch.column(k).tolist() for k in batch.columns.keys()}
+    return ({'time': t + 'Z', **{k: v[i] for k, v in columns.items()}} for i, t in enumerate(times))
 
 
 class TimeSeriesDatabase:
@@ -28,12 +65,33 @@ class TimeSeriesDatabase:
         """
         pass
 
+    def insert_batch(self, records):
+        """
+        insert a batch of data to DB
+
+        :param records: list of (fields, table, tags, dt)
+        """
+        for fields, table, tags, dt in records:
+            self.insert(fields, table, tags, dt)
+
     def select(self, fields, table, tags, time_range, filters=''):
         """
         fetch data from DB
         """
         pass
 
+    def select_many(self, selects, statements=20, parallel=1):
+        """
+        fetch data of many selects, one by one by default
+
+        :param selects: list of arguments of `select`
+        """
+        results = []
+        for s in selects:
+            pts = self.select(*s)
+            results.append(list(pts) if pts is not None else None)
+        return results
+
     def finish(self):
         """
         force update immediately
@@ -42,81 +100,272 @@ class TimeSeriesDatabase:
 
 
 class InfluxDBV1(TimeSeriesDatabase):
+    """
+    InfluxDB 1.x database.
+
+    with `async_write`, full batches are written by `write_threads` background threads through a queue
+    of `queue_size` batches, inserting blocks when the queue is full. pending records are also written
+    when no batch comes in `flush_interval` seconds, and `finish` waits until all batches are written.
+
+    points are encoded to line protocol with integer timestamps of `precision` ('h', 'm', 's', 'ms' or 'u'),
+    and request bodies are compressed by gzip if `gzip` is set.
+
+    with `bulk_import`, batches are written by `connections` keep-alive HTTP sessions in parallel for
+    backfilling, see `BulkLineWriter`, batches begin with `bulk_batch_size` lines and failed ones are retried
+    after `bulk_retry_delay` seconds. pending lines are written by `finish`.
+    """
     def __init__(self,
                  host='localhost',
                  port=8086,
                  username='root',
                  password='root',
-                 database=None):
+                 database=None,
+                 async_write=False,
+                 write_threads=1,
+                 queue_size=8,
+                 flush_interval=1.0,
+                 precision='u',
+                 gzip=True,
+                 bulk_import=False,
+                 connections=4,
+                 bulk_batch_size=1000,
+                 bulk_retry_delay=0.5):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.database = database
+        self.precision = precision
+        self.gzip = gzip
 
         self.batch_size = 1000
         self.batch_record = []
+        self.lock = threading.Lock()
+
+        self.async_write = async_write
+        self.write_threads = write_threads
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.bulk_import = bulk_import
+        self.connections = connections
+        self.bulk_batch_size = bulk_batch_size
+        self.bulk_retry_delay = bulk_retry_delay
+        self.writer = None
 
         self.client = None
 
     def connect(self):
         if self.client:
             return True
+        from influxdb import InfluxDBClient
         self.client = InfluxDBClient(
             host=self.host,
             port=self.port,
             username=self.username,
             password=self.password,
-            database=self.database
+            database=self.database,
+            gzip=self.gzip
         )
+        if self.bulk_import and not self.writer:
+            self.writer = BulkLineWriter(f'http://{self.host}:{self.port}',
+                                         {'db': self.database, 'precision': self.precision},
+                                         self.connections, self.queue_size, (self.username, self.password),
+                                         self.gzip, min_batch=self.bulk_batch_size,
+                                         retry_delay=self.bulk_retry_delay)
+        elif self.async_write and not self.writer:
+            self.writer = BackgroundBatchWriter(self.write_batch, self.write_threads, self.queue_size,
+                                                self.flush_interval, self.take_batch)
         return True if self.client else False
 
     def disconnect(self):
         self.finish()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
         self.client = None
 
     def insert(self, fields, table, tags, dt):
         """
         fields and tags should be key-value pair
         """
-        pt = {
-            "measurement": table,
-            "time": dt + timedelta(hours=-8),
-            "tags": tags,
-            "fields": fields
-        }
-        self.batch_record.append(pt)
+        line = encode_line(table, tags, fields, dt, self.precision)
+        if line:
+            self.insert_lines([line])
 
-        if len(self.batch_record) > self.batch_size:
-            self.finish()
+    def insert_batch(self, records):
+        self.insert_lines([
+            encode_line(table, tags, fields, dt, self.precision) for fields, table, tags, dt in records
+        ])
 
-    def select(self, fields, table, tags, time_range, filters=''):
-        if not self.client:
-            return None
+    def insert_lines(self, lines):
+        """
+        insert points encoded in line protocol with timestamps of `precision`.
+        """
+        with self.lock:
+            self.batch_record.extend(line for line in lines if line)
+            full = len(self.batch_record) > self.batch_size
 
+        if full:
+            self.flush()
+
+    @staticmethod
+    def make_query(fields, table, tags, time_range, filters=''):
         if type(fields) == str:
             fields = [fields, ]
         if not fields:
             return None
 
-        tags_str = ' and '.join(['='.join([k, "'"+str(v)+"'"]) for k, v in tags.items()])
-        time_range = time_range.get_selector()
-        pts = self.client.query(
-            "select {} from {} where source='{}' {} {}".format(
-                ','.join(fields), table, tags_str,
-                '' if not time_range else ' and ' + time_range,
-                ' and ' + filters if filters else ''
-            )
-        ).get_points()
+        conditions = ["{}='{}'".format(k, str(v).replace("'", "\\'")) for k, v in tags.items()]
+        time_range = time_range.get_selector() if time_range else ''
+        if time_range:
+            conditions.append(time_range)
+        if filters:
+            conditions.append(filters)
+        return 'select {} from {}{}'.format(
+            ','.join(fields), table, ' where ' + ' and '.join(conditions) if conditions else ''
+        )
+
+    def select(self, fields, table, tags, time_range, filters=''):
+        if not self.client:
+            return None
+
+        query = self.make_query(fields, table, tags, time_range, filters)
+        if not query:
+            return None
+        pts = self.client.query(query).get_points()
         return pts
 
+    def select_many(self, selects, statements=20, parallel=1):
+        """
+        run many selects in few requests, up to `statements` selects are sent in a request separated by ';',
+        and requests are sent by `parallel` threads.
+
+        :param selects: list of (fields, table, tags, time_range) or (fields, table, tags, time_range, filters).
+        :return points of each select in the same order, None for an invalid select.
+        """
+        if not self.client:
+            return None
+
+        queries = [self.make_query(*s) for s in selects]
+        valid = [i for i, q in enumerate(queries) if q]
+        batches = [valid[i:i + statements] for i in range(0, len(valid), statements)]
+
+        def query(batch):
+            results = self.client.query(';'.join(queries[i] for i in batch))
+            if not isinstance(results, list):
+                results = [results]
+            results = sorted(results, key=lambda r: r.raw.get('statement_id', 0))
+            return [list(r.get_points()) for r in results]
+
+        if parallel > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                batch_results = list(executor.map(query, batches))
+        else:
+            batch_results = [query(batch) for batch in batches]
+
+        points = [None] * len(selects)
+        for batch, results in zip(batches, batch_results):
+            for i, pts in zip(batch, results):
+                points[i] = pts
+        return points
+
+    def select_chunks(self, fields, table, tags, time_range, filters='', chunk_size=10000):
+        """
+        query in chunked mode, yield a columnar batch for each chunk as the response streams in.
+
+        times are int64 microseconds of local time (UTC+8) like `ColumnarBatch`, numbers are in numpy
+        arrays (missing values are NaN) and strings in object arrays, no dict is made for rows.
+        """
+        import requests
+        query = self.make_query(fields, table, tags, time_range, filters)
+        if not query:
+            return
+        params = {'q': query, 'db': self.database, 'epoch': 'u', 'chunked': 'true', 'chunk_size': chunk_size}
+        with requests.get(f'http://{self.host}:{self.port}/query', params=params,
+                          auth=(self.username, self.password), stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(chunk_size=64 * 1024):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                for result in chunk.get('results', []):
+                    if 'error' in result:
+                        raise RuntimeError(result['error'])
+                    for series in result.get('series', []):
+                        if series.get('values'):
+                            yield self.make_columnar(series)
+
+    @staticmethod
+    def make_columnar(series: dict):
+        import numpy as np
+        from coffee.data.columnar import ColumnarBatch
+        keys = series['columns']
+        columns = list(zip(*series['values']))
+        time_idx = keys.index('time')
+        timestamps = np.array(columns[time_idx], dtype=np.int64) + LOCAL_UTC_OFFSET // PRECISIONS['u']
+        data = {}
+        for idx, key in enumerate(keys):
+            if idx == time_idx:
+                continue
+            values = np.array(columns[idx])
+            if values.dtype.kind == 'O':
+                # numbers with None
+                try:
+                    values = np.array(columns[idx], dtype=np.float64)
+                except (TypeError, ValueError):
+                    pass
+            elif values.dtype.kind not in 'biuf':
+                values = np.array(columns[idx], dtype=object)
+            data[key] = values
+        return ColumnarBatch(series['name'], timestamps, data, [])
+
+    def select_numpy(self, fields, table, tags, time_range, filters='', chunk_size=10000):
+        """
+        query in chunked mode and concatenate chunks into a columnar batch, None if nothing is found.
+        """
+        from coffee.data.columnar import ColumnarBatch
+        return ColumnarBatch.concat(list(self.select_chunks(fields, table, tags, time_range, filters, chunk_size)))
+
+    def take_batch(self):
+        """
+        take all pending records.
+        """
+        with self.lock:
+            batch, self.batch_record = self.batch_record, []
+        return batch
+
+    def write_batch(self, batch):
+        if self.client:
+            self.client.write_points(batch, time_precision=self.precision, batch_size=self.batch_size,
+                                     protocol='line')
+
+    def flush(self):
+        """
+        write pending records, or hand them over to the background writer.
+        """
+        batch = self.take_batch()
+        if not batch:
+            return
+        if self.writer:
+            self.writer.put(batch)
+        else:
+            self.write_batch(batch)
+
     def finish(self):
-        if len(self.batch_record) > 0:
-            if self.client:
-                self.client.write_points(self.batch_record, batch_size=self.batch_size)
-            self.batch_record = []
+        self.flush()
+        if self.writer:
+            self.writer.join()
 
 
-DEF_TSDB = InfluxDBV1(DEF_CFG.influxdb_host, DEF_CFG.influxdb_port, DEF_CFG.influxdb_username, DEF_CFG.influxdb_password,
-                      DEF_CFG.influxdb_database)
-DEF_TSDB.connect()
+def __getattr__(name):
+    # DEF_TSDB is created on first use
+    if name == 'DEF_TSDB':
+        cfg = settings.DEF_CFG
+        db = InfluxDBV1(cfg.influxdb_host, cfg.influxdb_port, cfg.influxdb_username, cfg.influxdb_password,
+                        cfg.influxdb_database)
+        db.connect()
+        globals()[name] = db
+        return db
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
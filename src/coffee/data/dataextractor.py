@@ -1,9 +1,15 @@
 # Copyright 2022 tkorays. All Rights Reserved.
 # Licensed to MIT under a Contributor Agreement.
 
+import functools
+import hashlib
 import re
 import types
 import yaml
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 
 class PatternInterface:
@@ -41,6 +47,98 @@ class PatternInterface:
         """
         pass
 
+    def get_fingerprint(self):
+        """
+        hash of everything deciding the extracted data, None if results of this pattern can't be cached.
+        """
+        return None
+
+
+class UnstableStateError(ValueError):
+    pass
+
+
+def code_names(code) -> set:
+    """
+    global and attribute names used by the code and the code nested in it.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return names
+
+
+def stable_state(obj):
+    """
+    state of a converter or processor which decides its results and is the same across runs.
+    functions are identified by bytecode, constants, names, defaults, closure values and values of the module
+    globals they use, classes by methods, and other objects by class and attributes or their own repr.
+
+    :raise UnstableStateError if the state can't be known, e.g. an object only has the default repr.
+    """
+    # functions and classes being walked, they are only named when they're met again (e.g. by recursion)
+    walking = set()
+
+    def walk(obj, depth: int):
+        if depth > 32:
+            raise UnstableStateError(f'{type(obj).__name__} is nested too deep')
+        depth += 1
+        if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+            return obj
+        if isinstance(obj, (list, tuple)):
+            return type(obj).__name__, [walk(v, depth) for v in obj]
+        if isinstance(obj, (set, frozenset)):
+            return type(obj).__name__, sorted(repr(walk(v, depth)) for v in obj)
+        if isinstance(obj, dict):
+            return 'dict', sorted(((repr(walk(k, depth)), walk(v, depth)) for k, v in obj.items()),
+                                  key=lambda item: item[0])
+        if isinstance(obj, types.CodeType):
+            return 'code', obj.co_code, walk(obj.co_consts, depth), obj.co_names
+        if isinstance(obj, (types.FunctionType, type)) and id(obj) in walking:
+            return 'ref', obj.__module__, obj.__qualname__
+        if isinstance(obj, types.FunctionType):
+            try:
+                closure = [cell.cell_contents for cell in obj.__closure__ or ()]
+            except ValueError:
+                raise UnstableStateError(f'{obj.__qualname__} has an empty closure cell')
+            used = {name: obj.__globals__[name] for name in code_names(obj.__code__) if name in obj.__globals__}
+            walking.add(id(obj))
+            try:
+                return ('function', obj.__module__, obj.__qualname__, walk(obj.__code__, depth),
+                        walk(obj.__defaults__, depth), walk(obj.__kwdefaults__, depth), walk(closure, depth),
+                        walk(used, depth))
+            finally:
+                walking.discard(id(obj))
+        if isinstance(obj, types.MethodType):
+            return 'method', walk(obj.__func__, depth), walk(obj.__self__, depth)
+        if isinstance(obj, functools.partial):
+            return 'partial', walk(obj.func, depth), walk(obj.args, depth), walk(obj.keywords, depth)
+        if isinstance(obj, types.ModuleType):
+            return 'module', obj.__name__
+        if isinstance(obj, type):
+            methods = {k: getattr(v, '__func__', v) for k, v in vars(obj).items()
+                       if isinstance(v, (types.FunctionType, staticmethod, classmethod))}
+            walking.add(id(obj))
+            try:
+                return ('class', obj.__module__, obj.__qualname__, walk(methods, depth),
+                        [walk(base, depth) for base in obj.__bases__ if base is not object])
+            finally:
+                walking.discard(id(obj))
+        if isinstance(obj, (types.BuiltinFunctionType, types.MethodDescriptorType, types.WrapperDescriptorType,
+                            types.MethodWrapperType, types.ClassMethodDescriptorType)):
+            owner = getattr(obj, '__self__', None)
+            if isinstance(owner, types.ModuleType):
+                owner = None
+            return 'builtin', getattr(obj, '__module__', None), obj.__qualname__, walk(owner, depth)
+        if hasattr(obj, '__dict__'):
+            return 'object', walk(type(obj), depth), walk(vars(obj), depth)
+        if type(obj).__repr__ is not object.__repr__:
+            return 'object', walk(type(obj), depth), repr(obj)
+        raise UnstableStateError(f'{type(obj).__name__} has no stable state')
+
+    return walk(obj, 0)
+
 
 class PatternGroup:
     """
@@ -65,6 +163,12 @@ class PatternGroup:
         for p in self.patterns:
             p.run_tests()
 
+    def compile(self):
+        """
+        compile this group to a multi-pattern matcher, patterns added later are not included.
+        """
+        return CompiledPatternGroup(self)
+
 
 class RegexPattern(PatternInterface, yaml.YAMLObject):
     def __init__(self, name, pattern, fields, tags=[], version='', processors=[], exclude_report=[], tests=[]):
@@ -74,6 +178,8 @@ class RegexPattern(PatternInterface, yaml.YAMLObject):
         self.tags = tags
         self.processors = processors
         self.regex = None
+        self.bytes_regex = None
+        self.bytes_compatible = None
         self.fields = fields
         self.exclude_report = exclude_report
         self.tests = tests
@@ -88,6 +194,18 @@ class RegexPattern(PatternInterface, yaml.YAMLObject):
     def get_unique_id(self):
         return self.name + (('@' + str(self.version)) if self.version else '')
 
+    def get_fingerprint(self):
+        try:
+            items = (
+                type(self).__name__, self.name, self.version, self.pattern,
+                stable_state(list(self.fields.items())),
+                [tuple(t) for t in self.tags],
+                stable_state(self.processors),
+            )
+        except UnstableStateError:
+            return None
+        return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
     def get_name(self):
         return self.name
     
@@ -100,12 +218,56 @@ class RegexPattern(PatternInterface, yaml.YAMLObject):
     def get_match_count(self):
         return self.match_count
 
-    def match(self, s):
+    def get_regex(self):
         self.regex = re.compile(self.pattern) if not self.regex else self.regex
-        if not self.regex:
+        return self.regex
+
+    def match(self, s):
+        if not self.get_regex():
+            return {}
+
+        return self.extract(self.regex.findall(s))
+
+    def get_bytes_regex(self):
+        """
+        compiled bytes regex of this pattern, it is in multiline mode, so it can be applied to
+        a line inside a large buffer by `pos` and `endpos`.
+        """
+        if not self.bytes_regex:
+            self.bytes_regex = re.compile(self.pattern.encode('utf-8'), re.MULTILINE)
+        return self.bytes_regex
+
+    def is_bytes_compatible(self):
+        """
+        whether the bytes regex matches the same as the str one, see `bytes_compatible`.
+        """
+        if getattr(self, 'bytes_compatible', None) is None:
+            self.bytes_compatible = bytes_compatible(self.pattern)
+        return self.bytes_compatible
+
+    def match_bytes(self, b, pos=0, endpos=None):
+        """
+        do extracting on bytes, only the captured fields are decoded.
+        patterns not compatible with bytes are matched on the decoded string.
+        """
+        endpos = len(b) if endpos is None else endpos
+        if not self.is_bytes_compatible():
+            return self.match(b[pos:endpos].decode('utf-8', errors='ignore'))
+        regex = self.get_bytes_regex()
+        result = regex.findall(b, pos, endpos)
+        if not result:
             return {}
 
-        result = self.regex.findall(s)
+        if isinstance(result[0], type(())):
+            result = [tuple(r.decode('utf-8', errors='ignore') for r in result[0])]
+        else:
+            result = [r.decode('utf-8', errors='ignore') for r in result]
+        return self.extract(result)
+
+    def extract(self, result):
+        """
+        convert the `findall` result to a key-value dict by fields.
+        """
         if not result:
             return {}
 
@@ -189,6 +351,146 @@ class SplitPattern(PatternInterface):
         return result
 
 
+def required_literals(pattern: str) -> list:
+    """
+    literal strings which must appear in every string matched by the regex.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    state = parsed.state if hasattr(parsed, 'state') else parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return []
+
+    def walk(items):
+        literals = []
+        current = ''
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current += chr(av)
+                continue
+            if current:
+                literals.append(current)
+                current = ''
+            if op is sre_parse.SUBPATTERN:
+                # av: group, add_flags, del_flags, pattern
+                if not av[1] & re.IGNORECASE:
+                    literals.extend(walk(av[-1]))
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                literals.extend(walk(av[2]))
+        if current:
+            literals.append(current)
+        return literals
+
+    return walk(parsed)
+
+
+def bytes_compatible(pattern: str) -> bool:
+    """
+    whether the regex matches bytes of utf-8 the same as str, classes like \\w, \\d, \\s and \\b and
+    case-insensitive matching only know ascii in bytes regexes.
+    """
+    if not pattern.isascii():
+        return False
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return False
+    state = parsed.state if hasattr(parsed, 'state') else parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return False
+
+    unicode_ops = (sre_parse.CATEGORY, sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY)
+
+    def sensitive(node):
+        if isinstance(node, sre_parse.SubPattern):
+            node = node.data
+        if isinstance(node, tuple) and len(node) == 2 and node[0] is sre_parse.SUBPATTERN:
+            # av: group, add_flags, del_flags, pattern
+            if node[1][1] & re.IGNORECASE:
+                return True
+        if isinstance(node, (list, tuple)):
+            return any(sensitive(n) for n in node)
+        return any(node is op for op in unicode_ops)
+
+    return not sensitive(parsed)
+
+
+def literal_trie_regex(literals: list) -> str:
+    """
+    build a regex matching any of the literals, literals are merged in a trie to reduce the backtracking.
+    """
+    trie = {}
+    for lit in literals:
+        node = trie
+        for c in lit:
+            node = node.setdefault(c, {})
+        # a longer literal contains this one, it's needless to go deeper
+        node.clear()
+        node[''] = True
+
+    def build(node):
+        if '' in node:
+            return ''
+        alternatives = [re.escape(c) + build(node[c]) for c in sorted(node.keys())]
+        return alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+
+    return build(trie) if literals else ''
+
+
+class CompiledPatternGroup:
+    """
+    match all patterns of a group at once.
+
+    every regex pattern is guarded by the longest literal it requires, lines without any literal are rejected
+    by a single search, and only the candidate patterns are matched.
+    """
+    def __init__(self, group: PatternGroup):
+        self.group = group
+        self.patterns = list(group.get_patterns())
+        self.ts_patterns = list(group.get_ts_patterns())
+        # literal of every pattern, patterns without literal should always be matched
+        self.literals = []
+        self.always = []
+        for idx, p in enumerate(self.patterns):
+            literals = required_literals(p.pattern) if isinstance(p, RegexPattern) else []
+            literal = max(literals, key=len) if literals else ''
+            self.literals.append(literal)
+            if not literal:
+                self.always.append(idx)
+
+        trie = literal_trie_regex([lit for lit in self.literals if lit])
+        self.literal_regex = re.compile(trie) if trie else None
+        self.literal_bytes_regex = re.compile(trie.encode('utf-8')) if trie else None
+        self.bytes_literals = [lit.encode('utf-8') for lit in self.literals]
+
+    def candidates(self, line: str) -> list:
+        """
+        indexes of patterns which may match this line.
+        """
+        if not self.literal_regex or not self.literal_regex.search(line):
+            return self.always
+        return [idx for idx, lit in enumerate(self.literals) if not lit or lit in line]
+
+    def candidates_bytes(self, line: bytes) -> list:
+        """
+        indexes of regex patterns, which may match this line, except the patterns without literal.
+        """
+        return [idx for idx, lit in enumerate(self.bytes_literals) if lit and lit in line]
+
+    def match(self, line: str) -> list:
+        """
+        :return list of (pattern index, value).
+        """
+        result = []
+        for idx in self.candidates(line):
+            r = self.patterns[idx].match(line)
+            if r:
+                result.append((idx, r))
+        return result
+
+
 class PatternGroupBuilder:
     """
     build a pattern group
@@ -43,6 +43,15 @@ class DataSink(metaclass=abc.ABCMeta):
         """
         pass
 
+    def on_batch(self, datapoints: list) -> list:
+        """
+        Input a batch of source data to sink. Fall back to `on_data` one by one,
+        sinks can override it to process the batch at once.
+
+        :param datapoints: list of data
+        """
+        return [self.on_data(dp) for dp in datapoints]
+
     @abc.abstractmethod
     def finish(self, datapoint: DataPoint) -> DataPoint:
         """
@@ -74,9 +83,12 @@ class DataSource(metaclass=abc.ABCMeta):
 class DataLoader(DataSource, DataSink, ABC):
     """
     Load data from some source, and feed datapoints to all sinks.
+    Datapoints are delivered in batches of `batch_size` if it's larger than 1.
     """
-    def __init__(self):
+    def __init__(self, batch_size: int = 1):
         self.sinks = []
+        self.batch_size = batch_size
+        self.batch = []
 
     def add_sink(self, sink: DataSink):
         self.sinks.append(sink)
@@ -85,12 +97,38 @@ class DataLoader(DataSource, DataSink, ABC):
     def start(self):
         pass
 
+    def feed(self, datapoint: DataPoint):
+        """
+        Feed a datapoint to all sinks, it will be delivered when the batch is full.
+        """
+        if self.batch_size <= 1:
+            self.on_data(datapoint)
+            return
+        self.batch.append(datapoint)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Deliver the pending batch to all sinks.
+        """
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.on_batch(batch)
+
     def on_data(self, datapoint: DataPoint) -> DataPoint:
         for s in self.sinks:
             datapoint = s.on_data(datapoint)
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        for s in self.sinks:
+            datapoints = s.on_batch(datapoints)
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
+        self.flush()
         for s in self.sinks:
             datapoint = s.finish(datapoint)
         return datapoint
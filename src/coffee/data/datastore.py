@@ -2,11 +2,45 @@
 # Licensed to MIT under a Contributor Agreement.
 
 import abc
+import contextlib
+import hashlib
 import os
 import pickle
-import h5py
-import numpy as np
-from coffee.core.settings import DEF_CFG
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from coffee.core import settings
+
+
+def data_size(data, seen: set = None) -> int:
+    """
+    approximate memory size of data without copying it, arrays, columnar batches and data frames are
+    measured by their buffers, containers and objects by their items and attributes.
+    """
+    seen = set() if seen is None else seen
+    if id(data) in seen:
+        return 0
+    seen.add(id(data))
+    nbytes = getattr(data, 'nbytes', None)
+    if nbytes is not None and not isinstance(data, type):
+        return int(nbytes() if callable(nbytes) else nbytes)
+    memory_usage = getattr(data, 'memory_usage', None)
+    if callable(memory_usage) and not isinstance(data, type):
+        # pandas objects
+        usage = memory_usage(index=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    size = sys.getsizeof(data)
+    if isinstance(data, dict):
+        size += sum(data_size(k, seen) + data_size(v, seen) for k, v in data.items())
+    elif isinstance(data, (list, tuple, set, frozenset)):
+        size += sum(data_size(v, seen) for v in data)
+    elif hasattr(data, '__dict__') and not isinstance(data, type):
+        size += data_size(vars(data), seen)
+    return size
 
 
 class DataStorable(metaclass=abc.ABCMeta):
@@ -78,13 +112,65 @@ class DataStore(metaclass=abc.ABCMeta):
         """
         pass
 
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        """
+        check many data of a type.
+
+        :return True or False for each cache id.
+        """
+        return [self.exist(type_id, cache_id) for cache_id in cache_ids]
+
+    def add_many(self, type_id: str, items: dict):
+        """
+        add many data of a type, existing data are not changed.
+
+        :param items: cache id => data.
+        :return True if all data have been added.
+        """
+        return all([self.add(type_id, cache_id, data) for cache_id, data in items.items()])
+
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        """
+        fetch many data of a type.
+
+        :return data for each cache id, None if not found.
+        """
+        return [self.fetch(type_id, cache_id) for cache_id in cache_ids]
+
+    def remove(self, type_id: str, cache_id: str):
+        """
+        remove data if it exists, stores which can't remove data raise NotImplementedError.
+
+        :param type_id: the data type id, the same type data has the same structure.
+        :param cache_id: data id identified by some fields.
+        :return True if the data doesn't exist anymore.
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support removing data')
+
 
 class FileSystemDataStore(DataStore):
     """
-    store data in the filesystem.
+    store data in the filesystem, a file for each data.
+    batch operations read and write files by `threads` threads.
+
+    with `compress` or `dedup`, data are pickled by protocol 5 (if supported) with large buffers (e.g. numpy
+    arrays) out of band, and the pickle and buffers are cut into chunks of `chunk_size`. chunks are compressed
+    by zlib with `compress`, and with `dedup` they are kept once in `.objects` by content hash and data files
+    only keep the hashes, `collect_garbage` removes chunks no longer used. data files of plain pickles are
+    always readable.
     """
-    def __init__(self, path):
+    MAGIC = b'COFFEE-DS1\n'
+    PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+    def __init__(self, path, threads: int = 8, compress: bool = False, dedup: bool = False,
+                 chunk_size: int = 4 * 1024 * 1024, compress_level: int = 6):
         self.path = path
+        self.threads = threads
+        self.compress = compress
+        self.dedup = dedup
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.objects_path = os.path.join(self.path, '.objects')
         if not os.path.exists(self.path):
             os.mkdir(self.path)
         if not os.path.exists(self.path):
@@ -105,8 +191,7 @@ class FileSystemDataStore(DataStore):
         if not os.path.exists(os.path.join(self.path, type_id)):
             return False
 
-        with open(os.path.join(self.path, type_id, cache_id), 'wb') as f:
-            pickle.dump(data, f)
+        self.dump(os.path.join(self.path, type_id, cache_id), data)
         return True
 
     def update(self, type_id: str, cache_id: str, data):
@@ -115,8 +200,7 @@ class FileSystemDataStore(DataStore):
         if not os.path.exists(os.path.join(self.path, type_id)):
             return False
 
-        with open(os.path.join(self.path, type_id, cache_id), 'wb') as f:
-            pickle.dump(data, f)
+        self.dump(os.path.join(self.path, type_id, cache_id), data)
         return True
 
     def update_or_add(self, type_id: str, cache_id: str, data):
@@ -129,66 +213,1072 @@ class FileSystemDataStore(DataStore):
         if not os.path.exists(os.path.join(self.path, type_id, cache_id)):
             return None
 
-        data = None
-        with open(os.path.join(self.path, type_id, cache_id), 'rb') as f:
-            data = pickle.load(f)
-        return data
+        return self.load(os.path.join(self.path, type_id, cache_id))
+
+    def dump(self, path: str, data):
+        if not self.compress and not self.dedup:
+            with open(path, 'wb') as f:
+                pickle.dump(data, f)
+            return
+
+        buffers = []
+        if self.PROTOCOL >= 5:
+            payload = pickle.dumps(data, protocol=self.PROTOCOL, buffer_callback=buffers.append)
+        else:
+            # no out-of-band buffers before python 3.8
+            payload = pickle.dumps(data, protocol=self.PROTOCOL)
+        parts = [self.dump_chunks(memoryview(payload))]
+        parts += [self.dump_chunks(b.raw()) for b in buffers]
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            pickle.dump(parts, f, protocol=self.PROTOCOL)
+
+    def dump_chunks(self, data: memoryview) -> list:
+        """
+        :return list of (compressed, content hash) with `dedup`, or (compressed, chunk) of data.
+        """
+        chunks = []
+        for pos in range(0, len(data), self.chunk_size):
+            chunk = data[pos:pos + self.chunk_size]
+            content = zlib.compress(chunk, self.compress_level) if self.compress else bytes(chunk)
+            if not self.dedup:
+                chunks.append((self.compress, content))
+                continue
+            digest = hashlib.sha256(chunk).hexdigest()
+            path = self.object_path(digest)
+            try:
+                # touched, so it's kept by `collect_garbage` until the data file is written
+                os.utime(path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f'{path}.{threading.get_ident()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp, path)
+            chunks.append((self.compress, digest))
+        return chunks
+
+    def load(self, path: str):
+        with open(path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                f.seek(0)
+                return pickle.load(f)
+            parts = pickle.load(f)
+
+        payloads = []
+        for chunks in parts:
+            payload = bytearray()
+            for compressed, content in chunks:
+                if isinstance(content, str):
+                    with open(self.object_path(content), 'rb') as f:
+                        content = f.read()
+                payload += zlib.decompress(content) if compressed else content
+            payloads.append(payload)
+        if len(payloads) == 1:
+            return pickle.loads(payloads[0])
+        return pickle.loads(payloads[0], buffers=payloads[1:])
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], digest[2:])
+
+    def collect_garbage(self, grace: float = 60.0) -> int:
+        """
+        remove chunks not used by any data.
+        chunks written or reused in `grace` seconds before the sweep and temporary files are kept, since they
+        may belong to data being dumped concurrently. unreadable data files (e.g. being written) are skipped.
+
+        :return number of removed chunks.
+        """
+        begin = time.time()
+        used = set()
+        for type_id in os.listdir(self.path):
+            if type_id == '.objects' or not os.path.isdir(os.path.join(self.path, type_id)):
+                continue
+            for cache_id in os.listdir(os.path.join(self.path, type_id)):
+                try:
+                    with open(os.path.join(self.path, type_id, cache_id), 'rb') as f:
+                        if f.read(len(self.MAGIC)) != self.MAGIC:
+                            continue
+                        parts = pickle.load(f)
+                    used.update(content for chunks in parts for _, content in chunks if isinstance(content, str))
+                except Exception:
+                    continue
+
+        removed = 0
+        if not os.path.isdir(self.objects_path):
+            return removed
+        for prefix in os.listdir(self.objects_path):
+            for name in os.listdir(os.path.join(self.objects_path, prefix)):
+                path = os.path.join(self.objects_path, prefix, name)
+                if name.endswith('.tmp') or prefix + name in used:
+                    continue
+                try:
+                    if os.path.getmtime(path) >= begin - grace:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+        return removed
+
+    def remove(self, type_id: str, cache_id: str):
+        try:
+            os.remove(os.path.join(self.path, type_id, cache_id))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def list_ids(self, type_id: str) -> set:
+        try:
+            return set(os.listdir(os.path.join(self.path, type_id)))
+        except FileNotFoundError:
+            return set()
+
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        # a directory listing instead of a stat for each
+        ids = self.list_ids(type_id)
+        return [cache_id in ids for cache_id in cache_ids]
+
+    def add_many(self, type_id: str, items: dict):
+        os.makedirs(os.path.join(self.path, type_id), exist_ok=True)
+        ids = self.list_ids(type_id)
+
+        def write(item):
+            self.dump(os.path.join(self.path, type_id, item[0]), item[1])
+            return True
+
+        new_items = [item for item in items.items() if item[0] not in ids]
+        return all(self.map(write, new_items))
+
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        def read(cache_id):
+            try:
+                return self.load(os.path.join(self.path, type_id, cache_id))
+            except FileNotFoundError:
+                return None
+
+        return self.map(read, cache_ids)
+
+    def map(self, func, items: list) -> list:
+        if self.threads <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.threads, len(items))) as executor:
+            return list(executor.map(func, items))
 
 
 class HDF5DataStore(DataStore):
-    # how to store VLEN bytes in HDF5
-    # https://docs.h5py.org/en/latest/special.html?highlight=VLEN#h5py.vlen_dtype
+    """
+    store data in a HDF5 file, each type is a group and each data is a dataset or a group in it:
+    * numpy arrays are chunked datasets compressed by `compression`, or contiguous datasets without compression.
+      fetched arrays are copies owned by the caller, they are not changed by later writes.
+    * columnar batches are groups of column datasets.
+    * other data are pickled into bytes datasets.
+
+    arrays and columnar batches can be read partially by `fetch_slice`.
+    files of old versions keep data pickled in attributes of a dataset for each type, they are still readable
+    and moved to the new layout when the type is written.
+    """
 
-    def __init__(self, path):
+    def __init__(self, path, compression: str = 'gzip', compression_opts=4):
         self.path = path
-        self.hdf5 = h5py.File(self.path, "a")
-        # root has a data set named type_id
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.hdf5 = self.open()
 
     def __del__(self):
         self.hdf5.close()
 
+    def open(self):
+        import h5py
+        # new files are in the latest format, so they can be opened by `HDF5SWMRDataStore` later
+        return h5py.File(self.path, "a", libver='latest')
+
+    @staticmethod
+    def entry_name(cache_id: str) -> str:
+        return quote(cache_id, safe='')
+
+    def type_group(self, type_id: str, create: bool = False):
+        """
+        group of a type, old datasets of pickled attributes are moved to a group when `create` is set.
+        """
+        import h5py
+        group = self.hdf5.get(f"{type_id}")
+        if group is None:
+            return self.hdf5.create_group(f"{type_id}") if create else None
+        if not create or isinstance(group, h5py.Group):
+            return group
+        legacy = {k: v.tobytes() for k, v in group.attrs.items()}
+        del self.hdf5[f"{type_id}"]
+        group = self.hdf5.create_group(f"{type_id}")
+        for cache_id, data in legacy.items():
+            self.write_pickle(group, self.entry_name(cache_id), data)
+        return group
+
     def exist(self, type_id: str, cache_id: str):
-        dataset = self.hdf5.get(f"{type_id}")
-        if not dataset:
-            return False
-        return cache_id in dataset.keys()
+        return self.exist_many(type_id, [cache_id])[0]
 
     def add(self, type_id: str, cache_id: str, data):
-        dataset = self.hdf5.get(f"{type_id}")
-        if not dataset:
-            self.hdf5.create_dataset(f'{type_id}', data='')
-            dataset = self.hdf5.get(f"{type_id}")
+        return self.add_many(type_id, {cache_id: data})
+
+    def update(self, type_id: str, cache_id: str, data):
+        if self.hdf5.get(f"{type_id}") is None:
+            return False
+        self.write(self.type_group(type_id, True), cache_id, data)
+        self.hdf5.flush()
+        return True
+
+    def update_or_add(self, type_id: str, cache_id: str, data):
+        self.write(self.type_group(type_id, True), cache_id, data)
+        self.hdf5.flush()
+        return True
+
+    def fetch(self, type_id: str, cache_id: str):
+        return self.fetch_many(type_id, [cache_id])[0]
+
+    def remove(self, type_id: str, cache_id: str):
+        import h5py
+        group = self.type_group(type_id)
+        if isinstance(group, h5py.Dataset):
+            if cache_id in group.attrs:
+                del group.attrs[cache_id]
+        elif group is not None and self.entry_name(cache_id) in group:
+            del group[self.entry_name(cache_id)]
+        self.hdf5.flush()
+        return True
+
+    def fetch_slice(self, type_id: str, cache_id: str, index):
+        """
+        read a part of data, `index` selects items of an array, rows of a columnar batch,
+        or is applied to other data after unpickled.
+        """
+        import h5py
+        group = self.type_group(type_id)
+        if group is None:
+            return None
+        if isinstance(group, h5py.Dataset):
+            data = self.fetch(type_id, cache_id)
+            return data[index] if data is not None else None
+        entry = group.get(self.entry_name(cache_id))
+        if entry is None:
+            return None
+        kind = entry.attrs.get('kind')
+        if kind == 'array':
+            return entry[index]
+        if kind == 'columnar':
+            return self.read_columnar(entry, index)
+        return self.read(entry)[index]
+
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        import h5py
+        group = self.type_group(type_id)
+        if group is None:
+            return [False] * len(cache_ids)
+        if isinstance(group, h5py.Dataset):
+            ids = set(group.attrs.keys())
+            return [cache_id in ids for cache_id in cache_ids]
+        ids = set(group.keys())
+        return [self.entry_name(cache_id) in ids for cache_id in cache_ids]
+
+    def add_many(self, type_id: str, items: dict):
+        group = self.type_group(type_id, True)
+        ids = set(group.keys())
+        for cache_id, data in items.items():
+            if self.entry_name(cache_id) not in ids:
+                self.write(group, cache_id, data)
+        self.hdf5.flush()
+        return True
+
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        import h5py
+        group = self.type_group(type_id)
+        if group is None:
+            return [None] * len(cache_ids)
+        if isinstance(group, h5py.Dataset):
+            attrs = group.attrs
+            ids = set(attrs.keys())
+            return [pickle.loads(attrs[cache_id].tobytes()) if cache_id in ids else None for cache_id in cache_ids]
+        results = []
+        for cache_id in cache_ids:
+            entry = group.get(self.entry_name(cache_id))
+            results.append(self.read(entry) if entry is not None else None)
+        return results
+
+    def write(self, group, cache_id: str, data):
+        import numpy as np
+        from coffee.data.columnar import ColumnarBatch
+        name = self.entry_name(cache_id)
+        if name in group:
+            del group[name]
+        if isinstance(data, np.ndarray) and data.dtype.kind in 'biufcSV' and not data.dtype.hasobject:
+            self.write_array(group, name, data).attrs['kind'] = 'array'
+        elif isinstance(data, ColumnarBatch):
+            self.write_columnar(group, name, data)
         else:
-            if cache_id not in dataset.attrs.keys():
-                return True
-        dataset.attrs[cache_id] = np.void(pickle.dumps(data))
-        self.hdf5.update()
+            self.write_pickle(group, name, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def write_array(self, group, name: str, data):
+        if not self.compression or data.ndim == 0 or data.size == 0:
+            return group.create_dataset(name, data=data)
+        return group.create_dataset(name, data=data, chunks=True, compression=self.compression,
+                                    compression_opts=self.compression_opts, shuffle=True)
+
+    def write_pickle(self, group, name: str, data: bytes):
+        import numpy as np
+        group.create_dataset(name, data=np.frombuffer(data, dtype=np.uint8)).attrs['kind'] = 'pickle'
+
+    def write_columnar(self, group, name: str, batch):
+        import numpy as np
+        entry = group.create_group(name)
+        entry.attrs['kind'] = 'columnar'
+        self.write_array(entry, 'timestamps', batch.timestamps)
+        columns = []
+        for i, (key, col) in enumerate(batch.columns.items()):
+            if not isinstance(col, tuple) and col.dtype.hasobject:
+                # decoded strings, dictionary encode them again
+                codes = {}
+                col = (np.array([codes.setdefault(v, len(codes)) if v is not None else -1 for v in col],
+                                dtype=np.int32), list(codes.keys()))
+            self.write_array(entry, f'c{i}', col[0] if isinstance(col, tuple) else col)
+            columns.append((key, col[1] if isinstance(col, tuple) else None))
+        self.write_pickle(entry, 'meta', pickle.dumps((batch.name, batch.tags, columns)))
+
+    def read(self, entry):
+        kind = entry.attrs.get('kind')
+        if kind == 'array':
+            # not mapped, space of removed or updated datasets may be reused by later writes
+            return entry[()]
+        if kind == 'columnar':
+            return self.read_columnar(entry)
+        return pickle.loads(entry[()].tobytes())
+
+    @staticmethod
+    def read_columnar(entry, index=slice(None)):
+        from coffee.data.columnar import ColumnarBatch
+        name, tags, columns = pickle.loads(entry['meta'][()].tobytes())
+        data = {}
+        for i, (key, categories) in enumerate(columns):
+            col = entry[f'c{i}'][index]
+            data[key] = (col, categories) if categories is not None else col
+        return ColumnarBatch(name, entry['timestamps'][index], data, tags)
+
+
+class HDF5SWMRDataStore(HDF5DataStore):
+    """
+    HDF5 data store in single-writer/multiple-reader mode, a process opens the file as `writer` and any number
+    of processes open it as readers, readers see new data without reopening the file.
+
+    HDF5 can't create objects in SWMR mode, so data are pickled and appended to a log of three datasets:
+    keys, data and an index of (key offset, key size, data offset, data size), removed data have size -1.
+    writes are kept in memory and appended every `batch_size` data or `batch_bytes` bytes, or by `flush`.
+    readers read new index rows at most every `refresh_interval` seconds. a reader of a file without the log
+    (never opened by a writer) only reads data of `HDF5DataStore`, it must be reopened to see the log.
+
+    the log only grows, updated and removed data still take space until the writer calls `compact`.
+
+    data of `HDF5DataStore` in the file are still readable, but files in formats older than HDF5 1.10 can't be
+    opened in SWMR mode.
+    """
+    def __init__(self, path, writer: bool = False, batch_size: int = 256, batch_bytes: int = 16 * 1024 * 1024,
+                 refresh_interval: float = 0):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        # key => (data offset, data size)
+        self.positions = {}
+        self.rows = 0
+        self.refreshed = 0
+        # key => pickled data, None for removed
+        self.pending = OrderedDict()
+        self.pending_bytes = 0
+        super().__init__(path)
+        self.log = self.open_log(self.hdf5)
+        self.refresh(force=True)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def open(self):
+        import h5py
+        import numpy as np
+        if not self.writer:
+            return h5py.File(self.path, 'r', libver='latest', swmr=True)
+        f = h5py.File(self.path, 'a', libver='latest')
+        if '.swmr' not in f:
+            self.create_log(f)
+        f.swmr_mode = True
+        return f
+
+    @staticmethod
+    def create_log(f):
+        import numpy as np
+        log = f.create_group('.swmr')
+        log.create_dataset('keys', shape=(0,), maxshape=(None,), dtype=np.uint8, chunks=(64 * 1024,))
+        log.create_dataset('data', shape=(0,), maxshape=(None,), dtype=np.uint8, chunks=(1024 * 1024,))
+        log.create_dataset('index', shape=(0, 4), maxshape=(None, 4), dtype=np.int64, chunks=(4096, 4))
+
+    @staticmethod
+    def open_log(f):
+        """
+        :return datasets of the log, None if the file has no log.
+        """
+        if '.swmr' not in f:
+            return None
+        return {name: f[f'.swmr/{name}'] for name in ('keys', 'data', 'index')}
+
+    def close(self):
+        if self.hdf5:
+            if self.writer:
+                self.flush()
+            self.hdf5.close()
+            self.hdf5 = None
+
+    @staticmethod
+    def log_key(type_id: str, cache_id: str) -> bytes:
+        return f'{type_id}\0{cache_id}'.encode()
+
+    def refresh(self, force: bool = False):
+        """
+        read index rows appended by the writer.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and (self.writer or now - self.refreshed < self.refresh_interval):
+                return
+            if self.log is None:
+                return
+            self.refreshed = now
+            index = self.log['index']
+            if not self.writer:
+                index.refresh()
+                self.log['keys'].refresh()
+                self.log['data'].refresh()
+            rows = index.shape[0]
+            if rows <= self.rows:
+                return
+            new_rows = index[self.rows:rows]
+            begin = int(new_rows[0][0])
+            keys = self.log['keys'][begin:int(new_rows[-1][0] + new_rows[-1][1])].tobytes()
+            for key_offset, key_size, data_offset, data_size in new_rows.tolist():
+                key = keys[key_offset - begin:key_offset - begin + key_size]
+                self.positions[key] = (data_offset, data_size)
+            self.rows = rows
+
+    def flush(self):
+        """
+        append pending writes to the log, readers see them after this.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            rows = self.write_log(self.log, self.pending)
+            for key, row in zip(self.pending.keys(), rows):
+                self.positions[key] = (row[2], row[3])
+            self.rows += len(rows)
+            self.pending.clear()
+            self.pending_bytes = 0
+
+    def compact(self):
+        """
+        rewrite the file with the latest data of the log only, and data of `HDF5DataStore` are copied.
+        readers keep reading the old file until they are reopened.
+        """
+        import h5py
+        if not self.writer:
+            raise PermissionError(f'{self.path} is opened by a reader')
+        with self.lock:
+            self.flush()
+            tmp = self.path + '.compact'
+            with h5py.File(tmp, 'w', libver='latest') as f:
+                for name in self.hdf5:
+                    if name != '.swmr':
+                        self.hdf5.copy(self.hdf5[name], f, name=name)
+                self.create_log(f)
+                log = self.open_log(f)
+                records, size = OrderedDict(), 0
+                for key, (offset, data_size) in self.positions.items():
+                    type_id, cache_id = key.decode().split('\0', 1)
+                    if data_size >= 0:
+                        records[key] = self.log['data'][offset:offset + data_size].tobytes()
+                    elif super().exist_many(type_id, [cache_id])[0]:
+                        # removed data of `HDF5DataStore` are still in the file
+                        records[key] = None
+                    else:
+                        continue
+                    size += max(data_size, 0)
+                    if len(records) >= self.batch_size or size >= self.batch_bytes:
+                        self.write_log(log, records)
+                        records, size = OrderedDict(), 0
+                self.write_log(log, records)
+            self.hdf5.close()
+            os.replace(tmp, self.path)
+            self.hdf5 = self.open()
+            self.log = self.open_log(self.hdf5)
+            self.positions = {}
+            self.rows = 0
+            self.refresh(force=True)
+
+    @classmethod
+    def write_log(cls, log: dict, records: dict) -> list:
+        """
+        append records (key => pickled data, None for removed) to the log.
+
+        :return index rows of the records.
+        """
+        import numpy as np
+        if not records:
+            return []
+        keys, data, index = log['keys'], log['data'], log['index']
+        key_offset, data_offset = keys.shape[0], data.shape[0]
+        rows = []
+        for key, value in records.items():
+            size = len(value) if value is not None else -1
+            rows.append((key_offset, len(key), data_offset, size))
+            key_offset += len(key)
+            data_offset += max(size, 0)
+        # data before index, readers only follow index rows
+        cls.append(keys, b''.join(records.keys()))
+        cls.append(data, b''.join(v for v in records.values() if v is not None))
+        index.resize((index.shape[0] + len(rows), 4))
+        index[-len(rows):] = np.array(rows, dtype=np.int64)
+        index.flush()
+        return rows
+
+    @staticmethod
+    def append(dataset, content: bytes):
+        import numpy as np
+        if not content:
+            return
+        size = dataset.shape[0]
+        dataset.resize((size + len(content),))
+        dataset[size:] = np.frombuffer(content, dtype=np.uint8)
+        dataset.flush()
+
+    def put(self, type_id: str, cache_id: str, value):
+        if not self.writer:
+            raise PermissionError(f'{self.path} is opened by a reader')
+        with self.lock:
+            key = self.log_key(type_id, cache_id)
+            self.pending.pop(key, None)
+            self.pending[key] = value
+            self.pending_bytes += len(value) if value is not None else 0
+            full = len(self.pending) >= self.batch_size or self.pending_bytes >= self.batch_bytes
+        if full:
+            self.flush()
         return True
 
+    def logged(self, type_id: str, cache_id: str):
+        """
+        :return True if the data is written, False if it's removed, or None if it's not in the log.
+        """
+        key = self.log_key(type_id, cache_id)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key] is not None
+            position = self.positions.get(key)
+        return position[1] >= 0 if position else None
+
+    def lookup(self, type_id: str, cache_id: str):
+        """
+        :return pickled data, None if it's removed, or False if it's not in the log.
+        """
+        key = self.log_key(type_id, cache_id)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            position = self.positions.get(key)
+        if position is None:
+            return False
+        offset, size = position
+        return self.log['data'][offset:offset + size].tobytes() if size >= 0 else None
+
+    def exist(self, type_id: str, cache_id: str):
+        return self.exist_many(type_id, [cache_id])[0]
+
+    def add(self, type_id: str, cache_id: str, data):
+        if self.exist(type_id, cache_id):
+            return True
+        return self.put(type_id, cache_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
     def update(self, type_id: str, cache_id: str, data):
-        dataset = self.hdf5.get(f"{type_id}")
-        if dataset:
-            dataset.attrs[cache_id] = np.void(pickle.dumps(data))
-            self.hdf5.update()
+        return self.put(type_id, cache_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def update_or_add(self, type_id: str, cache_id: str, data):
+        return self.update(type_id, cache_id, data)
+
+    def remove(self, type_id: str, cache_id: str):
+        return self.put(type_id, cache_id, None)
+
+    def fetch(self, type_id: str, cache_id: str):
+        return self.fetch_many(type_id, [cache_id])[0]
+
+    def fetch_slice(self, type_id: str, cache_id: str, index):
+        data = self.fetch(type_id, cache_id)
+        return data[index] if data is not None else None
+
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        self.refresh()
+        found = [self.logged(type_id, cache_id) for cache_id in cache_ids]
+        missing = [i for i, exist in enumerate(found) if exist is None]
+        if missing:
+            # written by HDF5DataStore
+            for i, exist in zip(missing, super().exist_many(type_id, [cache_ids[i] for i in missing])):
+                found[i] = exist
+        return found
+
+    def add_many(self, type_id: str, items: dict):
+        exists = self.exist_many(type_id, list(items.keys()))
+        for (cache_id, data), exist in zip(items.items(), exists):
+            if not exist:
+                self.put(type_id, cache_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
         return True
 
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        self.refresh()
+        results = []
+        for cache_id in cache_ids:
+            value = self.lookup(type_id, cache_id)
+            if value is False:
+                # written by HDF5DataStore
+                value = super().fetch_many(type_id, [cache_id])[0]
+            elif value is not None:
+                value = pickle.loads(value)
+            results.append(value)
+        return results
+
+
+class SQLiteDataStore(DataStore):
+    """
+    store data in a SQLite database file in WAL mode, readers don't block each other nor the writer.
+    each thread has its own connection, `close` closes connections of all threads.
+
+    writes in `transaction` are committed together or rolled back on error, other writes are committed
+    one by one. data of a type can be listed by cache id prefix with `scan`.
+    """
+    # parameters in a statement
+    MAX_PARAMS = 500
+
+    def __init__(self, path, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        # connections of threads are reopened after `close`
+        self.generation = 0
+        with self.transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS data (type_id TEXT NOT NULL, cache_id TEXT NOT NULL, '
+                         'value BLOB, PRIMARY KEY (type_id, cache_id)) WITHOUT ROWID')
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.generation != self.generation:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self.lock:
+                self.connections.append(conn)
+                self.local.generation = self.generation
+            self.local.conn = conn
+            self.local.depth = 0
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        commit all writes in the block at once, nested blocks are in the same transaction.
+        """
+        conn = self.connection()
+        if self.local.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        self.local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            conn.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+            self.generation += 1
+        for conn in connections:
+            conn.close()
+        self.local.conn = None
+
+    def exist(self, type_id: str, cache_id: str):
+        return self.exist_many(type_id, [cache_id])[0]
+
+    def add(self, type_id: str, cache_id: str, data):
+        return self.add_many(type_id, {cache_id: data})
+
+    def update(self, type_id: str, cache_id: str, data):
+        with self.transaction() as conn:
+            cursor = conn.execute('UPDATE data SET value = ? WHERE type_id = ? AND cache_id = ?',
+                                  (pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), type_id, cache_id))
+        return cursor.rowcount > 0
+
     def update_or_add(self, type_id: str, cache_id: str, data):
-        dataset = self.hdf5.get(f"{type_id}")
-        if not dataset:
-            self.hdf5.create_dataset(f'{type_id}', data='')
-            dataset = self.hdf5.get(f"{type_id}")
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO data VALUES (?, ?, ?)',
+                         (type_id, cache_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+        return True
 
-        dataset.attrs[cache_id] = np.void(pickle.dumps(data))
-        self.hdf5.update()
+    def fetch(self, type_id: str, cache_id: str):
+        row = self.connection().execute('SELECT value FROM data WHERE type_id = ? AND cache_id = ?',
+                                        (type_id, cache_id)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        found = set(k for k, _ in self.select(type_id, cache_ids, 'cache_id, NULL'))
+        return [cache_id in found for cache_id in cache_ids]
+
+    def add_many(self, type_id: str, items: dict):
+        with self.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO data VALUES (?, ?, ?)', (
+                (type_id, cache_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+                for cache_id, data in items.items()
+            ))
         return True
 
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        found = dict(self.select(type_id, cache_ids, 'cache_id, value'))
+        return [pickle.loads(found[cache_id]) if cache_id in found else None for cache_id in cache_ids]
+
+    def select(self, type_id: str, cache_ids: list, columns: str) -> list:
+        conn = self.connection()
+        rows = []
+        for pos in range(0, len(cache_ids), self.MAX_PARAMS):
+            batch = cache_ids[pos:pos + self.MAX_PARAMS]
+            rows += conn.execute(
+                f'SELECT {columns} FROM data WHERE type_id = ? AND cache_id IN ({",".join("?" * len(batch))})',
+                [type_id, *batch]
+            ).fetchall()
+        return rows
+
+    def remove(self, type_id: str, cache_id: str):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM data WHERE type_id = ? AND cache_id = ?', (type_id, cache_id))
+        return True
+
+    def scan(self, type_id: str, prefix: str = '', with_data: bool = True):
+        """
+        iterate data of a type whose cache id begins with `prefix`, in order of cache id.
+
+        :return iterator of (cache_id, data), or cache ids without `with_data`.
+        """
+        sql = f'SELECT cache_id{", value" if with_data else ""} FROM data WHERE type_id = ? AND cache_id >= ?'
+        params = [type_id, prefix]
+        if prefix:
+            sql += ' AND cache_id < ?'
+            params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        for row in self.connection().execute(sql + ' ORDER BY cache_id', params):
+            yield (row[0], pickle.loads(row[1])) if with_data else row[0]
+
+
+class LRUDataStore(DataStore):
+    """
+    keep recently used data of `store` in memory, at most `max_items` data and `max_bytes` bytes
+    (approximate memory size, see `data_size`). cached data is shared with callers, don't modify it.
+
+    with `write_back`, writing is kept in memory and written to `store` when evicted or by `flush`,
+    otherwise it's written to `store` immediately and the cached data is invalidated.
+    """
+    def __init__(self, store: DataStore, max_items: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 write_back: bool = False):
+        self.store = store
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.write_back = write_back
+        self.lock = threading.RLock()
+        # (type_id, cache_id) => [data, size, pending write of `store` or None]
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def exist(self, type_id: str, cache_id: str):
+        with self.lock:
+            if (type_id, cache_id) in self.entries:
+                return True
+        return self.store.exist(type_id, cache_id)
+
+    def add(self, type_id: str, cache_id: str, data):
+        if self.exist(type_id, cache_id):
+            return True
+        if self.write_back:
+            self.put(type_id, cache_id, data, 'add')
+            return True
+        return self.store.add(type_id, cache_id, data)
+
+    def update(self, type_id: str, cache_id: str, data):
+        if self.write_back:
+            self.put(type_id, cache_id, data, 'update')
+            return True
+        self.invalidate(type_id, cache_id)
+        return self.store.update(type_id, cache_id, data)
+
+    def update_or_add(self, type_id: str, cache_id: str, data):
+        if self.write_back:
+            self.put(type_id, cache_id, data, 'update_or_add')
+            return True
+        self.invalidate(type_id, cache_id)
+        return self.store.update_or_add(type_id, cache_id, data)
+
     def fetch(self, type_id: str, cache_id: str):
-        dataset = self.hdf5.get(f"{type_id}")
-        if not dataset:
-            return None
-        if cache_id not in dataset.attrs.keys():
+        key = (type_id, cache_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return entry[0]
+        data = self.store.fetch(type_id, cache_id)
+        if data is not None:
+            self.put(type_id, cache_id, data, None)
+        return data
+
+    def exist_many(self, type_id: str, cache_ids: list) -> list:
+        with self.lock:
+            cached = [(type_id, cache_id) in self.entries for cache_id in cache_ids]
+        missing = [cache_id for cache_id, hit in zip(cache_ids, cached) if not hit]
+        found = iter(self.store.exist_many(type_id, missing) if missing else [])
+        return [hit or next(found) for hit in cached]
+
+    def add_many(self, type_id: str, items: dict):
+        exists = self.exist_many(type_id, list(items.keys()))
+        items = {cache_id: data for (cache_id, data), exist in zip(items.items(), exists) if not exist}
+        if self.write_back:
+            for cache_id, data in items.items():
+                self.put(type_id, cache_id, data, 'add')
+            return True
+        return self.store.add_many(type_id, items) if items else True
+
+    def fetch_many(self, type_id: str, cache_ids: list) -> list:
+        results = [None] * len(cache_ids)
+        missing = []
+        with self.lock:
+            for i, cache_id in enumerate(cache_ids):
+                entry = self.entries.get((type_id, cache_id))
+                if entry:
+                    self.entries.move_to_end((type_id, cache_id))
+                    results[i] = entry[0]
+                else:
+                    missing.append(i)
+        if missing:
+            fetched = self.store.fetch_many(type_id, [cache_ids[i] for i in missing])
+            for i, data in zip(missing, fetched):
+                results[i] = data
+                if data is not None:
+                    self.put(type_id, cache_ids[i], data, None)
+        return results
+
+    def remove(self, type_id: str, cache_id: str):
+        with self.lock:
+            entry = self.entries.pop((type_id, cache_id), None)
+            if entry:
+                self.bytes -= entry[1]
+        return self.store.remove(type_id, cache_id)
+
+    def invalidate(self, type_id: str, cache_id: str):
+        """
+        drop cached data, pending writing is written to `store` first.
+        """
+        with self.lock:
+            entry = self.entries.pop((type_id, cache_id), None)
+            if entry:
+                self.bytes -= entry[1]
+                self.write_pending(type_id, cache_id, entry)
+
+    def flush(self):
+        """
+        write all pending writing to `store`.
+        """
+        with self.lock:
+            for (type_id, cache_id), entry in self.entries.items():
+                self.write_pending(type_id, cache_id, entry)
+
+    def put(self, type_id: str, cache_id: str, data, pending):
+        size = data_size(data)
+        with self.lock:
+            key = (type_id, cache_id)
+            old = self.entries.pop(key, None)
+            if old:
+                self.bytes -= old[1]
+                if pending and old[2]:
+                    # a pending add is still an add
+                    pending = old[2] if pending == 'update' else pending
+            if size > self.max_bytes:
+                # too large to be cached
+                self.write_pending(type_id, cache_id, [data, size, pending])
+                return
+            self.entries[key] = [data, size, pending]
+            self.bytes += size
+            while len(self.entries) > self.max_items or self.bytes > self.max_bytes:
+                (old_type, old_cache), entry = self.entries.popitem(last=False)
+                self.bytes -= entry[1]
+                self.write_pending(old_type, old_cache, entry)
+
+    def write_pending(self, type_id: str, cache_id: str, entry: list):
+        if entry[2]:
+            getattr(self.store, entry[2])(type_id, cache_id, entry[0])
+            entry[2] = None
+
+
+class BoundedDataStore(DataStore):
+    """
+    keep data of `store` in `max_bytes` bytes (size of pickled data), data of a type expire after the seconds
+    of `ttl` (type_id => seconds) or `default_ttl`, 0 for no limit.
+
+    sizes and access times and counts are kept in a SQLite file of `meta_path`, and least recently ('lru')
+    or least frequently ('lfu') used data are removed by `policy`. expired and over-quota data are removed
+    at most `evict_batch` a time after each write, so the store may exceed the quota for a while.
+    accesses by `fetch` are kept in memory and saved every `HITS_BATCH` hits, before eviction or by `flush`.
+    data written to `store` directly are not managed.
+    """
+    HITS_BATCH = 256
+
+    def __init__(self, store: DataStore, meta_path: str, max_bytes: int = 0, ttl: dict = None,
+                 default_ttl: float = 0, policy: str = 'lru', evict_batch: int = 16):
+        import sqlite3
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'unknown eviction policy: {policy}')
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.policy = policy
+        self.evict_batch = evict_batch
+        self.lock = threading.Lock()
+        self.meta = sqlite3.connect(meta_path, isolation_level=None, check_same_thread=False)
+        self.meta.execute('PRAGMA journal_mode=WAL')
+        self.meta.execute('PRAGMA synchronous=NORMAL')
+        self.meta.execute('CREATE TABLE IF NOT EXISTS meta (type_id TEXT NOT NULL, cache_id TEXT NOT NULL, '
+                          'size INTEGER, expire REAL, access REAL, hits INTEGER, '
+                          'PRIMARY KEY (type_id, cache_id)) WITHOUT ROWID')
+        self.meta.execute('CREATE INDEX IF NOT EXISTS meta_access ON meta (access)')
+        self.meta.execute('CREATE INDEX IF NOT EXISTS meta_hits ON meta (hits, access)')
+        self.meta.execute('CREATE INDEX IF NOT EXISTS meta_expire ON meta (expire)')
+        self.bytes = self.meta.execute('SELECT COALESCE(SUM(size), 0) FROM meta').fetchone()[0]
+        # (type_id, cache_id) => [last access, hits] not saved yet
+        self.hits = {}
+
+    def expired(self, type_id: str, cache_id: str) -> bool:
+        with self.lock:
+            row = self.meta.execute('SELECT expire FROM meta WHERE type_id = ? AND cache_id = ?',
+                                    (type_id, cache_id)).fetchone()
+        if not row or not row[0] or row[0] > time.time():
+            return False
+        self.remove(type_id, cache_id)
+        return True
+
+    def exist(self, type_id: str, cache_id: str):
+        return not self.expired(type_id, cache_id) and self.store.exist(type_id, cache_id)
+
+    def add(self, type_id: str, cache_id: str, data):
+        if self.exist(type_id, cache_id):
+            return True
+        return self.write(type_id, cache_id, data, self.store.add)
+
+    def update(self, type_id: str, cache_id: str, data):
+        return self.write(type_id, cache_id, data, self.store.update)
+
+    def update_or_add(self, type_id: str, cache_id: str, data):
+        return self.write(type_id, cache_id, data, self.store.update_or_add)
+
+    def fetch(self, type_id: str, cache_id: str):
+        if self.expired(type_id, cache_id):
             return None
-        return pickle.loads(dataset.attrs[cache_id].tobytes())
+        data = self.store.fetch(type_id, cache_id)
+        if data is not None:
+            with self.lock:
+                hit = self.hits.setdefault((type_id, cache_id), [0, 0])
+                hit[0] = time.time()
+                hit[1] += 1
+                full = len(self.hits) >= self.HITS_BATCH
+            if full:
+                self.flush()
+        return data
+
+    def flush(self):
+        """
+        save accesses kept in memory.
+        """
+        with self.lock:
+            if not self.hits:
+                return
+            hits, self.hits = self.hits, {}
+            self.meta.execute('BEGIN')
+            self.meta.executemany('UPDATE meta SET access = ?, hits = hits + ? WHERE type_id = ? AND cache_id = ?',
+                                  ((access, count, type_id, cache_id)
+                                   for (type_id, cache_id), (access, count) in hits.items()))
+            self.meta.execute('COMMIT')
+
+    def remove(self, type_id: str, cache_id: str):
+        with self.lock:
+            self.hits.pop((type_id, cache_id), None)
+            row = self.meta.execute('SELECT size FROM meta WHERE type_id = ? AND cache_id = ?',
+                                    (type_id, cache_id)).fetchone()
+            if row:
+                self.meta.execute('DELETE FROM meta WHERE type_id = ? AND cache_id = ?', (type_id, cache_id))
+                self.bytes -= row[0]
+        return self.store.remove(type_id, cache_id)
+
+    def write(self, type_id: str, cache_id: str, data, func):
+        size = len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        now = time.time()
+        ttl = self.ttl.get(type_id, self.default_ttl)
+        result = func(type_id, cache_id, data)
+        if not result:
+            # nothing is written, e.g. updating missing data
+            return result
+        with self.lock:
+            self.hits.pop((type_id, cache_id), None)
+            row = self.meta.execute('SELECT size FROM meta WHERE type_id = ? AND cache_id = ?',
+                                    (type_id, cache_id)).fetchone()
+            self.bytes += size - (row[0] if row else 0)
+            self.meta.execute('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?)',
+                              (type_id, cache_id, size, now + ttl if ttl else None, now, 0))
+        self.evict()
+        return result
+
+    def evict(self):
+        """
+        remove some expired data, and some least used data if the store is over quota.
+        """
+        self.flush()
+        with self.lock:
+            victims = self.meta.execute('SELECT type_id, cache_id FROM meta WHERE expire <= ? LIMIT ?',
+                                        (time.time(), self.evict_batch)).fetchall()
+        for type_id, cache_id in victims:
+            self.remove(type_id, cache_id)
+
+        order = 'access' if self.policy == 'lru' else 'hits, access'
+        for _ in range(self.evict_batch - len(victims)):
+            with self.lock:
+                if not self.max_bytes or self.bytes <= self.max_bytes:
+                    break
+                row = self.meta.execute(f'SELECT type_id, cache_id FROM meta ORDER BY {order} LIMIT 1').fetchone()
+            if not row:
+                break
+            self.remove(*row)
 
 
-DEF_DATA_STORE = FileSystemDataStore(DEF_CFG.data_store_path)
+def __getattr__(name):
+    # DEF_DATA_STORE is created on first use
+    if name == 'DEF_DATA_STORE':
+        cfg = settings.DEF_CFG
+        store = FileSystemDataStore(cfg.data_store_path)
+        if cfg.data_store_max_size or cfg.data_store_ttl:
+            store = BoundedDataStore(store, os.path.join(cfg.data_store_path, '.meta.db'), cfg.data_store_max_size,
+                                     default_ttl=cfg.data_store_ttl)
+        globals()[name] = store
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
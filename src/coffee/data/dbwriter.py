@@ -0,0 +1,243 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+write batches to database in background threads, so parsing is overlapped with network I/O.
+"""
+
+import gzip
+import queue
+import threading
+import time
+
+
+class BackgroundBatchWriter:
+    """
+    batches are handed over to writer threads by a bounded queue, `put` blocks when the queue is full,
+    so the producer can't run too far ahead of the database.
+
+    writer threads call `on_idle` when no batch comes in `flush_interval` seconds, the returned batch
+    (the pending records of the producer) is written too.
+    """
+    def __init__(self, write, threads: int = 1, queue_size: int = 8, flush_interval: float = 1.0, on_idle=None):
+        self.write = write
+        self.on_idle = on_idle
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.errors = []
+        # number of batches returned by `on_idle` which are being written
+        self.idle_writing = 0
+        self.idle_cond = threading.Condition()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(max(1, threads))]
+        for t in self.threads:
+            t.start()
+
+    def put(self, batch):
+        """
+        hand over a batch, block if the queue is full.
+        """
+        self.queue.put(batch)
+
+    def join(self):
+        """
+        wait until all batches are written, the first error of writing is raised.
+        """
+        self.queue.join()
+        with self.idle_cond:
+            self.idle_cond.wait_for(lambda: self.idle_writing == 0)
+        if self.errors:
+            error = self.errors[0]
+            self.errors = []
+            raise error
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def run(self):
+        while True:
+            try:
+                batch = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.write_idle()
+                continue
+
+            if batch is None:
+                self.queue.task_done()
+                break
+            self.write_safely(batch)
+            self.queue.task_done()
+
+    def write_idle(self):
+        if not self.on_idle:
+            return
+        with self.idle_cond:
+            batch = self.on_idle()
+            if not batch:
+                return
+            self.idle_writing += 1
+        try:
+            self.write_safely(batch)
+        finally:
+            with self.idle_cond:
+                self.idle_writing -= 1
+                self.idle_cond.notify_all()
+
+    def write_safely(self, batch):
+        try:
+            self.write(batch)
+        except Exception as e:
+            self.errors.append(e)
+
+
+def series_key(line: str) -> str:
+    """
+    measurement and tags of a line protocol string.
+    """
+    if '\\' not in line:
+        return line[:line.find(' ')]
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == ' ':
+            return line[:i]
+        i += 1
+    return line
+
+
+class BulkLineWriter:
+    """
+    write line protocol strings to InfluxDB by `connections` keep-alive HTTP sessions in parallel.
+
+    lines are sharded by series, each shard is written by its own session in order, and a failed batch is
+    retried before the next batch of the shard, so points of a series are never reordered.
+    batch size of each shard is adapted to the measured latency of writing, grows when a batch is written
+    faster than `target_latency` and shrinks when it's slower.
+    """
+    def __init__(self, url: str, params: dict, connections: int = 4, queue_size: int = 4, auth=None,
+                 gzip: bool = True, target_latency: float = 0.5, min_batch: int = 1000, max_batch: int = 50000,
+                 retries: int = 3, retry_delay: float = 0.5, timeout: float = 30.0):
+        self.url = url.rstrip('/') + '/write'
+        self.params = params
+        self.auth = auth
+        self.gzip = gzip
+        self.target_latency = target_latency
+        self.min_batch = min_batch
+        self.max_batch = max(min_batch, max_batch)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.errors = []
+        self.batch_sizes = [min_batch] * max(1, connections)
+        self.pending = [[] for _ in self.batch_sizes]
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in self.batch_sizes]
+        self.threads = [threading.Thread(target=self.run, args=(i,), daemon=True) for i in range(len(self.queues))]
+        for t in self.threads:
+            t.start()
+
+    def put(self, lines):
+        """
+        add lines, full batches are handed over to the writers, block if a writer queue is full.
+        """
+        # batches are queued with the lock held, so batches of a shard keep the order of lines
+        with self.lock:
+            shards = len(self.pending)
+            for line in lines:
+                self.pending[hash(series_key(line)) % shards].append(line)
+            for idx, pending in enumerate(self.pending):
+                if len(pending) >= self.batch_sizes[idx]:
+                    self.pending[idx] = []
+                    self.queues[idx].put(pending)
+
+    def flush(self):
+        """
+        hand over pending lines of all shards.
+        """
+        with self.lock:
+            for idx, pending in enumerate(self.pending):
+                if pending:
+                    self.pending[idx] = []
+                    self.queues[idx].put(pending)
+
+    def join(self):
+        """
+        write all lines, the first error of writing is raised.
+        """
+        self.flush()
+        for q in self.queues:
+            q.join()
+        if self.errors:
+            error = self.errors[0]
+            self.errors = []
+            raise error
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def run(self, idx: int):
+        import requests
+        session = requests.Session()
+        q = self.queues[idx]
+        while True:
+            batch = q.get()
+            if batch is None:
+                q.task_done()
+                break
+            try:
+                pos = 0
+                while pos < len(batch):
+                    # batch size may be changed by the last write
+                    size = self.batch_sizes[idx]
+                    self.write(session, idx, batch[pos:pos + size])
+                    pos += size
+            except Exception as e:
+                self.errors.append(e)
+            q.task_done()
+        session.close()
+
+    def write(self, session, idx: int, lines: list):
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        headers = {'Content-Type': 'application/octet-stream'}
+        if self.gzip:
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+
+        for retry in range(self.retries + 1):
+            begin = time.monotonic()
+            try:
+                r = session.post(self.url, params=self.params, data=data, headers=headers, auth=self.auth,
+                                 timeout=self.timeout)
+            except OSError as e:
+                # requests' connection errors are OSError
+                error = e
+            else:
+                if r.status_code < 300:
+                    self.adapt(idx, len(lines), time.monotonic() - begin)
+                    return
+                error = RuntimeError(f'write failed with {r.status_code}: {r.text}')
+                if 400 <= r.status_code < 500 and r.status_code != 429:
+                    # bad request won't succeed by retrying
+                    break
+            if retry < self.retries:
+                time.sleep(self.retry_delay * (2 ** retry))
+        raise error
+
+    def adapt(self, idx: int, count: int, latency: float):
+        if count < self.batch_sizes[idx]:
+            return
+        if latency < self.target_latency / 2:
+            self.batch_sizes[idx] = min(self.max_batch, self.batch_sizes[idx] * 2)
+        elif latency > self.target_latency:
+            self.batch_sizes[idx] = max(self.min_batch, self.batch_sizes[idx] // 2)
@@ -0,0 +1,162 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+encode points to InfluxDB line protocol directly, the escaping is the same as the influxdb client.
+
+datetimes without timezone are local time of UTC+8, the same as before. timestamps are integers
+in `PRECISIONS`, microsecond is the default, which keeps datetimes from logs unchanged.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+_EPOCH = datetime(1970, 1, 1)
+PRECISIONS = {
+    'h': timedelta(hours=1),
+    'm': timedelta(minutes=1),
+    's': timedelta(seconds=1),
+    'ms': timedelta(milliseconds=1),
+    'u': timedelta(microseconds=1),
+}
+LOCAL_UTC_OFFSET = timedelta(hours=8)
+
+
+def escape_name(s) -> str:
+    """
+    escape measurement, tag keys and values and field keys, empty string for None.
+    """
+    if s is None:
+        return ''
+    return str(s).replace('\\', '\\\\').replace(' ', '\\ ').replace(',', '\\,').replace('=', '\\=')\
+        .replace('\n', '\\n')
+
+
+def measurement_name(line: str) -> str:
+    """
+    unescaped measurement of a line protocol string.
+    """
+    if '\\' not in line:
+        end = min(i for i in (line.find(','), line.find(' '), len(line)) if i >= 0)
+        return line[:end]
+    chars = []
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == '\\' and i + 1 < len(line):
+            chars.append('\n' if line[i + 1] == 'n' else line[i + 1])
+            i += 2
+            continue
+        if c in ', ':
+            break
+        chars.append(c)
+        i += 1
+    return ''.join(chars)
+
+
+def encode_value(v) -> str:
+    """
+    encode field value, empty string for None.
+    """
+    if v is None:
+        return ''
+    t = type(v)
+    if t is str:
+        return '"' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    if t is int:
+        return str(v) + 'i'
+    if t is float:
+        return repr(v)
+    if t is bool:
+        return str(v)
+    if isinstance(v, int) and not isinstance(v, bool):
+        return str(int(v)) + 'i'
+    try:
+        return repr(float(v))
+    except (TypeError, ValueError):
+        return str(v)
+
+
+def encode_timestamp(dt: datetime, precision: str = 'u', utc_offset: timedelta = LOCAL_UTC_OFFSET) -> int:
+    """
+    integer timestamp of a datetime, datetime without timezone is in `utc_offset`.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - utc_offset - _EPOCH) // PRECISIONS[precision]
+
+
+def encode_fields(fields: dict, field_keys: dict = None) -> str:
+    """
+    :param field_keys: cache of escaped field keys.
+    """
+    field_keys = {} if field_keys is None else field_keys
+    result = []
+    for k in sorted(fields.keys()):
+        value = encode_value(fields[k])
+        if value == '':
+            continue
+        key = field_keys.get(k)
+        if key is None:
+            key = field_keys[k] = escape_name(k)
+        if key:
+            result.append(key + '=' + value)
+    return ','.join(result)
+
+
+def encode_line(measurement: str, tags: dict, fields: dict, dt: datetime, precision: str = 'u') -> str:
+    """
+    :return line protocol of a point, empty string if there is no field.
+    """
+    field_str = encode_fields(fields)
+    if not field_str:
+        return ''
+    line = escape_name(measurement)
+    for k in sorted(tags.keys()):
+        key = escape_name(k)
+        value = escape_name(tags[k])
+        if key and value:
+            line += ',' + key + '=' + value
+    return line + ' ' + field_str + ' ' + str(encode_timestamp(dt, precision))
+
+
+class SeriesEncoder:
+    """
+    encode points with the same measurement and tag mapping, names are escaped only once.
+
+    tags of a point are taken from its values by `tags`, a list of (value key, tag key),
+    and `static_tags` are the same for all points.
+    """
+    def __init__(self, measurement: str, tags: list, static_tags: dict = None, precision: str = 'u'):
+        self.prefix = escape_name(measurement)
+        self.precision = precision
+        self.field_keys = {}
+        self.tag_mapping = tags
+
+        # (value key, escaped tag key) or (None, escaped static tag), sorted by tag key
+        mapping = {}
+        for k, v in (static_tags or {}).items():
+            key, value = escape_name(k), escape_name(v)
+            mapping[k] = (None, key + '=' + value) if key and value else None
+        for value_key, tag_key in tags:
+            key = escape_name(tag_key)
+            mapping[tag_key] = (value_key, key) if key else None
+        self.tags = [mapping[k] for k in sorted(mapping.keys(), key=str) if mapping[k]]
+
+    def encode(self, fields: dict, dt: datetime) -> str:
+        """
+        :return line protocol of a point, empty string if there is no field.
+        """
+        field_str = encode_fields(fields, self.field_keys)
+        if not field_str:
+            return ''
+        line = self.prefix
+        for value_key, tag in self.tags:
+            if value_key is None:
+                line += ',' + tag
+                continue
+            if value_key not in fields:
+                continue
+            value = escape_name(fields[value_key])
+            if value:
+                line += ',' + tag + '=' + value
+        return line + ' ' + field_str + ' ' + str(encode_timestamp(dt, self.precision))
@@ -7,21 +7,33 @@ this file provides some data processors:
 * influxdb processor
 * time tracker
 * data aggregator
+* columnar data aggregator
+* rollup sink
 """
 
 from coffee.data.dataflow import DataPoint
-from coffee.data.database import InfluxDBV1
+from coffee.data.database import TimeSeriesDatabase
+from coffee.data.lineprotocol import SeriesEncoder
+from coffee.data.spool import LineSpool, SpoolDrainer
 from coffee.core.utils import randstr
 from coffee.data.dataflow import DataSink
 
+from collections import Counter
 from datetime import datetime, timedelta
+import time
 import click
 
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
 
 class BypassDataSink(DataSink):
     def on_data(self, datapoint: DataPoint) -> DataPoint:
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
         return datapoint
 
@@ -29,31 +41,94 @@ class BypassDataSink(DataSink):
 class InfluxDBDataSink(DataSink):
     """
     track the min and max time for range selection.
+
+    with `spool`, lines are appended to the spool and replayed to the database by a drainer in background,
+    the spool is flushed after each batch, or every `flush_interval` seconds for single points.
+    `finish` waits for the drainer at most `drain_timeout` seconds, the rest is replayed next time, then the
+    drainer is stopped and the spool is closed.
+    if the spool is not drained in time, the first error of the drainer is raised, or a warning is printed.
     """
-    def __init__(self, influx: InfluxDBV1, source=''):
+    def __init__(self, influx: TimeSeriesDatabase, source='', spool: LineSpool = None, drain_timeout: float = 10.0,
+                 flush_interval: float = 1.0):
         super().__init__()
         self.influx = influx
         self.source_id = randstr(10) if not source else source
+        # name => line protocol encoder, measurement and tags are escaped once per pattern
+        self.encoders = {}
+        self.spool = spool
+        self.drain_timeout = drain_timeout
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        self.drainer = None
+        if spool:
+            self.drainer = SpoolDrainer(spool, influx)
+            self.drainer.start()
 
-    def on_data(self, datapoint: DataPoint) -> DataPoint:
+    def make_tags(self, datapoint: DataPoint) -> dict:
         tags_kv = {
             'source': self.source_id
         }
         for tag in datapoint.tags:
             if tag[0] in datapoint.value.keys():
                 tags_kv[tag[1]] = datapoint.value[tag[0]]
-        self.influx.insert(
-            fields=datapoint.value,
-            table=datapoint.name,
-            tags=tags_kv,
-            dt=datapoint.timestamp
-        )
+        return tags_kv
+
+    def get_encoder(self, datapoint: DataPoint) -> SeriesEncoder:
+        encoder = self.encoders.get(datapoint.name)
+        if not encoder or (encoder.tag_mapping is not datapoint.tags and encoder.tag_mapping != datapoint.tags):
+            encoder = SeriesEncoder(datapoint.name, datapoint.tags, {'source': self.source_id}, self.influx.precision)
+            self.encoders[datapoint.name] = encoder
+        return encoder
+
+    def write_lines(self, lines: list, flush: bool = True):
+        """
+        write lines to the spool or the database, the spool is only flushed with `flush` or when the last
+        flush is `flush_interval` seconds ago.
+        """
+        if not self.spool:
+            self.influx.insert_lines(lines)
+            return
+        self.spool.append(lines)
+        now = time.monotonic()
+        if flush or now - self.flushed_at >= self.flush_interval:
+            self.spool.flush()
+            self.flushed_at = now
+
+    def on_data(self, datapoint: DataPoint) -> DataPoint:
+        if not hasattr(self.influx, 'insert_lines'):
+            # databases without line protocol, e.g. the embedded one
+            self.influx.insert(datapoint.value, datapoint.name, self.make_tags(datapoint), datapoint.timestamp)
+        else:
+            self.write_lines([self.get_encoder(datapoint).encode(datapoint.value, datapoint.timestamp)], flush=False)
 
         datapoint.meta['_source'] = self.source_id
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        if not hasattr(self.influx, 'insert_lines'):
+            self.influx.insert_batch([(dp.value, dp.name, self.make_tags(dp), dp.timestamp) for dp in datapoints])
+        else:
+            self.write_lines([self.get_encoder(dp).encode(dp.value, dp.timestamp) for dp in datapoints])
+        for dp in datapoints:
+            dp.meta['_source'] = self.source_id
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
-        self.influx.finish()
+        if self.drainer:
+            self.spool.flush()
+            try:
+                drained = self.drainer.join(self.drain_timeout)
+            finally:
+                self.drainer.stop()
+                self.spool.close()
+            errors, self.drainer.errors = self.drainer.errors, []
+            if not drained:
+                if errors:
+                    raise errors[0]
+                click.echo(click.style(f'{self.drainer.pending()} bytes in spool {self.spool.path} are not '
+                                       f'written yet, they will be replayed next time.', fg='yellow'), err=True)
+        else:
+            self.influx.finish()
         return datapoint
 
 
@@ -68,6 +143,15 @@ class DatapointTimeTracker(DataSink):
         self.max_ts = datapoint.timestamp_ms() if datapoint.timestamp_ms() > self.max_ts else self.max_ts
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        if not datapoints:
+            return datapoints
+        min_ts = min(dp.timestamp for dp in datapoints)
+        max_ts = max(dp.timestamp for dp in datapoints)
+        self.min_ts = min(self.min_ts, int(min_ts.timestamp() * 1000))
+        self.max_ts = max(self.max_ts, int(max_ts.timestamp() * 1000))
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
         return datapoint
 
@@ -96,6 +180,12 @@ class DataAggregator(DataSink):
         self.all_points.append(value)
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        for dp in datapoints:
+            dp.value['timestamp'] = dp.timestamp
+        self.all_points.extend([dp.value for dp in datapoints])
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
         return datapoint
 
@@ -103,6 +193,135 @@ class DataAggregator(DataSink):
         return self.all_points
 
 
+class ColumnarDataAggregator(DataSink):
+    """
+    aggregate points in columnar batches by name, it takes much less memory than `DataAggregator`.
+    batches are built when finished.
+    """
+
+    def __init__(self):
+        super(ColumnarDataAggregator, self).__init__()
+        # imported when created, so importing this module doesn't load numpy
+        from coffee.data.columnar import ColumnarBatchBuilder
+        self.builder_class = ColumnarBatchBuilder
+        self.builders = {}
+        self.result = {}
+
+    def on_data(self, datapoint: DataPoint) -> DataPoint:
+        builder = self.builders.get(datapoint.name)
+        if builder is None:
+            builder = self.builders[datapoint.name] = self.builder_class(datapoint.name, datapoint.tags)
+        builder.append(datapoint.timestamp, datapoint.value)
+        return datapoint
+
+    def on_batch(self, datapoints: list) -> list:
+        builders = self.builders
+        for dp in datapoints:
+            builder = builders.get(dp.name)
+            if builder is None:
+                builder = builders[dp.name] = self.builder_class(dp.name, dp.tags)
+            builder.append(dp.timestamp, dp.value)
+        return datapoints
+
+    def finish(self, datapoint: DataPoint) -> DataPoint:
+        for name, builder in self.builders.items():
+            if len(builder) > 0:
+                self.result.setdefault(name, []).append(builder.build())
+        return datapoint
+
+    def batches(self, name: str) -> list:
+        return self.result.get(name, [])
+
+    def to_pandas(self, name: str):
+        import pandas as pd
+        batches = self.batches(name)
+        if len(batches) == 1:
+            return batches[0].to_pandas()
+        return pd.concat([b.to_pandas() for b in batches], ignore_index=True)
+
+
+class RollupDataSink(DataSink):
+    """
+    roll up points of each series (name and tag values) by tumbling windows of `window`, and pass one point
+    per window to `sink`. each number field `f` becomes `f_min`, `f_max`, `f_mean`, `f_count` and `f_last`,
+    other fields keep the last value.
+
+    a window is passed when a later window of the series begins, late points are rolled up into the current
+    window. with `raw`, points are also passed to `sink`, and rollups are named with `suffix`.
+    """
+
+    def __init__(self, sink: DataSink, window: timedelta = timedelta(seconds=1), raw: bool = False,
+                 suffix: str = ''):
+        super(RollupDataSink, self).__init__()
+        self.sink = sink
+        self.window = window // timedelta(microseconds=1)
+        self.raw = raw
+        self.suffix = suffix if suffix or not raw else '_rollup'
+        # series => [window begin, {field: [min, max, sum, count, last]}, {field or tag: last value}, last datapoint]
+        self.series = {}
+
+    def on_data(self, datapoint: DataPoint) -> DataPoint:
+        self.on_batch([datapoint])
+        return datapoint
+
+    def on_batch(self, datapoints: list) -> list:
+        rollups = []
+        for dp in datapoints:
+            key = (dp.name, tuple(dp.value.get(t[0]) for t in dp.tags))
+            us = (dp.timestamp - _EPOCH) // _US
+            begin = us - us % self.window
+            state = self.series.get(key)
+            if state is None or begin > state[0]:
+                if state:
+                    rollups.append(self.make_rollup(state))
+                state = self.series[key] = [begin, {}, {}, dp]
+            state[3] = dp
+
+            stats, others = state[1], state[2]
+            for t in dp.tags:
+                if t[0] in dp.value:
+                    others[t[0]] = None
+            for k, v in dp.value.items():
+                if (type(v) is not int and type(v) is not float) or k in others:
+                    others[k] = v
+                    continue
+                st = stats.get(k)
+                if st is None:
+                    stats[k] = [v, v, v, 1, v]
+                    continue
+                if v < st[0]:
+                    st[0] = v
+                if v > st[1]:
+                    st[1] = v
+                st[2] += v
+                st[3] += 1
+                st[4] = v
+
+        if self.raw:
+            self.sink.on_batch(datapoints)
+        if rollups:
+            self.sink.on_batch(rollups)
+        return datapoints
+
+    def make_rollup(self, state: list) -> DataPoint:
+        begin, stats, others, last = state
+        value = dict(others)
+        for k, (min_v, max_v, sum_v, count, last_v) in stats.items():
+            value[k + '_min'] = min_v
+            value[k + '_max'] = max_v
+            value[k + '_mean'] = sum_v / count
+            value[k + '_count'] = count
+            value[k + '_last'] = last_v
+        return DataPoint(last.name + self.suffix, _EPOCH + begin * _US, value, last.tags, dict(last.meta))
+
+    def finish(self, datapoint: DataPoint) -> DataPoint:
+        rollups = [self.make_rollup(state) for state in self.series.values()]
+        self.series = {}
+        if rollups:
+            self.sink.on_batch(rollups)
+        return self.sink.finish(datapoint)
+
+
 class PatternMatchReporter(DataSink):
     def __init__(self):
         super().__init__()
@@ -119,6 +338,13 @@ class PatternMatchReporter(DataSink):
             self.result[id] += 1
         return datapoint
 
+    def on_batch(self, datapoints: list) -> list:
+        for id, count in Counter([dp.meta.get('id', '') for dp in datapoints]).items():
+            if not id:
+                continue
+            self.result[id] = self.result.get(id, 0) + count
+        return datapoints
+
     def finish(self, datapoint: DataPoint) -> DataPoint:
         click.echo(click.style('Pattern Match Result:', fg='green', bold=True))
         # click.echo(click.style('  {:<28s} : {}'.format('Begin Time', min_dt), fg='red'))
@@ -0,0 +1,237 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+cache of query results in front of a time series database.
+
+results are cached by time segments of (measurement, fields, tags, filters), a query only fetches the
+sub-ranges which are not cached yet and merges them with cached segments.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from coffee.data.columnar import ColumnarBatch
+from coffee.data.database import TimeSeriesDatabase, TimeRange, columnar_to_points
+from coffee.data.lineprotocol import measurement_name
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+
+def missing_ranges(segments: list, begin: int, end: int) -> list:
+    """
+    sub-ranges of [begin, end) not covered by sorted segments of (begin, end, ...).
+    """
+    missing = []
+    pos = begin
+    for b, e, _ in segments:
+        if e <= pos:
+            continue
+        if b >= end:
+            break
+        if b > pos:
+            missing.append((pos, b))
+        pos = max(pos, e)
+    if pos < end:
+        missing.append((pos, end))
+    return missing
+
+
+def merge_segments(segments: list) -> list:
+    """
+    merge adjacent segments of sorted (begin, end, batch).
+    """
+    merged = []
+    for seg in segments:
+        if merged and merged[-1][1] == seg[0]:
+            b, _, batch = merged[-1]
+            merged[-1] = (b, seg[1], ColumnarBatch.concat([batch, seg[2]]))
+        else:
+            merged.append(seg)
+    return merged
+
+
+class CachedTimeSeriesDatabase(TimeSeriesDatabase):
+    """
+    cache results of `select` in front of `db`, which should support `select_numpy`.
+
+    entries over `max_memory` bytes are moved to `disk_path` if it's set, and files over `max_disk` bytes
+    are removed, both in LRU order. ranges later than `settle_time` before now are always fetched since
+    points may still be coming. inserting (including `insert_lines`) through this wrapper invalidates entries
+    of the measurement.
+
+    queries without a closed time range are not cached.
+    """
+    def __init__(self, db: TimeSeriesDatabase, max_memory: int = 256 * 1024 * 1024, disk_path: str = '',
+                 max_disk: int = 1024 * 1024 * 1024, settle_time: timedelta = timedelta(seconds=60)):
+        self.db = db
+        self.max_memory = max_memory
+        self.disk_path = disk_path
+        self.max_disk = max_disk
+        self.settle_time = settle_time
+        self.lock = threading.Lock()
+        # key => sorted list of (begin, end, batch), begin and end are microseconds like `ColumnarBatch`
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.memory = 0
+        self.disk = 0
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+            self.disk = sum(os.path.getsize(f) for f in self.disk_files())
+
+    def __getattr__(self, name):
+        # other methods of the database
+        if name == 'db':
+            raise AttributeError(name)
+        attr = getattr(self.db, name)
+        if name == 'insert_lines':
+            # only forwarded if the database has line protocol, lines invalidate entries of their measurements
+            def insert_lines(lines):
+                lines = [line for line in lines if line]
+                for table in set(measurement_name(line) for line in lines):
+                    self.invalidate(table)
+                return attr(lines)
+            return insert_lines
+        return attr
+
+    def connect(self):
+        return self.db.connect()
+
+    def disconnect(self):
+        return self.db.disconnect()
+
+    def insert(self, fields, table, tags, dt):
+        self.invalidate(table)
+        return self.db.insert(fields, table, tags, dt)
+
+    def insert_batch(self, records):
+        for table in set(r[1] for r in records):
+            self.invalidate(table)
+        return self.db.insert_batch(records)
+
+    def finish(self):
+        return self.db.finish()
+
+    def select(self, fields, table, tags, time_range, filters=''):
+        """
+        rows in dict with time in RFC3339 like InfluxDB.
+        """
+        return columnar_to_points(self.select_numpy(fields, table, tags, time_range, filters))
+
+    def select_numpy(self, fields, table, tags, time_range, filters=''):
+        if not time_range or not time_range.begin or not time_range.end:
+            return self.db.select_numpy(fields, table, tags, time_range, filters)
+
+        fields = [fields, ] if type(fields) == str else fields
+        key = (table, tuple(sorted(fields)), tuple(sorted((k, str(v)) for k, v in tags.items())), filters)
+        begin = (time_range.begin - _EPOCH) // _US
+        end = (time_range.end - _EPOCH) // _US
+        settled = min(end, (datetime.now() - self.settle_time - _EPOCH) // _US)
+
+        with self.lock:
+            segments = list(self.lookup(key))
+
+        fetched = []
+        for b, e in missing_ranges(segments, begin, settled) if begin < settled else []:
+            fetched.append((b, e, self.fetch(fields, table, tags, b, e, filters)))
+        if fetched:
+            segments = merge_segments(sorted(segments + fetched, key=lambda s: s[0]))
+            with self.lock:
+                self.store(key, segments)
+
+        batches = [batch.time_slice(begin, end) for b, e, batch in segments if b < end and e > begin]
+        if settled < end:
+            batches.append(self.fetch(fields, table, tags, max(begin, settled), end, filters))
+        batches = [b for b in batches if len(b)]
+        return ColumnarBatch.concat(batches)
+
+    def fetch(self, fields, table, tags, begin: int, end: int, filters: str) -> ColumnarBatch:
+        time_range = TimeRange(_EPOCH + begin * _US, _EPOCH + end * _US)
+        batch = self.db.select_numpy(fields, table, tags, time_range, filters)
+        if batch is None:
+            batch = ColumnarBatch(table, np.empty(0, dtype=np.int64), {}, [])
+        return batch
+
+    def invalidate(self, table: str = None):
+        """
+        remove entries of a measurement, or all entries.
+        """
+        with self.lock:
+            for key in [k for k in self.entries.keys() if table is None or k[0] == table]:
+                self.memory -= self.sizes.pop(key)
+                del self.entries[key]
+            prefix = self.table_prefix(table) if table is not None else ''
+            for path in self.disk_files():
+                if os.path.basename(path).startswith(prefix):
+                    self.disk -= os.path.getsize(path)
+                    os.remove(path)
+
+    def lookup(self, key) -> list:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        path = self.key_path(key)
+        if path and os.path.exists(path):
+            self.disk -= os.path.getsize(path)
+            _, segments = self.load_file(path)
+            os.remove(path)
+            self.store(key, segments)
+            return segments
+        return []
+
+    def store(self, key, segments: list):
+        if key in self.entries:
+            self.memory -= self.sizes[key]
+        self.entries[key] = segments
+        self.entries.move_to_end(key)
+        self.sizes[key] = sum(s[2].nbytes() for s in segments)
+        self.memory += self.sizes[key]
+
+        while self.memory > self.max_memory and len(self.entries) > 1:
+            old_key, old_segments = self.entries.popitem(last=False)
+            self.memory -= self.sizes.pop(old_key)
+            if self.disk_path:
+                self.spill(old_key, old_segments)
+
+    def spill(self, key, segments: list):
+        path = self.key_path(key)
+        with open(path, 'wb') as f:
+            pickle.dump((key, segments), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.disk += os.path.getsize(path)
+
+        # least recently used file is the oldest one
+        for old in sorted(self.disk_files(), key=os.path.getmtime):
+            if self.disk <= self.max_disk:
+                break
+            self.disk -= os.path.getsize(old)
+            os.remove(old)
+
+    @staticmethod
+    def table_prefix(table: str) -> str:
+        """
+        files of a measurement start with the hash of its name, so they can be invalidated without loading.
+        """
+        return hashlib.sha1(table.encode()).hexdigest()[:16] + '-'
+
+    def key_path(self, key) -> str:
+        if not self.disk_path:
+            return ''
+        name = self.table_prefix(key[0]) + hashlib.sha1(repr(key).encode()).hexdigest() + '.cache'
+        return os.path.join(self.disk_path, name)
+
+    def disk_files(self) -> list:
+        if not self.disk_path:
+            return []
+        return [os.path.join(self.disk_path, f) for f in os.listdir(self.disk_path) if f.endswith('.cache')]
+
+    @staticmethod
+    def load_file(path: str):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,203 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+write-ahead spool of line protocol strings on local disk.
+
+lines are appended to segment files at disk speed, and drainers replay segments to databases, so
+parsing doesn't wait for a slow database and a run can be re-sent to another database later.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class LineSpool:
+    """
+    directory of append-only segment files, a new segment is started when the current one is larger than
+    `segment_size` bytes, or when the spool is opened again.
+    """
+    SUFFIX = '.lp'
+
+    def __init__(self, path: str, segment_size: int = 64 * 1024 * 1024, sync: bool = False):
+        self.path = path
+        self.segment_size = segment_size
+        # fsync on flush, data survives power failure but is slower
+        self.sync = sync
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 0
+        self.file = None
+
+    def segments(self) -> list:
+        """
+        indexes of all segments in order.
+        """
+        return sorted(int(f[:-len(self.SUFFIX)]) for f in os.listdir(self.path) if f.endswith(self.SUFFIX))
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f'{segment:010d}{self.SUFFIX}')
+
+    def append(self, lines):
+        """
+        append lines, they are visible to drainers after `flush`.
+        """
+        data = '\n'.join(line for line in lines if line)
+        if not data:
+            return
+        with self.lock:
+            if not self.file:
+                self.file = open(self.segment_path(self.segment), 'ab')
+            self.file.write(data.encode('utf-8') + b'\n')
+            if self.file.tell() >= self.segment_size:
+                self.file.close()
+                self.file = None
+                self.segment += 1
+
+    def flush(self):
+        with self.lock:
+            if not self.file:
+                return
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class SpoolDrainer:
+    """
+    replay segments of a spool to a database from the checkpoint of `name`, progress is saved after
+    each batch is written, so lines are written at least once after a restart or an error.
+
+    drainers with different names replay the same spool independently, e.g. to a second database.
+    """
+    def __init__(self, spool: LineSpool, db, name: str = 'default', read_size: int = 4 * 1024 * 1024,
+                 interval: float = 1.0, remove_drained: bool = False):
+        self.spool = spool
+        self.db = db
+        self.name = name
+        self.read_size = read_size
+        self.interval = interval
+        # remove segments which are replayed, only for a single drainer
+        self.remove_drained = remove_drained
+        self.checkpoint_path = os.path.join(spool.path, f'{name}.checkpoint')
+        self.segment, self.offset = self.load_checkpoint()
+        self.errors = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return 0, 0
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        return checkpoint['segment'], checkpoint['offset']
+
+    def save_checkpoint(self):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segment': self.segment, 'offset': self.offset}, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def pending(self) -> int:
+        """
+        bytes flushed to the spool but not replayed yet.
+        """
+        total = 0
+        for segment in self.spool.segments():
+            if segment < self.segment:
+                continue
+            size = os.path.getsize(self.spool.segment_path(segment))
+            total += size - self.offset if segment == self.segment else size
+        return total
+
+    def drain_once(self) -> int:
+        """
+        replay lines until the end of the spool.
+
+        :return number of lines written.
+        """
+        count = 0
+        while True:
+            segments = [s for s in self.spool.segments() if s >= self.segment]
+            if not segments:
+                return count
+            if segments[0] != self.segment:
+                # the segment of checkpoint was removed
+                self.segment, self.offset = segments[0], 0
+
+            with open(self.spool.segment_path(self.segment), 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(self.read_size)
+                # a line may be longer than `read_size`
+                while data and b'\n' not in data[-self.read_size:]:
+                    more = f.read(self.read_size)
+                    if not more:
+                        break
+                    data += more
+            end = data.rfind(b'\n') + 1
+            if end:
+                lines = data[:end].decode('utf-8', errors='ignore').splitlines()
+                self.db.insert_lines(lines)
+                self.db.finish()
+                count += len(lines)
+                self.offset += end
+                self.save_checkpoint()
+                continue
+
+            if len(segments) == 1:
+                # the segment is being written
+                return count
+            # move to the next segment, a torn line without newline at the end is dropped
+            drained = self.segment
+            self.segment, self.offset = segments[1], 0
+            self.save_checkpoint()
+            if self.remove_drained:
+                os.remove(self.spool.segment_path(drained))
+
+    def start(self):
+        """
+        replay in a background thread until `stop`.
+        """
+        if self.thread:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                if self.drain_once():
+                    continue
+            except Exception as e:
+                # retry from the checkpoint later
+                self.errors.append(e)
+            self.stopped.wait(self.interval)
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        wait until all flushed lines are replayed.
+
+        :return False if timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending() > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.interval, 0.05))
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
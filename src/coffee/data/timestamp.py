@@ -0,0 +1,240 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+recognize timestamps of log lines.
+
+lines of a log almost always have the same timestamp format at the same position, so the format is
+learned from the first lines, then the timestamp is parsed by slicing at fixed offsets. the timestamp
+patterns are tried one by one only when the fast path fails, or when a pattern before the learned one
+may match the line, so the result is always the one of the first matching pattern.
+"""
+
+import re
+from datetime import datetime
+
+from coffee.core.utils import merge_datetime
+from coffee.data.dataextractor import RegexPattern
+
+_DIGIT = re.compile(r'\d')
+_BYTES_DIGIT = re.compile(rb'\d')
+
+
+class TimestampLayout:
+    """
+    fixed-offset layout of a timestamp in a line, learned from a regex match.
+    """
+    def __init__(self, offset, length, fields, separators, prev_char, next_char):
+        # offset of the timestamp in the line and its length
+        self.offset = offset
+        self.length = length
+        # (name, begin, end) of every field, relative to the timestamp
+        self.fields = fields
+        # (begin, end, text) of texts between fields
+        self.separators = separators
+        self.prev_char = prev_char
+        self.next_char = next_char
+
+        # fields before millisecond are the key of the datetime cache
+        self.ms_field = fields[-1] if fields[-1][0] == 'millisecond' else None
+        self.key_length = self.ms_field[1] if self.ms_field else length
+        self.key_fields = [f for f in fields if f is not self.ms_field]
+        self.key_separators = [s for s in separators if s[1] <= self.key_length]
+        self.ms_separators = [s for s in separators if s[1] > self.key_length]
+        self.check_prefix = offset > 0 and fields[0][1] == 0
+
+        self.cache_key = None
+        self.cache_datetime = None
+
+    def __eq__(self, other):
+        return isinstance(other, TimestampLayout) and self.signature() == other.signature()
+
+    def signature(self):
+        return self.offset, self.length, self.fields, self.separators, self.prev_char, self.next_char
+
+    @staticmethod
+    def create(m, begin: int, end: int, t: RegexPattern):
+        """
+        create a layout by the match of a timestamp pattern, None if it can't be parsed at fixed offsets.
+        """
+        names = list(t.fields.keys())
+        if m.re.groups != len(names) or any(v is not int for v in t.fields.values()):
+            return None
+        # values changed by processors can't be parsed at fixed offsets
+        if getattr(t, 'processors', None):
+            return None
+        if 'millisecond' in names and names[-1] != 'millisecond':
+            return None
+
+        s = m.string
+        offset = m.start() - begin
+        # the match can only be found at the same offset if no earlier match is possible
+        if offset > 0 and m.start(1) != m.start():
+            return None
+
+        fields = []
+        separators = []
+        pos = m.start()
+        for idx, name in enumerate(names):
+            b, e = m.span(idx + 1)
+            if b < pos or b == e:
+                return None
+            if b > pos:
+                separators.append((pos - m.start(), b - m.start(), s[pos:b]))
+            fields.append((name, b - m.start(), e - m.start()))
+            pos = e
+        if pos < m.end():
+            separators.append((pos - m.start(), m.end() - m.start(), s[pos:m.end()]))
+
+        prev_char = s[m.start() - 1:m.start()] if offset > 0 else None
+        next_char = s[m.end():m.end() + 1] if m.end() < end else s[0:0]
+        return TimestampLayout(offset, m.end() - m.start(), tuple(fields), tuple(separators),
+                               prev_char, next_char)
+
+    def parse(self, s, begin: int, end: int, base_datetime: datetime):
+        """
+        parse the timestamp of line s[begin:end], None if the line doesn't fit this layout.
+        """
+        o = begin + self.offset
+        e = o + self.length
+        if e > end:
+            return None
+        if self.prev_char is not None and s[o - 1:o] != self.prev_char:
+            return None
+        if (s[e:e + 1] if e < end else s[0:0]) != self.next_char:
+            return None
+        if self.check_prefix:
+            digit = _DIGIT if isinstance(s, str) else _BYTES_DIGIT
+            if digit.search(s, begin, o):
+                return None
+
+        try:
+            key = s[o:o + self.key_length]
+            if key != self.cache_key:
+                for sb, se, text in self.key_separators:
+                    if key[sb:se] != text:
+                        return None
+                kv = {}
+                for name, fb, fe in self.key_fields:
+                    v = key[fb:fe]
+                    if not v.isdigit():
+                        return None
+                    kv[name] = int(v)
+                self.cache_datetime = merge_datetime(base_datetime, kv)
+                self.cache_key = key
+
+            if not self.ms_field:
+                return self.cache_datetime
+            for sb, se, text in self.ms_separators:
+                if s[o + sb:o + se] != text:
+                    return None
+            v = s[o + self.ms_field[1]:o + self.ms_field[2]]
+            if not v.isdigit():
+                return None
+            # the same as `merge_datetime`
+            return self.cache_datetime.replace(microsecond=int(v))
+        except ValueError:
+            return None
+
+
+class TimestampRecognizer:
+    """
+    parse timestamp of lines by the learned layout, and fall back to timestamp patterns.
+
+    the layout is learned when `learn_lines` continuous timestamps have the same layout,
+    and it will be learned again after `learn_lines` continuous failures. learning stops if no layout
+    is found in `learn_lines * 16` timestamps.
+    """
+    def __init__(self, ts_patterns: list, base_datetime: datetime, learn_lines: int = 8):
+        self.ts_patterns = ts_patterns
+        self.base_datetime = base_datetime
+        self.learn_lines = learn_lines
+        self.layout = None
+        self.candidate = None
+        self.votes = 0
+        self.misses = 0
+        self.attempts = 0
+        # index of the pattern of the layout, and regexes of the patterns before it
+        self.layout_index = None
+        self.candidate_index = None
+        self.guard = None
+        self.guards = [self.make_guard(ts_patterns[:idx]) for idx in range(len(ts_patterns))]
+
+    @staticmethod
+    def make_guard(patterns: list):
+        """
+        (str regex, bytes regex) matching any of the patterns, (None, None) for no pattern,
+        or None if the patterns can't be searched at once.
+        """
+        if not patterns:
+            return None, None
+        if not all(isinstance(t, RegexPattern) for t in patterns):
+            return None
+        regex = '|'.join(f'(?:{t.pattern})' for t in patterns)
+        return re.compile(regex), re.compile(regex.encode('utf-8'), re.MULTILINE)
+
+    def parse(self, line: str):
+        """
+        :return datetime of this line, None if no timestamp found.
+        """
+        return self.parse_range(line, 0, len(line))
+
+    def parse_bytes(self, buf, begin: int, end: int):
+        """
+        :return datetime of line buf[begin:end], None if no timestamp found.
+        """
+        return self.parse_range(buf, begin, end)
+
+    def parse_range(self, s, begin: int, end: int):
+        is_bytes = not isinstance(s, str)
+        if self.layout:
+            guard = self.guard[1 if is_bytes else 0]
+            # patterns before the layout's have priority
+            if not guard or not (guard.search(s, begin, end) if is_bytes else guard.search(s)):
+                dt = self.layout.parse(s, begin, end, self.base_datetime)
+                if dt:
+                    self.misses = 0
+                    return dt
+
+        for idx, t in enumerate(self.ts_patterns):
+            if not isinstance(t, RegexPattern):
+                ts = t.match(s[begin:end].decode('utf-8', errors='ignore') if is_bytes else s[begin:end])
+                if ts:
+                    return merge_datetime(self.base_datetime, ts)
+                continue
+
+            ts = t.match_bytes(s, begin, end) if is_bytes else t.match(s)
+            # early break when find ts
+            if ts:
+                self.learn(idx, s, begin, end, is_bytes)
+                return merge_datetime(self.base_datetime, ts)
+        return None
+
+    def learn(self, idx: int, s, begin: int, end: int, is_bytes: bool):
+        if self.layout:
+            self.misses += 1
+            if self.misses < self.learn_lines:
+                return
+            self.layout = None
+            self.attempts = 0
+        if self.attempts >= self.learn_lines * 16 or self.guards[idx] is None:
+            return
+        self.attempts += 1
+
+        t = self.ts_patterns[idx]
+        m = t.get_bytes_regex().search(s, begin, end) if is_bytes else t.get_regex().search(s)
+        layout = TimestampLayout.create(m, begin, end, t) if m else None
+        if layout and layout == self.candidate and idx == self.candidate_index:
+            self.votes += 1
+        else:
+            self.candidate = layout
+            self.candidate_index = idx
+            self.votes = 1
+        if self.candidate and self.votes >= self.learn_lines:
+            self.layout = self.candidate
+            self.layout_index = self.candidate_index
+            self.guard = self.guards[self.layout_index]
+            self.candidate = None
+            self.votes = 0
+            self.misses = 0
+            self.attempts = 0
@@ -5,9 +5,14 @@
 万物负阴而抱阳，冲气以为和。
 """
 
+import hashlib
+import heapq
 import io
+import mmap
 import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 from rich.console import Console
@@ -16,11 +21,66 @@ from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 
 from coffee.data import (
-    RegexPattern, PatternGroupBuilder, PatternGroup, DataPoint, DataLoader,
-    PatternMatchReporter, DatapointTimeTracker, DataSink
+    RegexPattern, PatternGroupBuilder, PatternGroup, CompiledPatternGroup, DataPoint, DataLoader,
+    PatternMatchReporter, DatapointTimeTracker, DataSink, DEFAULT_TS_PATTERNS, TimestampRecognizer, DataStore
 )
-from coffee.core.utils import merge_datetime
 from coffee.logkit.utils.logtail import LogTail
+from coffee.logkit.utils.parsecache import PointRecorder, file_fingerprint, recorded_points
+from coffee.logkit.utils.filechunk import split_file_ranges, split_buffer_ranges
+from coffee.logkit.utils.bytescan import BytesLineScanner
+
+
+def match_line(matcher: CompiledPatternGroup, recognizer: TimestampRecognizer, line: str):
+    """
+    match timestamp and data patterns of a compiled group in a single line.
+
+    :return datetime of this line (None if no timestamp found) and a list of (pattern index, value).
+    """
+    return recognizer.parse(line), matcher.match(line)
+
+
+# compiled pattern group used in the worker process, set by `_init_chunk_worker`
+_chunk_matcher = None
+_chunk_recognizer = None
+_chunk_use_mmap = False
+
+
+def _init_chunk_worker(group: PatternGroup, base_datetime: datetime, use_mmap: bool = False):
+    global _chunk_matcher, _chunk_recognizer, _chunk_use_mmap
+    _chunk_matcher = group.compile()
+    _chunk_recognizer = TimestampRecognizer(group.get_ts_patterns(), base_datetime)
+    _chunk_use_mmap = use_mmap
+
+
+def _parse_chunk(path: str, begin: int, end: int):
+    """
+    parse lines in [begin, end) of a file in the worker process.
+
+    lines before the first timestamp of this chunk get a `None` datetime, the caller should fill them
+    with the datetime carried from the previous chunk.
+
+    :return list of (pattern index, datetime, value, line number in this chunk), the last datetime found
+    in this chunk and the number of lines in this chunk.
+    """
+    if _chunk_use_mmap:
+        with io.open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return BytesLineScanner(_chunk_matcher, _chunk_recognizer).scan(mm, begin, end)
+
+    with io.open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(end - begin)
+
+    points = []
+    prev_datetime = None
+    lines = 0
+    for line_no, line in enumerate(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='ignore')):
+        dt, matches = match_line(_chunk_matcher, _chunk_recognizer, line)
+        if dt:
+            prev_datetime = dt
+        for idx, r in matches:
+            points.append((idx, prev_datetime, r, line_no))
+        lines = line_no + 1
+    return points, prev_datetime, lines
 
 
 class LineSink:
@@ -30,6 +90,12 @@ class LineSink:
     def on_line(self, filename: str, line: str):
         pass
 
+    def flush(self):
+        """
+        no more lines for now.
+        """
+        pass
+
 
 class LogWatchHandler(FileSystemEventHandler):
     """
@@ -55,6 +121,7 @@ class LogWatchHandler(FileSystemEventHandler):
                 self.line_sink.on_line(event.src_path, line)
             else:
                 break
+        self.line_sink.flush()
 
     def on_created(self, event):
         pass
@@ -83,21 +150,44 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
         only_new=False
     ).set_pattern_group(group).start()
     ```
+
+    offline loading can be parallelized by `workers`, the file is split into chunks of `chunk_size` bytes
+    and parsed in a process pool, datapoints are still fed to sinks in file order.
+    patterns and their processors should be picklable if the platform spawns worker processes.
+
+    datapoints are delivered to sinks in batches of `batch_size`, see `DataSink.on_batch`.
+
+    `use_mmap` maps the file to memory and scans it with bytes regexes, lines are split by b'\\n' and only
+    the captured fields are decoded. it works with `workers` too.
+
+    with `cache`, points of every pattern are saved to the data store by fingerprints of the file content,
+    timestamp patterns and the pattern, and replayed to sinks next time instead of parsing, only patterns
+    not cached are parsed. replayed points are in log order, points of the same line are in pattern order.
+    `base_datetime` is in the fingerprint if it's given, or else its date is if some timestamp pattern has
+    no date (so such a cache only lives for a day), and patterns with converters or processors whose state can't be fingerprinted are always parsed.
     """
+    CACHE_TYPE = 'parsed_log_v2'
+
     def __init__(self,
                  path: str,
                  live_watch: str = '',
-                 base_datetime: datetime = datetime.now(),
+                 base_datetime: datetime = None,
                  show_progress: bool = False,
                  show_match_result: bool = False,
                  custom_time_tracker: DataSink = None,
-                 only_new: bool = False):
-        DataLoader.__init__(self)
+                 only_new: bool = False,
+                 workers: int = 0,
+                 chunk_size: int = 32 * 1024 * 1024,
+                 use_mmap: bool = False,
+                 batch_size: int = 1000,
+                 cache: DataStore = None):
+        DataLoader.__init__(self, batch_size)
         PatternGroupBuilder.__init__(self)
         LineSink.__init__(self)
 
         self.path = os.path.abspath(path)
-        self.base_datetime = base_datetime
+        self.base_datetime = base_datetime if base_datetime else datetime.now()
+        self.fixed_base_datetime = base_datetime is not None
         self.show_progress = show_progress
         if show_match_result:
             self.add_sink(PatternMatchReporter())
@@ -107,6 +197,17 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
             self.event_handler = None
         self.observer = PollingObserver()
         self.prev_datetime = None
+        # number of lines parsed, points are recorded with their line numbers
+        self.lines = 0
+        self.matcher = None
+        self.recognizer = None
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self.cache = cache
+        # pattern index => recorder of points for the cache
+        self.recorders = None
+        self.record_only = False
 
         if not custom_time_tracker:
             self.time_tracker = DatapointTimeTracker()
@@ -117,8 +218,24 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
 
     def set_pattern_group(self, group: PatternGroup):
         self.pattern_group = group
+        self.matcher = None
+        self.recognizer = None
         return self
 
+    @staticmethod
+    def make_datapoint(p: RegexPattern, dt: datetime, value: dict) -> DataPoint:
+        return DataPoint(
+            name=p.get_name(),
+            timestamp=dt,
+            value=value,
+            tags=p.get_tags(),
+            meta={
+                'name': p.get_name(),
+                'id': p.get_unique_id(),
+                'tags': p.get_tags(),
+            }
+        )
+
     def on_line(self, filename: str, line: str):
         # print(f'{filename} : {line}')
         if not line:
@@ -126,47 +243,83 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
             dp = self.finish(dp)
             return dp
 
-        # timestamp pattern in logs
-        PTS = self.pattern_group.get_ts_patterns()
-        # data pattern in logs
-        PDT = self.pattern_group.get_patterns()
-
-        # match time
-        ts = None
-        for t in PTS:
-            ts = t.match(line)
-            # early break when find ts
-            if ts:
-                break
-
-        if not ts:
+        if not self.matcher:
+            self.compile()
+        line_no = self.lines
+        self.lines += 1
+        dt, matches = match_line(self.matcher, self.recognizer, line)
+        if not dt:
             if not self.prev_datetime:
                 return
             dt = self.prev_datetime
         else:
-            dt = merge_datetime(self.base_datetime, ts)
             self.prev_datetime = dt
 
-        for p in PDT:
-            # match data
-            r = p.match(line)
-            if not r:
+        # data pattern in logs
+        for idx, r in matches:
+            self.on_match(idx, dt, r, line_no)
+
+    def on_match(self, idx: int, dt: datetime, value: dict, line_no: int):
+        if self.recorders is not None:
+            self.recorders[idx].append(line_no, dt, value)
+            if self.record_only:
+                return
+        self.feed(self.make_datapoint(self.matcher.patterns[idx], dt, value))
+
+    def load_parallel(self, progress=None, task=None):
+        """
+        parse the file in a process pool, and merge the results in file order.
+        """
+        ranges = split_file_ranges(self.path, self.chunk_size)
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_chunk_worker,
+                                 initargs=(self.pattern_group, self.base_datetime, self.use_mmap)) as executor:
+            # limit the pending chunks, so results will not pile up in memory
+            pending = deque()
+            for begin, end in ranges:
+                pending.append((end - begin, executor.submit(_parse_chunk, self.path, begin, end)))
+                if len(pending) < self.workers * 2:
+                    continue
+                self.on_chunk_result(*pending.popleft(), progress, task)
+            while pending:
+                self.on_chunk_result(*pending.popleft(), progress, task)
+
+    def load_mmap(self, progress=None, task=None):
+        """
+        scan the memory mapped file with bytes regexes, progress is reported by byte offset.
+        """
+        if os.path.getsize(self.path) == 0:
+            return
+        scanner = BytesLineScanner(self.matcher, self.recognizer)
+        with io.open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for begin, end in split_buffer_ranges(mm, self.chunk_size):
+                self.on_chunk_points(*scanner.scan(mm, begin, end))
+                if progress is not None and task is not None:
+                    progress.update(task, advance=end - begin)
+
+    def on_chunk_result(self, size, future, progress=None, task=None):
+        self.on_chunk_points(*future.result())
+        if progress is not None and task is not None:
+            progress.update(task, advance=size)
+
+    def on_chunk_points(self, points, last_datetime, lines):
+        for idx, dt, r, line_no in points:
+            # carry the timestamp over the chunk boundary
+            dt = dt if dt else self.prev_datetime
+            if not dt:
                 continue
+            self.on_match(idx, dt, r, self.lines + line_no)
+        if last_datetime:
+            self.prev_datetime = last_datetime
+        self.lines += lines
 
-            dp = DataPoint(
-                name=p.get_name(),
-                timestamp=dt,
-                value=r,
-                tags=p.get_tags(),
-                meta={
-                    'name': p.get_name(),
-                    'id': p.get_unique_id(),
-                    'tags': p.get_tags(),
-                }
-            )
-            dp = self.on_data(dp)
+    def compile(self):
+        self.matcher = self.pattern_group.compile()
+        self.recognizer = TimestampRecognizer(self.pattern_group.get_ts_patterns(), self.base_datetime)
 
     def start(self):
+        # patterns may be changed before starting
+        self.compile()
         if self.event_handler:
             self.observer.schedule(self.event_handler, self.path)
             self.observer.start()
@@ -177,6 +330,29 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
             finally:
                 self.observer.stop()
                 self.observer.join()
+        elif self.cache is not None:
+            self.load_cached()
+        else:
+            self.load()
+
+        dp = DataPoint.make_meta_datapoint({})
+        dp = self.finish(dp)
+        return dp
+
+    def load(self):
+        """
+        parse the whole file offline.
+        """
+        self.lines = 0
+        if self.workers > 1 or self.use_mmap:
+            with Progress(console=Console(stderr=True)) as progress:
+                task = None
+                if self.show_progress:
+                    task = progress.add_task("Parsing...", total=os.path.getsize(self.path))
+                if self.workers > 1:
+                    self.load_parallel(progress, task)
+                else:
+                    self.load_mmap(progress, task)
         else:
             # get lines of this log
             lines = 0
@@ -196,9 +372,79 @@ class LogFileDataLoader(DataLoader, PatternGroupBuilder, LineSink):
 
                     self.on_line("", line)
 
-        dp = DataPoint.make_meta_datapoint({})
-        dp = self.finish(dp)
-        return dp
+    def cache_ids(self) -> list:
+        """
+        cache id of every pattern, None if it can't be cached.
+        """
+        patterns = self.pattern_group.get_patterns()
+        ts_patterns = self.pattern_group.get_ts_patterns()
+        ts = [p.get_fingerprint() for p in ts_patterns]
+        if None in ts:
+            return [None] * len(patterns)
+        # fields missing from timestamps are taken from `base_datetime`, which is now if not given
+        fields = [set(getattr(p, 'fields', None) or ()) for p in ts_patterns]
+        if self.fixed_base_datetime or any(not {'hour', 'minute', 'second'} <= f for f in fields):
+            ts.append(self.base_datetime.isoformat())
+        elif any(not {'year', 'month', 'day'} <= f for f in fields):
+            ts.append(self.base_datetime.date().isoformat())
+        prefix = f'{file_fingerprint(self.path)}-{hashlib.sha1(repr(ts).encode("utf-8")).hexdigest()}'
+        return [f'{prefix}-{fp}' if fp else None for fp in (p.get_fingerprint() for p in patterns)]
+
+    def load_cached(self):
+        """
+        replay cached points, patterns without cached points are parsed and saved first.
+        """
+        patterns = list(self.pattern_group.get_patterns())
+        cache_ids = self.cache_ids()
+        valid = [i for i, cache_id in enumerate(cache_ids) if cache_id]
+        cached = [None] * len(patterns)
+        for i, data in zip(valid, self.cache.fetch_many(self.CACHE_TYPE, [cache_ids[i] for i in valid])):
+            cached[i] = data
+        missing = [i for i, data in enumerate(cached) if data is None]
+
+        if len(missing) == len(patterns):
+            # nothing cached, points are fed while parsing
+            self.recorders = {i: PointRecorder(p.get_name(), p.get_tags()) for i, p in enumerate(patterns)}
+            try:
+                self.load()
+            finally:
+                recorders, self.recorders = self.recorders, None
+            self.save_cached(cache_ids, {i: r.build() for i, r in recorders.items()})
+            return
+
+        if missing:
+            # parse new patterns only, then replay them with the cached ones
+            group = self.pattern_group
+            self.pattern_group = PatternGroup(group.get_name(), [patterns[i] for i in missing],
+                                              group.get_ts_patterns())
+            self.compile()
+            self.recorders = {j: PointRecorder(patterns[i].get_name(), patterns[i].get_tags())
+                              for j, i in enumerate(missing)}
+            self.record_only = True
+            try:
+                self.load()
+            finally:
+                recorders, self.recorders = self.recorders, None
+                self.record_only = False
+                self.pattern_group = group
+                self.prev_datetime = None
+                self.compile()
+            parsed = {i: recorders[j].build() for j, i in enumerate(missing)}
+            self.save_cached(cache_ids, parsed)
+            cached = [parsed.get(i, data) for i, data in enumerate(cached)]
+        self.replay(patterns, cached)
+
+    def save_cached(self, cache_ids: list, parsed: dict):
+        self.cache.add_many(self.CACHE_TYPE, {cache_ids[i]: data for i, data in parsed.items() if cache_ids[i]})
+
+    def replay(self, patterns: list, cached: list):
+        def stream(idx, data):
+            for line_no, dt, value in recorded_points(data):
+                yield line_no, idx, dt, value
+
+        for _, idx, dt, value in heapq.merge(*[stream(i, data) for i, data in enumerate(cached)],
+                                             key=lambda point: (point[0], point[1])):
+            self.feed(self.make_datapoint(patterns[idx], dt, value))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+scan a large bytes buffer (such as a mmap of a log file) with a pattern group.
+
+the literals required by data patterns are searched in the whole buffer at once, patterns without
+literal search the whole buffer with their bytes regexes, so lines no pattern can match are never
+visited in python. only the candidate lines are matched again line by line, and only the captured
+fields are decoded.
+
+lines are split by b'\\n', a timestamp is only searched for the candidate lines and the lines
+before them. a trailing b'\\r' of lines is dropped before matching like reading the log in text mode.
+"""
+
+from coffee.data import CompiledPatternGroup, RegexPattern, TimestampRecognizer
+
+
+def is_bytes_pattern(p) -> bool:
+    """
+    whether a pattern can be matched by bytes regex, other patterns should be matched after decoding.
+    """
+    return isinstance(p, RegexPattern) and p.is_bytes_compatible()
+
+
+class BytesLineScanner:
+    def __init__(self, matcher: CompiledPatternGroup, recognizer: TimestampRecognizer):
+        self.matcher = matcher
+        self.recognizer = recognizer
+        self.patterns = matcher.patterns
+
+    @staticmethod
+    def match(p, buf, begin: int, end: int) -> dict:
+        if buf[end - 2:end] == b'\r\n':
+            # CRLF is read as b'\n' in text mode
+            line = buf[begin:end - 2] + b'\n'
+            begin, end, buf = 0, len(line), line
+        if is_bytes_pattern(p):
+            return p.match_bytes(buf, begin, end)
+        return p.match(buf[begin:end].decode('utf-8', errors='ignore'))
+
+    def search_datetime(self, buf, begin: int, end: int):
+        """
+        search the last timestamp in lines of [begin, end), end should be the start of a line.
+        """
+        while end > begin:
+            line_begin = max(buf.rfind(b'\n', begin, end - 1) + 1, begin)
+            dt = self.recognizer.parse_bytes(buf, line_begin, end)
+            if dt:
+                return dt
+            end = line_begin
+        return None
+
+    @staticmethod
+    def line_range(buf, pos: int, begin: int, end: int):
+        """
+        the line holding `pos`, it is limited in [begin, end).
+        """
+        line_begin = max(buf.rfind(b'\n', begin, pos) + 1, begin)
+        line_end = buf.find(b'\n', pos, end)
+        return line_begin, end if line_end < 0 else line_end + 1
+
+    def candidates(self, buf, begin: int, end: int) -> dict:
+        """
+        find lines which may be matched by data patterns.
+
+        :return line begin => (line end, set of pattern indexes)
+        """
+        lines = {}
+        regex = self.matcher.literal_bytes_regex
+        pos = begin
+        while regex and pos < end:
+            m = regex.search(buf, pos, end)
+            if not m:
+                break
+            line_begin, line_end = self.line_range(buf, m.start(), begin, end)
+            lines[line_begin] = (line_end, set(self.matcher.candidates_bytes(buf[line_begin:line_end])))
+            pos = line_end
+
+        # `$` doesn't match before b'\r\n' in the buffer
+        crlf = buf.find(b'\r\n', begin, end) >= 0
+        for idx in self.matcher.always:
+            p = self.patterns[idx]
+            if not is_bytes_pattern(p) or (crlf and '$' in p.pattern):
+                # every line is a candidate
+                pos = begin
+                while pos < end:
+                    line_begin, line_end = self.line_range(buf, pos, begin, end)
+                    lines.setdefault(line_begin, (line_end, set()))[1].add(idx)
+                    pos = line_end
+                continue
+
+            regex = p.get_bytes_regex()
+            pos = begin
+            while pos < end:
+                m = regex.search(buf, pos, end)
+                if not m or m.start() >= end:
+                    break
+                # a match may cross lines, the line it starts with is the candidate
+                line_begin, line_end = self.line_range(buf, m.start(), begin, end)
+                lines.setdefault(line_begin, (line_end, set()))[1].add(idx)
+                pos = line_end
+        return lines
+
+    def scan(self, buf, begin: int, end: int):
+        """
+        scan lines in [begin, end) of the buffer.
+
+        lines before the first timestamp of this range get a `None` datetime, the caller should fill them
+        with the datetime carried from the previous range.
+
+        :return list of (pattern index, datetime, value, line number in this range), the last datetime found
+        in this range and the number of lines in this range.
+        """
+        points = []
+        prev_datetime = None
+        # lines before `checked` have been searched for timestamp
+        checked = begin
+        # lines before `counted` have been counted
+        counted = begin
+        line_no = 0
+        lines = self.candidates(buf, begin, end)
+        for line_begin in sorted(lines.keys()):
+            line_end, indexes = lines[line_begin]
+            line_no += buf[counted:line_begin].count(b'\n')
+            counted = line_begin
+            dt = self.recognizer.parse_bytes(buf, line_begin, line_end)
+            if not dt:
+                dt = self.search_datetime(buf, checked, line_begin)
+            if dt:
+                prev_datetime = dt
+            checked = line_end
+
+            for idx in sorted(indexes):
+                r = self.match(self.patterns[idx], buf, line_begin, line_end)
+                if r:
+                    points.append((idx, prev_datetime, r, line_no))
+
+        dt = self.search_datetime(buf, checked, end)
+        return points, dt if dt else prev_datetime, line_no + buf[counted:end].count(b'\n')
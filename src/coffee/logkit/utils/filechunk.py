@@ -0,0 +1,58 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+split a file into byte ranges, every range begins at the start of a line and ends after a line break.
+"""
+
+import io
+import os
+
+
+def split_file_ranges(path: str, chunk_size: int) -> list:
+    """
+    split file to ranges with the size about `chunk_size` bytes.
+
+    :param path: file path.
+    :param chunk_size: expected size of every range.
+    :return list of (begin, end) pairs, `end` is not included.
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        return []
+    chunk_size = max(1, chunk_size)
+
+    ranges = []
+    with io.open(path, 'rb') as f:
+        begin = 0
+        while begin < file_size:
+            end = begin + chunk_size
+            if end >= file_size:
+                end = file_size
+            else:
+                # move to the end of current line
+                f.seek(end - 1)
+                f.readline()
+                end = f.tell()
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+def split_buffer_ranges(buf, chunk_size: int) -> list:
+    """
+    split a bytes buffer (or mmap) to ranges with the size about `chunk_size` bytes.
+
+    :return list of (begin, end) pairs, `end` is not included.
+    """
+    size = len(buf)
+    chunk_size = max(1, chunk_size)
+
+    ranges = []
+    begin = 0
+    while begin < size:
+        end = buf.find(b'\n', min(begin + chunk_size, size) - 1)
+        end = size if end < 0 else end + 1
+        ranges.append((begin, end))
+        begin = end
+    return ranges
@@ -0,0 +1,103 @@
+# Copyright 2022 tkorays. All Rights Reserved.
+# Licensed to MIT under a Contributor Agreement.
+
+"""
+cache of parsed logs.
+
+points extracted by a pattern are kept in a data store by the fingerprints of the file content, the
+timestamp patterns and the pattern, so a pattern is only parsed again when the log or itself is changed.
+every point keeps the number of its line, so points of different patterns can be replayed in log order.
+"""
+
+import hashlib
+from array import array
+import io
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+# types of values which are kept in columns
+_COLUMN_TYPES = (int, float, str, bool)
+_INT64 = (-2 ** 63, 2 ** 63)
+
+
+def file_fingerprint(path: str, block_size: int = 4 * 1024 * 1024) -> str:
+    """
+    hash of the file content.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with io.open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def batch_points(data):
+    """
+    iterate (datetime, value) of points in a columnar batch or a list.
+    """
+    if isinstance(data, list):
+        yield from data
+        return
+    keys = list(data.columns.keys())
+    columns = [data.column(k).tolist() for k in keys]
+    for i, us in enumerate(data.timestamps.tolist()):
+        yield _EPOCH + us * _US, {k: col[i] for k, col in zip(keys, columns)}
+
+
+def recorded_points(data):
+    """
+    iterate (line number, datetime, value) of recorded points, see `PointRecorder.build`.
+    """
+    lines, points = data
+    for line, (dt, value) in zip(lines, batch_points(points)):
+        yield line, dt, value
+
+
+class PointRecorder:
+    """
+    record points of a pattern in a columnar batch.
+
+    columns can't keep missing values and types exactly, so once a point has different keys or types from
+    the first one, all points of the pattern are kept as a list of (datetime, value).
+    """
+    def __init__(self, name: str, tags: list):
+        from coffee.data import ColumnarBatchBuilder
+        self.builder = ColumnarBatchBuilder(name, tags)
+        # line number of every point
+        self.lines = array('q')
+        # (key, type) of every field in the first point
+        self.types = None
+        self.rows = None
+
+    def append(self, line: int, dt: datetime, value: dict):
+        self.lines.append(line)
+        if self.rows is None:
+            types = tuple((k, type(v)) for k, v in value.items())
+            if self.types is None:
+                self.types = types
+            if types == self.types and dt.tzinfo is None and self.columnar(value):
+                self.builder.append(dt, value)
+                return
+            self.rows = list(batch_points(self.builder.build())) if len(self.builder) else []
+        self.rows.append((dt, dict(value)))
+
+    @staticmethod
+    def columnar(value: dict) -> bool:
+        for v in value.values():
+            if type(v) not in _COLUMN_TYPES:
+                return False
+            if type(v) is int and not _INT64[0] <= v < _INT64[1]:
+                return False
+        return True
+
+    def build(self):
+        """
+        :return line numbers and points, points are a columnar batch, or a list of (datetime, value).
+        """
+        if self.rows is not None:
+            return self.lines, self.rows
+        return self.lines, self.builder.build() if len(self.builder) else []
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+import click
+from click.testing import CliRunner
+from coffee.core.playbook import PlaybookCommandLoader, PlaybookManifest, LazyPlaybookGroup
+
+PLAYBOOK = '''
+import click
+
+
+@click.command('hello', help={help!r})
+def hello():
+    click.echo('hello from playbook')
+
+
+commands = [hello]
+'''
+
+
+class LazyPlaybookGroupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.plays = os.path.join(self.tmp.name, 'plays')
+        self.play_dir = os.path.join(self.plays, 'LazyDemoPlaybook')
+        os.makedirs(self.play_dir)
+        self.write_playbook('say hello')
+        self.manifest_path = os.path.join(self.tmp.name, 'playbooks.json')
+
+    def tearDown(self) -> None:
+        sys.modules.pop('LazyDemoPlaybook', None)
+        if self.plays in sys.path:
+            sys.path.remove(self.plays)
+        self.tmp.cleanup()
+
+    def write_playbook(self, help):
+        path = os.path.join(self.play_dir, '__init__.py')
+        with open(path, 'w') as f:
+            f.write(PLAYBOOK.format(help=help))
+        # make sure mtime is changed
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+    def make_group(self):
+        @click.group(cls=LazyPlaybookGroup)
+        def group():
+            pass
+        group.manifest = PlaybookManifest(self.manifest_path)
+        PlaybookCommandLoader(group).load_custom_plays(self.plays)
+        return group
+
+    def testLazyLoad(self):
+        self.make_group()
+        self.assertTrue(os.path.exists(self.manifest_path))
+        sys.modules.pop('LazyDemoPlaybook')
+
+        # help is listed from the manifest without importing the playbook
+        result = CliRunner().invoke(self.make_group(), ['--help'])
+        self.assertIn('say hello', result.output)
+        self.assertNotIn('LazyDemoPlaybook', sys.modules)
+
+        result = CliRunner().invoke(self.make_group(), ['hello'])
+        self.assertEqual(result.output, 'hello from playbook\n')
+        self.assertIn('LazyDemoPlaybook', sys.modules)
+
+    def testInvalidate(self):
+        self.make_group()
+        sys.modules.pop('LazyDemoPlaybook')
+        self.write_playbook('say hello again')
+        result = CliRunner().invoke(self.make_group(), ['--help'])
+        self.assertIn('say hello again', result.output)
+
+    def testMissingPath(self):
+        group = self.make_group()
+        PlaybookCommandLoader(group).load_custom_plays(os.path.join(self.tmp.name, 'missing'))
+        self.assertEqual(group.list_commands(None), ['hello'])
@@ -0,0 +1,26 @@
+import unittest
+from datetime import datetime
+import numpy as np
+from coffee.data import ColumnarBatchBuilder
+
+
+class ColumnarBatchTest(unittest.TestCase):
+    def testBuild(self):
+        builder = ColumnarBatchBuilder('a_pattern', tags=[('a', 'A')])
+        builder.append(datetime(2022, 11, 6, 20, 0, 0), {'a': 1, 'b': 2, 'c': 'x'})
+        builder.append(datetime(2022, 11, 6, 20, 0, 1), {'a': 3, 'b': 2.5})
+        builder.append(datetime(2022, 11, 6, 20, 0, 2), {'a': 1, 'b': 4, 'c': 'y'})
+        batch = builder.build()
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(len(builder), 0)
+        self.assertEqual(batch.timestamps.dtype, np.int64)
+        self.assertEqual(batch.datetimes()[1], np.datetime64('2022-11-06T20:00:01'))
+        # tags are dictionary encoded
+        codes, categories = batch.columns['a']
+        self.assertEqual(codes.tolist(), [0, 1, 0])
+        self.assertEqual(categories, [1, 3])
+        # int column is converted to float
+        self.assertEqual(batch.columns['b'].dtype, np.float64)
+        self.assertEqual(batch.columns['b'].tolist(), [2.0, 2.5, 4.0])
+        self.assertEqual(batch.column('c').tolist(), ['x', None, 'y'])
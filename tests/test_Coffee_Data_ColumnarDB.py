@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from coffee.data import ColumnarTimeSeriesDatabase, TimeRange, InfluxDBDataSink, DataPoint
+
+
+class ColumnarTimeSeriesDatabaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = ColumnarTimeSeriesDatabase(self.tmp.name, partition=timedelta(hours=1), batch_size=100)
+        self.db.connect()
+        self.base = datetime(2022, 11, 6, 20, 0, 0)
+
+    def tearDown(self) -> None:
+        self.db.disconnect()
+        self.tmp.cleanup()
+
+    def testInsertSelect(self):
+        # out of order inserts across partitions, a field and a tag appear later
+        for i in reversed(range(500)):
+            fields = {'v': i, 'name': f'n{i % 3}'}
+            tags = {'source': 'a' if i % 2 else 'b'}
+            if i < 100:
+                fields['late'] = i * 0.5
+                tags['ssrc'] = 'x'
+            self.db.insert(fields, 'm', tags, self.base + timedelta(seconds=i * 30))
+        self.db.finish()
+
+        time_range = TimeRange(self.base + timedelta(seconds=30 * 50), self.base + timedelta(seconds=30 * 300))
+        batch = self.db.select_numpy(['v', 'name', 'late'], 'm', {'source': 'a'}, time_range)
+        expected = [i for i in range(50, 300) if i % 2]
+        self.assertEqual(batch.column('v').tolist(), expected)
+        self.assertEqual(batch.column('name').tolist(), [f'n{i % 3}' for i in expected])
+        self.assertEqual(batch.column('late')[:25].tolist(), [i * 0.5 for i in expected[:25]])
+        self.assertTrue(all(v != v for v in batch.column('late')[25:]))
+
+        # reopen and filter by the late tag
+        db = ColumnarTimeSeriesDatabase(self.tmp.name)
+        points = list(db.select('v', 'm', {'ssrc': 'x'}, None))
+        self.assertEqual([p['v'] for p in points], list(range(100)))
+        self.assertEqual(points[0]['time'], '2022-11-06T12:00:00.000000Z')
+        self.assertIsNone(db.select_numpy('v', 'm', {'source': 'c'}, None))
+        self.assertIsNone(db.select_numpy('v', 'unknown', {}, None))
+
+    def testDataSink(self):
+        sink = InfluxDBDataSink(self.db, source='s')
+        sink.on_batch([DataPoint('m', self.base + timedelta(seconds=i), {'v': i}, [], {}) for i in range(10)])
+        sink.finish(None)
+        batch = self.db.select_numpy('v', 'm', {'source': 's'}, TimeRange(self.base, self.base + timedelta(seconds=5)))
+        self.assertEqual(batch.column('v').tolist(), list(range(5)))
+
+    def testFilters(self):
+        for i in range(20):
+            self.db.insert({'v': i, 'name': f'n{i % 3}'}, 'm', {'source': 'a' if i % 2 else 'b'},
+                           self.base + timedelta(seconds=i))
+        self.db.finish()
+        select = lambda filters: self.db.select_numpy('v', 'm', {}, None, filters).column('v').tolist()
+        self.assertEqual(select("name='n1' and source='a'"), [1, 7, 13, 19])
+        self.assertEqual(select('"v"!=0 AND v<>1 and name<>\'n2\''), [3, 4, 6, 7, 9, 10, 12, 13, 15, 16, 18, 19])
+        self.assertEqual(select('v=4.0'), [4])
+        self.assertIsNone(self.db.select_numpy('v', 'm', {}, None, "unknown='x'"))
+        with self.assertRaises(ValueError):
+            self.db.select_numpy('v', 'm', {}, None, 'v > 1')
+
+    def testInterruptedAppend(self):
+        for i in range(10):
+            self.db.insert({'v': i}, 'm', {'source': 'a'}, self.base + timedelta(seconds=i))
+        self.db.finish()
+        partition = next(iter(self.db.partitions.values()))
+        # columns and blocks of the next append are written, but time is not
+        for name, data in (('f_v.f8', b'\0' * 8 * 5), ('t_source.i4', b'\0' * 4 * 5), ('f_new.f8', b'\0' * 8 * 15),
+                           ('blocks.i8', np.array([10, 5, 0, 0], dtype=np.int64).tobytes())):
+            with open(partition.file(name), 'ab') as f:
+                f.write(data)
+
+        # reading doesn't repair files, the append may be still going on
+        db = ColumnarTimeSeriesDatabase(self.tmp.name)
+        self.assertEqual(db.select_numpy('v', 'm', {}, None).column('v').tolist(), list(range(10)))
+        self.assertEqual(os.path.getsize(partition.file('blocks.i8')), 64)
+
+        for i in range(10, 15):
+            db.insert({'v': i, 'new': i}, 'm', {'source': 'a'}, self.base + timedelta(seconds=i))
+        batch = db.select_numpy(['v', 'new'], 'm', {'source': 'a'}, None)
+        self.assertEqual(batch.column('v').tolist(), list(range(15)))
+        self.assertEqual(batch.column('new').tolist()[10:], list(range(10, 15)))
+        self.assertEqual(os.path.getsize(partition.file('blocks.i8')), 64)
+        self.assertTrue(all(v != v for v in batch.column('new')[:10]))
+        db.disconnect()
@@ -0,0 +1,141 @@
+import unittest
+from datetime import datetime
+import ddt
+from coffee.core.utils import merge_datetime
+from coffee.data import RegexPattern, PatternGroupBuilder, DEFAULT_TS_PATTERNS, TimestampRecognizer
+from coffee.data.dataextractor import required_literals, bytes_compatible
+
+SCALE = 2
+
+
+def scale(name, kv):
+    return {k: v * SCALE for k, v in kv.items()}
+
+
+def scale_recursive(name, kv):
+    return scale_recursive(name, kv) if not kv else scale(name, kv)
+
+
+@ddt.ddt
+class CompiledPatternGroupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.group = PatternGroupBuilder('test').add_pattern(
+            RegexPattern('cpu', r'Sys\[CPU:([\d\.]+)%\(App\) ([\d\.]+)%\(Sys\)', {'app': float, 'sys': float})
+        ).add_pattern(
+            RegexPattern('pair', r'(\d+),(\d+)', {'a': int, 'b': int})
+        ).add_pattern(
+            RegexPattern('ignore_case', r'(?i)bitrate=(\d+)', {'bitrate': int})
+        ).add_pattern(
+            RegexPattern('cpu_level', r'CpuLevel:(\d+)', {'level': int})
+        ).build()
+        self.matcher = self.group.compile()
+
+    @ddt.data(
+        (r'(\d+),(\d+)', [',']),
+        (r'Sys\[CPU:([\d\.]+)%', ['Sys[CPU:', '%']),
+        (r'(?:abc)+def(ghi)?', ['abc', 'def']),
+        (r'(?i)abc', []),
+        (r'abc|def', []),
+    )
+    @ddt.unpack
+    def testRequiredLiterals(self, pattern, literals):
+        self.assertEqual(required_literals(pattern), literals)
+
+    @ddt.data(
+        (r'cpu:([0-9]+)|mem=(.*)', True),
+        (r'(\d+),(\d+)', False),
+        (r'name=([\w.]+)', False),
+        (r'\bend', False),
+        (r'(?i:abc)', False),
+        (r'é=(.*)', False),
+    )
+    @ddt.unpack
+    def testBytesCompatible(self, pattern, compatible):
+        self.assertEqual(bytes_compatible(pattern), compatible)
+
+    @ddt.data(
+        'Sys[CPU:12.5%(App) 30.1%(Sys) CpuLevel:2]',
+        'BitRate=100 1,2',
+        'nothing here',
+        'CpuLevel:x 3,4 bitrate=5',
+    )
+    def testMatch(self, line):
+        expected = []
+        for idx, p in enumerate(self.group.get_patterns()):
+            r = p.match(line)
+            if r:
+                expected.append((idx, r))
+        self.assertEqual(self.matcher.match(line), expected)
+
+    def testReject(self):
+        # only the pattern without literal is matched
+        self.assertEqual(self.matcher.candidates('nothing here'), [2])
+
+    def testFingerprintGlobals(self):
+        global SCALE
+
+        def fingerprint(processor):
+            return RegexPattern('a', r'(\d+)', {'a': int}, processors=[processor]).get_fingerprint()
+
+        expected = [fingerprint(scale), fingerprint(scale_recursive)]
+        self.assertNotIn(None, expected)
+        self.assertEqual([fingerprint(scale), fingerprint(scale_recursive)], expected)
+        try:
+            # module globals used by the processor and the functions it calls are fingerprinted too
+            SCALE = 3
+            self.assertNotEqual(fingerprint(scale), expected[0])
+            self.assertNotEqual(fingerprint(scale_recursive), expected[1])
+        finally:
+            SCALE = 2
+
+
+class TimestampRecognizerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.base_datetime = datetime(2022, 11, 6)
+
+    def parse_by_patterns(self, line):
+        for t in DEFAULT_TS_PATTERNS:
+            ts = t.match(line)
+            if ts:
+                return merge_datetime(self.base_datetime, ts)
+        return None
+
+    def testParse(self):
+        lines = [f'2022-11-06 20:{i // 60:02d}:{i % 60:02d}.{i * 7 % 1000:03d} [I] line {i}\n' for i in range(100)]
+        lines += [
+            'no timestamp here\n',
+            '2022-11-06 20:01:02 [I] no millisecond\n',
+            '2022-11-06 20:01:02.1234 [I] longer millisecond\n',
+            '[2022-11-06 20:01:02.123] [I] shifted\n',
+            '20:01:02.345 [I] time only\n',
+            '2022-11-06T20:01:02.678 [I] iso format\n',
+            # the iso format has priority over the learned one
+            '2022-11-06 20:00:30.100 [I] event at 2022-11-01T01:02:03.456\n',
+        ]
+        lines += [f'[2022-11-07 10:00:{i:02d}.{i:03d}] [I] line {i}\n' for i in range(30)]
+        lines += ['[2022-11-07 10:01:00.100] [I] event at 2022-11-01T01:02:03.456\n']
+
+        recognizer = TimestampRecognizer(DEFAULT_TS_PATTERNS, self.base_datetime)
+        for line in lines:
+            self.assertEqual(recognizer.parse(line), self.parse_by_patterns(line), line)
+        self.assertIsNotNone(recognizer.layout)
+
+        buf = ''.join(lines).encode()
+        recognizer = TimestampRecognizer(DEFAULT_TS_PATTERNS, self.base_datetime)
+        pos = 0
+        for line in lines:
+            end = pos + len(line.encode())
+            self.assertEqual(recognizer.parse_bytes(buf, pos, end), self.parse_by_patterns(line), line)
+            pos = end
+
+    def testProcessedPattern(self):
+        # hours are shifted by the processor
+        pattern = RegexPattern('ts', r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})\.(\d{3})',
+                               {'year': int, 'month': int, 'day': int, 'hour': int, 'minute': int, 'second': int,
+                                'millisecond': int},
+                               processors=[lambda name, kv: dict(kv, hour=kv['hour'] - 8)])
+        recognizer = TimestampRecognizer([pattern], self.base_datetime)
+        for i in range(50):
+            line = f'2022-11-06 09:00:{i:02d}.000 [I] line {i}\n'
+            self.assertEqual(recognizer.parse(line), datetime(2022, 11, 6, 1, 0, i), line)
+        self.assertIsNone(recognizer.layout)
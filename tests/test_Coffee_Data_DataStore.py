@@ -2,8 +2,16 @@ import unittest
 import os
 import tempfile
 import shutil
+import subprocess
+import sys
+import threading
+import time
+import pickle
 import ddt
-from coffee.data import FileSystemDataStore, HDF5DataStore
+import numpy as np
+from coffee.data import ColumnarBatch, FileSystemDataStore, HDF5DataStore, LRUDataStore,\
+    SQLiteDataStore, BoundedDataStore, HDF5SWMRDataStore
+from coffee.data.datastore import data_size, DataStore
 
 
 @ddt.ddt
@@ -12,6 +20,11 @@ class DataStoreTest(unittest.TestCase):
         self.temp_file1 = tempfile.mkdtemp()
         self.temp_file2 = tempfile.mktemp()
         self.datastore = [FileSystemDataStore(self.temp_file1), HDF5DataStore(self.temp_file2)]
+        self.datastore += [LRUDataStore(self.datastore[0]), LRUDataStore(self.datastore[1], write_back=True)]
+        self.temp_file3 = tempfile.mkdtemp()
+        self.datastore.append(FileSystemDataStore(self.temp_file3, compress=True, dedup=True))
+        self.datastore.append(SQLiteDataStore(os.path.join(self.temp_file3, 'store.db')))
+        self.datastore.append(BoundedDataStore(self.datastore[0], os.path.join(self.temp_file3, 'meta.db'), 1024))
 
     def tearDown(self) -> None:
         for ds in self.datastore:
@@ -20,21 +33,335 @@ class DataStoreTest(unittest.TestCase):
             shutil.rmtree(self.temp_file1)
         if os.path.exists(self.temp_file2):
             os.remove(self.temp_file2)
+        shutil.rmtree(self.temp_file3, ignore_errors=True)
 
-    @ddt.data(0, 1)
+    @ddt.data(0, 1, 2, 3, 4, 5, 6)
     def testAdd(self, store_idx):
         self.datastore[store_idx].add('type_name_aaa', '1234', '1234')
         result = self.datastore[store_idx].fetch('type_name_aaa', '1234')
         self.assertEqual(result, '1234')
 
-    @ddt.data(0, 1)
+    @ddt.data(0, 1, 2, 3, 4, 5, 6)
     def testUpdate(self, store_idx):
         self.datastore[store_idx].add('type_name_aaa', '1234', '1234')
         self.datastore[store_idx].update('type_name_aaa', '1234', '5678')
         self.assertEqual(self.datastore[store_idx].fetch('type_name_aaa', '1234'), '5678')
 
-    @ddt.data(0, 1)
+    @ddt.data(0, 1, 2, 3, 4, 5, 6)
     def testUpdateOrAdd(self, store_idx):
         self.datastore[store_idx].update_or_add('type_name_aaa', '1234', '1234')
         self.datastore[store_idx].update_or_add('type_name_aaa', '1234', '5678')
         self.assertEqual(self.datastore[store_idx].fetch('type_name_aaa', '1234'), '5678')
+
+    @ddt.data(0, 1, 2, 3, 4, 5, 6)
+    def testMany(self, store_idx):
+        store = self.datastore[store_idx]
+        self.assertEqual(store.fetch_many('type_name_aaa', ['1', '2']), [None, None])
+        store.add('type_name_aaa', '1', '1')
+        self.assertTrue(store.add_many('type_name_aaa', {'1': '0', '2': [2], '3': {'3': 3}}))
+        self.assertEqual(store.exist_many('type_name_aaa', ['1', '2', '4']), [True, True, False])
+        self.assertEqual(store.fetch_many('type_name_aaa', ['3', '4', '2', '1']), [{'3': 3}, None, [2], '1'])
+
+    @ddt.data(0, 1, 2, 3, 4, 5, 6)
+    def testRemove(self, store_idx):
+        store = self.datastore[store_idx]
+        store.add('type_name_aaa', '1', '1')
+        self.assertTrue(store.remove('type_name_aaa', '1'))
+        self.assertTrue(store.remove('type_name_aaa', '2'))
+        self.assertFalse(store.exist('type_name_aaa', '1'))
+        self.assertIsNone(store.fetch('type_name_aaa', '1'))
+
+    def testLRUWriteBack(self):
+        cache = LRUDataStore(self.datastore[0], max_items=2, write_back=True)
+        cache.add('type_name_aaa', '1', '1')
+        cache.update('type_name_aaa', '1', '11')
+        self.assertFalse(self.datastore[0].exist('type_name_aaa', '1'))
+        cache.add('type_name_aaa', '2', '2')
+        cache.add('type_name_aaa', '3', '3')
+        # the least recently used one is written when evicted
+        self.assertEqual(self.datastore[0].fetch('type_name_aaa', '1'), '11')
+        self.assertFalse(self.datastore[0].exist('type_name_aaa', '2'))
+        cache.flush()
+        self.assertEqual(self.datastore[0].fetch('type_name_aaa', '3'), '3')
+        self.assertEqual(cache.fetch('type_name_aaa', '1'), '11')
+        self.assertEqual(len(cache.entries), 2)
+
+    def testLRUInvalidate(self):
+        cache = LRUDataStore(self.datastore[0], max_bytes=1024)
+        cache.add('type_name_aaa', '1', '1')
+        self.assertEqual(cache.fetch('type_name_aaa', '1'), '1')
+        self.datastore[0].update('type_name_aaa', '1', '2')
+        self.assertEqual(cache.fetch('type_name_aaa', '1'), '1')
+        cache.update('type_name_aaa', '1', '3')
+        self.assertEqual(cache.fetch('type_name_aaa', '1'), '3')
+        # too large to be cached
+        cache.update('type_name_aaa', '1', 'x' * 2048)
+        self.assertEqual(cache.fetch('type_name_aaa', '1'), 'x' * 2048)
+        self.assertEqual(cache.bytes, 0)
+
+    def testRemoveNotSupported(self):
+        class DictDataStore(DataStore):
+            # a store written before `remove` was added
+            def __init__(self):
+                self.data = {}
+
+            def exist(self, type_id, cache_id):
+                return (type_id, cache_id) in self.data
+
+            def add(self, type_id, cache_id, data):
+                self.data.setdefault((type_id, cache_id), data)
+                return True
+
+            def update(self, type_id, cache_id, data):
+                self.data[(type_id, cache_id)] = data
+                return True
+
+            def update_or_add(self, type_id, cache_id, data):
+                return self.update(type_id, cache_id, data)
+
+            def fetch(self, type_id, cache_id):
+                return self.data.get((type_id, cache_id))
+
+        store = LRUDataStore(DictDataStore())
+        store.add('type_name_aaa', '1', 1)
+        self.assertEqual(store.fetch('type_name_aaa', '1'), 1)
+        with self.assertRaises(NotImplementedError):
+            store.remove('type_name_aaa', '1')
+
+    def testLRUSize(self):
+        # arrays are measured by their buffers, data are never pickled for the size
+        self.assertEqual(data_size(np.zeros(1000, dtype=np.int64)), 8000)
+        batch = ColumnarBatch('m', np.arange(100, dtype=np.int64), {'v': np.zeros(100)}, [])
+        self.assertEqual(data_size(batch), batch.nbytes())
+        self.assertGreater(data_size({'a': np.zeros(1000), 'b': [np.zeros(1000)]}), 16000)
+        cache = LRUDataStore(self.datastore[0], max_bytes=20000, write_back=True)
+        cache.add('type_name_aaa', '1', {'a': np.zeros(1000)})
+        cache.add('type_name_aaa', '2', np.zeros(1000))
+        self.assertEqual(len(cache.entries), 2)
+        cache.add('type_name_aaa', '3', np.zeros(1000))
+        # the least recently used one is evicted
+        self.assertEqual(list(cache.entries.keys()), [('type_name_aaa', '2'), ('type_name_aaa', '3')])
+
+    def testOldProtocol(self):
+        # pythons without protocol 5 keep buffers in the pickle
+        store = FileSystemDataStore(self.temp_file3, compress=True)
+        store.PROTOCOL = 4
+        data = {'features': np.arange(1000, dtype=np.int64)}
+        store.add('type_name_aaa', '1', data)
+        np.testing.assert_array_equal(store.fetch('type_name_aaa', '1')['features'], data['features'])
+
+    def testDedup(self):
+        store = FileSystemDataStore(self.temp_file3, compress=True, dedup=True, chunk_size=1024)
+        data = {'features': np.arange(10000, dtype=np.int64), 'name': 'abc'}
+        store.add('type_name_aaa', '1', data)
+        store.add('type_name_aaa', '2', data)
+        objects = os.path.join(self.temp_file3, '.objects')
+        chunks = sum(len(files) for _, _, files in os.walk(objects))
+        # 79 chunks of the array and a pickle, kept once
+        self.assertEqual(chunks, 80)
+        fetched = store.fetch('type_name_aaa', '2')
+        np.testing.assert_array_equal(fetched['features'], data['features'])
+        fetched['features'][0] = 1
+        self.assertEqual(store.fetch_many('type_name_aaa', ['1'])[0]['name'], 'abc')
+
+        # plain pickles are still readable, unused chunks are removed
+        FileSystemDataStore(self.temp_file3).update('type_name_aaa', '1', '1')
+        self.assertEqual(store.fetch('type_name_aaa', '1'), '1')
+        self.assertEqual(store.collect_garbage(grace=0), 0)
+        store.update('type_name_aaa', '2', '2')
+        # recent chunks may be used by data being dumped
+        self.assertEqual(store.collect_garbage(), 0)
+        # temporary files and truncated data files are skipped
+        tmp = os.path.join(objects, 'ab', 'cdef.1.tmp')
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        open(tmp, 'wb').close()
+        with open(os.path.join(self.temp_file3, 'type_name_aaa', '3'), 'wb') as f:
+            f.write(FileSystemDataStore.MAGIC + b'\x80\x05')
+        self.assertEqual(store.collect_garbage(grace=0), chunks)
+        self.assertTrue(os.path.exists(tmp))
+        self.assertEqual(store.fetch('type_name_aaa', '2'), '2')
+
+    def testSQLite(self):
+        store = self.datastore[5]
+        with store.transaction():
+            store.add_many('type_name_aaa', {'a/1': 1, 'a/2': 2, 'b/1': 3})
+            store.update_or_add('type_name_bbb', 'a/3', 4)
+        # only existing data are updated
+        self.assertFalse(store.update('type_name_bbb', 'a/4', 5))
+        self.assertFalse(store.exist('type_name_bbb', 'a/4'))
+        self.assertTrue(store.update('type_name_bbb', 'a/3', 5))
+        self.assertEqual(store.fetch('type_name_bbb', 'a/3'), 5)
+        with self.assertRaises(ValueError):
+            with store.transaction():
+                store.update('type_name_aaa', 'a/1', 5)
+                raise ValueError()
+        self.assertEqual(list(store.scan('type_name_aaa', 'a/')), [('a/1', 1), ('a/2', 2)])
+        self.assertEqual(list(store.scan('type_name_aaa', with_data=False)), ['a/1', 'a/2', 'b/1'])
+
+        # readers in other threads
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.fetch('type_name_aaa', 'b/1')))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [3] * 4)
+        # connections of all threads are closed
+        self.assertEqual(len(store.connections), 5)
+        connections = list(store.connections)
+        store.close()
+        for conn in connections:
+            with self.assertRaises(Exception):
+                conn.execute('SELECT 1')
+        self.assertEqual(store.fetch('type_name_aaa', 'b/1'), 3)
+
+    @ddt.data('lru', 'lfu')
+    def testBounded(self, policy):
+        meta = os.path.join(self.temp_file3, f'{policy}.db')
+        store = BoundedDataStore(self.datastore[0], meta, 3000, policy=policy, evict_batch=1)
+        for i in range(3):
+            store.add('type_name_aaa', str(i), 'x' * 900)
+        store.fetch('type_name_aaa', '0')
+        store.fetch('type_name_aaa', '1')
+        store.fetch('type_name_aaa', '1')
+        store.fetch('type_name_aaa', '0')
+        store.add('type_name_aaa', '3', 'x' * 900)
+        # '2' is neither recent nor frequent, then the oldest or least used one
+        self.assertFalse(store.exist('type_name_aaa', '2'))
+        store.update('type_name_aaa', '4', 'x' * 900)
+        self.assertEqual(store.exist_many('type_name_aaa', ['0', '1', '3']),
+                         [True, False, True] if policy == 'lru' else [True, True, False])
+        self.assertLessEqual(BoundedDataStore(self.datastore[0], meta).bytes, 3000)
+
+    def testBoundedTTL(self):
+        store = BoundedDataStore(self.datastore[0], os.path.join(self.temp_file3, 'ttl.db'),
+                                 ttl={'type_name_aaa': 0.05})
+        store.add('type_name_aaa', '1', '1')
+        store.add('type_name_bbb', '1', '1')
+        self.assertEqual(store.fetch('type_name_aaa', '1'), '1')
+        time.sleep(0.1)
+        self.assertIsNone(store.fetch('type_name_aaa', '1'))
+        self.assertFalse(self.datastore[0].exist('type_name_aaa', '1'))
+        self.assertEqual(store.fetch('type_name_bbb', '1'), '1')
+
+    def testBoundedAccounting(self):
+        meta = os.path.join(self.temp_file3, 'accounting.db')
+        store = BoundedDataStore(self.datastore[5], meta)
+        # nothing is written by updating missing data
+        self.assertFalse(store.update('type_name_aaa', '1', 'x' * 100))
+        self.assertEqual(store.bytes, 0)
+        store.add('type_name_aaa', '1', 'x' * 100)
+        self.assertGreater(store.bytes, 100)
+
+        # hits are saved in batches
+        for _ in range(3):
+            store.fetch('type_name_aaa', '1')
+        hits = lambda: store.meta.execute('SELECT hits FROM meta').fetchone()[0]
+        self.assertEqual(hits(), 0)
+        store.flush()
+        self.assertEqual(hits(), 3)
+
+
+class HDF5DataStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_file = tempfile.mktemp()
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+    def testArray(self):
+        store = HDF5DataStore(self.temp_file)
+        data = np.arange(100000, dtype=np.float64).reshape(1000, 100)
+        store.add('features', 'a', data)
+        self.assertTrue(store.exist('features', 'a'))
+        self.assertEqual(store.hdf5['features/a'].compression, 'gzip')
+        np.testing.assert_array_equal(store.fetch('features', 'a'), data)
+        np.testing.assert_array_equal(store.fetch_slice('features', 'a', np.s_[10:20, 5]), data[10:20, 5])
+
+        store = HDF5DataStore(self.temp_file + '.raw', compression=None)
+        try:
+            store.add('features', 'a', data)
+            fetched = store.fetch('features', 'a')
+            np.testing.assert_array_equal(fetched, data)
+            # fetched arrays are not changed by later writes
+            store.remove('features', 'a')
+            store.add('features', 'b', data + 1)
+            store.hdf5.flush()
+            np.testing.assert_array_equal(fetched, data)
+        finally:
+            os.remove(self.temp_file + '.raw')
+
+    def testColumnar(self):
+        store = HDF5DataStore(self.temp_file)
+        batch = ColumnarBatch('cpu', np.arange(10, dtype=np.int64), {
+            'usage': np.linspace(0, 1, 10),
+            'host': (np.array([0, 1] * 5, dtype=np.int32), ['a', 'b']),
+            'state': np.array(['x', None] * 5, dtype=object),
+        }, [('host', 'host')])
+        store.update_or_add('batches', '1/2', batch)
+        fetched = store.fetch('batches', '1/2')
+        self.assertEqual(fetched.name, 'cpu')
+        self.assertEqual(fetched.tags, [('host', 'host')])
+        np.testing.assert_array_equal(fetched.timestamps, batch.timestamps)
+        np.testing.assert_array_equal(fetched.column('usage'), batch.column('usage'))
+        self.assertEqual(fetched.column('host').tolist(), batch.column('host').tolist())
+        self.assertEqual(fetched.column('state').tolist(), batch.column('state').tolist())
+        part = store.fetch_slice('batches', '1/2', slice(2, 4))
+        self.assertEqual(part.timestamps.tolist(), [2, 3])
+        self.assertEqual(part.column('host').tolist(), ['a', 'b'])
+
+    def testLegacy(self):
+        import h5py
+        with h5py.File(self.temp_file, 'a') as f:
+            f.create_dataset('type_name_aaa', data='')
+            f['type_name_aaa'].attrs['1'] = np.void(pickle.dumps('1'))
+        store = HDF5DataStore(self.temp_file)
+        self.assertEqual(store.fetch('type_name_aaa', '1'), '1')
+        store.add('type_name_aaa', '2', np.zeros(3))
+        self.assertEqual(store.fetch_many('type_name_aaa', ['1', '2'])[0], '1')
+        self.assertEqual(store.fetch('type_name_aaa', '2').tolist(), [0, 0, 0])
+
+    def testSWMR(self):
+        HDF5DataStore(self.temp_file).add('type_name_aaa', '0', np.zeros(3))
+        writer = HDF5SWMRDataStore(self.temp_file, writer=True, batch_size=2)
+        reader = HDF5SWMRDataStore(self.temp_file)
+        writer.add('type_name_aaa', '1', {'a': 1})
+        self.assertEqual(writer.fetch('type_name_aaa', '1'), {'a': 1})
+        # not flushed yet
+        self.assertFalse(reader.exist('type_name_aaa', '1'))
+        writer.update('type_name_aaa', '2', '2')
+        self.assertEqual(reader.fetch_many('type_name_aaa', ['0', '1', '2', '3'])[1:], [{'a': 1}, '2', None])
+        self.assertEqual(reader.fetch('type_name_aaa', '0').tolist(), [0, 0, 0])
+
+        writer.remove('type_name_aaa', '0')
+        writer.update('type_name_aaa', '1', [1])
+        writer.flush()
+        script = f'from coffee.data import HDF5SWMRDataStore\n' \
+                 f'r = HDF5SWMRDataStore({self.temp_file!r})\n' \
+                 f'print(r.exist_many("type_name_aaa", ["0", "1", "2"]), r.fetch("type_name_aaa", "1"))'
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env).stdout
+        self.assertEqual(output.strip(), '[False, True, True] [1]')
+        self.assertEqual(reader.exist_many('type_name_aaa', ['0', '1']), [False, True])
+        with self.assertRaises(PermissionError):
+            reader.add('type_name_aaa', '4', 4)
+        reader.close()
+
+        # only the latest data are kept by compaction, 4 rows before
+        writer.compact()
+        # the removal of '0' is kept, it's still in the data of HDF5DataStore
+        self.assertEqual(writer.log['index'].shape[0], 3)
+        writer.update('type_name_aaa', '3', 3)
+        writer.flush()
+        reader = HDF5SWMRDataStore(self.temp_file)
+        self.assertEqual(reader.fetch_many('type_name_aaa', ['0', '1', '2', '3']), [None, [1], '2', 3])
+        reader.close()
+        writer.close()
+
+    def testSWMRWithoutLog(self):
+        HDF5DataStore(self.temp_file).add('type_name_aaa', '0', '0')
+        reader = HDF5SWMRDataStore(self.temp_file)
+        self.assertEqual(reader.fetch_many('type_name_aaa', ['0', '1']), ['0', None])
+        reader.close()
@@ -0,0 +1,218 @@
+import gzip
+import json
+import unittest
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+import ddt
+from influxdb.line_protocol import make_lines
+from influxdb.resultset import ResultSet
+from coffee.data import InfluxDBV1, InfluxDBDataSink, DataPoint, TimeRange
+from coffee.data.lineprotocol import encode_line, SeriesEncoder
+from coffee.data.dbwriter import series_key
+
+
+class FakeInfluxDBClient:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.points = []
+        self.lock = threading.Lock()
+
+    def write_points(self, points, **kwargs):
+        time.sleep(self.delay)
+        with self.lock:
+            self.points.extend(points)
+
+
+class FakeInfluxDBHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.requests % 3 == 0
+            if not fail:
+                server.lines.extend(gzip.decompress(body).decode().splitlines())
+        self.send_response(500 if fail else 204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeQueryClient:
+    """
+    result of `select v from m<i> ...` is a point with v = i.
+    """
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def query(self, q):
+        with self.lock:
+            self.queries.append(q)
+        results = []
+        for idx, statement in enumerate(q.split(';')):
+            i = int(statement.split(' from m')[1].split(' ')[0])
+            series = [{'name': f'm{i}', 'columns': ['time', 'v'], 'values': [['2022-11-06T12:00:00Z', i]]}]
+            results.append(ResultSet({'statement_id': idx, 'series': series if i % 5 else []}))
+        # results are not in order of statements
+        results.reverse()
+        return results[0] if len(results) == 1 else results
+
+
+class FakeQueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chunks = [
+        {'results': [{'statement_id': 0, 'series': [{
+            'name': 'm', 'columns': ['time', 'v', 's'], 'values': [[1667736000000000, 1, 'a'], [1667736000000001, 2, 'b']]
+        }], 'partial': True}]},
+        {'results': [{'statement_id': 0, 'series': [{
+            'name': 'm', 'columns': ['time', 'v', 's'], 'values': [[1667736000000002, None, 'c']]
+        }]}]},
+    ]
+
+    def do_GET(self):
+        body = ''.join(json.dumps(c) + '\n' for c in self.chunks).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@ddt.ddt
+class InfluxDBV1Test(unittest.TestCase):
+    def make_db(self, client, **kwargs):
+        db = InfluxDBV1(database='test', **kwargs)
+        db.connect()
+        db.client = client
+        return db
+
+    def insert(self, db, count):
+        for i in range(count):
+            db.insert({'v': i}, 'm', {'source': 'a'}, datetime(2022, 11, 6, 20, 0, 0, i))
+
+    def testAsyncWrite(self):
+        client = FakeInfluxDBClient(delay=0.01)
+        db = self.make_db(client, async_write=True, write_threads=2, queue_size=2)
+        db.batch_size = 10
+        self.insert(db, 1005)
+        db.finish()
+        self.assertEqual(sorted(int(p.split('v=')[1].split('i')[0]) for p in client.points), list(range(1005)))
+        db.disconnect()
+
+    def testFlushInterval(self):
+        client = FakeInfluxDBClient()
+        db = self.make_db(client, async_write=True, flush_interval=0.05)
+        self.insert(db, 5)
+        time.sleep(0.5)
+        # pending records are written without finish
+        self.assertEqual(len(client.points), 5)
+        db.disconnect()
+
+    def testDataSink(self):
+        client = FakeInfluxDBClient()
+        db = self.make_db(client)
+        sink = InfluxDBDataSink(db, source='src')
+        dt = datetime(2022, 11, 6, 20, 0, 0)
+        sink.on_batch([DataPoint('m', dt, {'v': 1, 'ssrc': 'a b'}, [('ssrc', 'ssrc')], {})])
+        sink.on_data(DataPoint('m', dt, {'v': 2}, [('ssrc', 'ssrc')], {}))
+        db.finish()
+        self.assertEqual(client.points, [
+            'm,source=src,ssrc=a\\ b ssrc="a b",v=1i 1667736000000000',
+            'm,source=src v=2i 1667736000000000',
+        ])
+
+    def testBulkImport(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeInfluxDBHandler)
+        server.lock = threading.Lock()
+        server.requests = 0
+        server.lines = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        db = InfluxDBV1(port=server.server_address[1], database='test', bulk_import=True, connections=3,
+                        bulk_batch_size=50, bulk_retry_delay=0.01)
+        db.connect()
+        for i in range(2000):
+            db.insert({'v': i}, 'm', {'source': f's{i % 7}'}, datetime(2022, 11, 6, 20, 0, 0, i))
+        db.finish()
+        db.disconnect()
+        server.shutdown()
+        server.server_close()
+
+        self.assertEqual(len(server.lines), 2000)
+        # every third request fails and is retried, points of a series are still in order
+        for source in range(7):
+            values = [int(line.split('v=')[1].split('i')[0]) for line in server.lines if f'source=s{source} ' in line]
+            self.assertEqual(values, list(range(source, 2000, 7)))
+
+    def testSelectNumpy(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeQueryHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        db = InfluxDBV1(port=server.server_address[1], database='test')
+        chunks = list(db.select_chunks(['v', 's'], 'm', {'source': 'a'}, None))
+        batch = db.select_numpy(['v', 's'], 'm', {'source': 'a'}, None)
+        server.shutdown()
+        server.server_close()
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0].column('v').dtype.kind, 'i')
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch.datetimes().astype(datetime)), [
+            datetime(2022, 11, 6, 20, 0, 0, i) for i in range(3)
+        ])
+        self.assertEqual(batch.column('v')[:2].tolist(), [1.0, 2.0])
+        self.assertTrue(batch.column('v')[2] != batch.column('v')[2])
+        self.assertEqual(batch.column('s').tolist(), ['a', 'b', 'c'])
+
+    @ddt.data(1, 3)
+    def testSelectMany(self, parallel):
+        client = FakeQueryClient()
+        db = self.make_db(client)
+        selects = [('v', f'm{i}', {'source': 'a'}, None) for i in range(11)] + [([], 'x', {}, None)]
+        points = db.select_many(selects, statements=4, parallel=parallel)
+        self.assertEqual(len(client.queries), 3)
+        self.assertEqual([p[0]['v'] if p else p for p in points],
+                         [[] if i % 5 == 0 else i for i in range(11)] + [None])
+
+    def testMakeQuery(self):
+        time_range = TimeRange(datetime(2022, 11, 6, 20, 0, 0), datetime(2022, 11, 6, 21, 0, 0))
+        self.assertEqual(
+            InfluxDBV1.make_query(['v'], 'm', {'source': 'a'}, time_range, 'v > 1'),
+            "select v from m where source='a' and time >= 1667736000000000000 and time < 1667739600000000000 and v > 1"
+        )
+        self.assertEqual(InfluxDBV1.make_query('v', 'm', {}, None), 'select v from m')
+
+    def testSeriesKey(self):
+        self.assertEqual(series_key('m,a=b v=1i 1'), 'm,a=b')
+        self.assertEqual(series_key('m\\ x,a=b\\ c v=1i 1'), 'm\\ x,a=b\\ c')
+
+
+@ddt.ddt
+class LineProtocolTest(unittest.TestCase):
+    @ddt.data(
+        ('m', {'source': 'a'}, {'v': 1, 'f': 1.5, 's': 'x "y"', 'b': True, 'n': None}),
+        ('m m,=', {'t a,g': 'v=\\', 'empty': '', 'none': None}, {'k k': -3, 'e=': 'a\\b\nc'}),
+        ('m', {}, {'f': 1e-7, 'big': 12345678901234}),
+    )
+    @ddt.unpack
+    def testEncodeLine(self, measurement, tags, fields):
+        dt = datetime(2022, 11, 6, 20, 1, 2, 345)
+        expected = make_lines({'points': [{
+            'measurement': measurement, 'tags': tags, 'fields': fields, 'time': dt + timedelta(hours=-8)
+        }]}, precision='u').strip()
+        self.assertEqual(encode_line(measurement, tags, fields, dt), expected)
+
+        encoder = SeriesEncoder(measurement, [(k, k) for k in tags.keys()])
+        value = dict(tags, **fields)
+        expected = make_lines({'points': [{
+            'measurement': measurement, 'tags': tags, 'fields': value, 'time': dt + timedelta(hours=-8)
+        }]}, precision='u').strip()
+        self.assertEqual(encoder.encode(value, dt), expected)
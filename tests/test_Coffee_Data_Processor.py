@@ -0,0 +1,40 @@
+import unittest
+from datetime import datetime, timedelta
+from coffee.data import DataPoint, DataAggregator, RollupDataSink
+
+
+class RollupDataSinkTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.base = datetime(2022, 11, 6, 20, 0, 0)
+        self.points = [
+            DataPoint('m', self.base + timedelta(milliseconds=100 * i),
+                      {'v': i, 'ssrc': i % 2, 'state': f's{i}'}, [('ssrc', 'ssrc')], {'id': 'm'})
+            for i in range(25)
+        ]
+
+    def testRollup(self):
+        agg = DataAggregator()
+        sink = RollupDataSink(agg, window=timedelta(seconds=1))
+        sink.on_batch(self.points[:12])
+        for dp in self.points[12:]:
+            sink.on_data(dp)
+        sink.finish(None)
+
+        points = sorted(agg.points(), key=lambda p: (p['timestamp'], p['ssrc']))
+        self.assertEqual(len(points), 6)
+        first = points[0]
+        self.assertEqual(first['timestamp'], self.base)
+        self.assertEqual(first['ssrc'], 0)
+        self.assertEqual((first['v_min'], first['v_max'], first['v_count'], first['v_last']), (0, 8, 5, 8))
+        self.assertEqual(first['v_mean'], 4.0)
+        self.assertEqual(first['state'], 's8')
+        self.assertNotIn('ssrc_min', first)
+        self.assertEqual(points[-1]['timestamp'], self.base + timedelta(seconds=2))
+        self.assertEqual(points[-1]['v_count'], 2)
+
+    def testRaw(self):
+        agg = DataAggregator()
+        sink = RollupDataSink(agg, window=timedelta(seconds=10), raw=True)
+        sink.on_batch(self.points)
+        sink.finish(None)
+        self.assertEqual(len(agg.points()), 25 + 2)
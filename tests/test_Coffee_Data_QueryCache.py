@@ -0,0 +1,133 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from coffee.data import CachedTimeSeriesDatabase, TimeRange, ColumnarBatch, ColumnarTimeSeriesDatabase, \
+    InfluxDBDataSink, DataPoint
+from coffee.data.querycache import missing_ranges
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+
+class FakeDatabase:
+    """
+    a point every second with v = seconds since 2022-11-06.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def select_numpy(self, fields, table, tags, time_range, filters=''):
+        self.queries.append((time_range.begin, time_range.end))
+        base = datetime(2022, 11, 6)
+        begin = max(0, int((time_range.begin - base).total_seconds() + 0.999999))
+        end = int((time_range.end - base).total_seconds() + 0.999999)
+        if begin >= end:
+            return None
+        seconds = np.arange(begin, end, dtype=np.int64)
+        timestamps = (base - _EPOCH) // _US + seconds * 1000000
+        return ColumnarBatch(table, timestamps, {'v': seconds.astype(np.float64)}, [])
+
+    def insert_lines(self, lines):
+        return True
+
+
+class CachedTimeSeriesDatabaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.base = datetime(2022, 11, 6)
+
+    def select(self, cache, begin, end, table='m'):
+        batch = cache.select_numpy('v', table, {'source': 'a'},
+                                   TimeRange(self.base + timedelta(seconds=begin), self.base + timedelta(seconds=end)))
+        return batch.column('v').tolist()
+
+    def testMissingRanges(self):
+        segments = [(10, 20, None), (30, 40, None)]
+        self.assertEqual(missing_ranges(segments, 0, 50), [(0, 10), (20, 30), (40, 50)])
+        self.assertEqual(missing_ranges(segments, 12, 35), [(20, 30)])
+        self.assertEqual(missing_ranges(segments, 30, 40), [])
+
+    def testOverlappedQueries(self):
+        db = FakeDatabase()
+        cache = CachedTimeSeriesDatabase(db)
+        self.assertEqual(self.select(cache, 10, 20), list(range(10, 20)))
+        self.assertEqual(self.select(cache, 30, 40), list(range(30, 40)))
+        self.assertEqual(len(db.queries), 2)
+
+        # only the gaps are fetched
+        self.assertEqual(self.select(cache, 5, 45), list(range(5, 45)))
+        sec = lambda s: self.base + timedelta(seconds=s)
+        self.assertEqual(db.queries[2:], [(sec(5), sec(10)), (sec(20), sec(30)), (sec(40), sec(45))])
+        self.assertEqual(len(cache.entries[next(iter(cache.entries))]), 1)
+
+        self.assertEqual(self.select(cache, 12, 33), list(range(12, 33)))
+        self.assertEqual(len(db.queries), 5)
+
+        cache.invalidate('m')
+        self.assertEqual(self.select(cache, 12, 33), list(range(12, 33)))
+        self.assertEqual(len(db.queries), 6)
+
+    def testSpill(self):
+        db = FakeDatabase()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CachedTimeSeriesDatabase(db, max_memory=2000, disk_path=tmp)
+            self.assertEqual(self.select(cache, 0, 100, 'a'), list(range(100)))
+            self.assertEqual(self.select(cache, 0, 100, 'b'), list(range(100)))
+            self.assertEqual(len(cache.entries), 1)
+            self.assertEqual(len(cache.disk_files()), 1)
+
+            # loaded from disk
+            self.assertEqual(self.select(cache, 0, 100, 'a'), list(range(100)))
+            self.assertEqual(len(db.queries), 2)
+
+    def testInvalidateSpilled(self):
+        db = FakeDatabase()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CachedTimeSeriesDatabase(db, max_memory=2000, disk_path=tmp)
+            for table in ('a', 'b', 'c'):
+                self.select(cache, 0, 100, table)
+            self.assertEqual(len(cache.disk_files()), 2)
+
+            # spilled files are found by name without loading them
+            cache.load_file = None
+            cache.invalidate('a')
+            self.assertEqual(len(cache.disk_files()), 1)
+            del cache.load_file
+            self.assertEqual(self.select(cache, 0, 100, 'b'), list(range(100)))
+            self.assertEqual(len(db.queries), 3)
+
+    def testRecentRange(self):
+        db = FakeDatabase()
+        cache = CachedTimeSeriesDatabase(db)
+        now = datetime.now()
+        cache.select_numpy('v', 'm', {}, TimeRange(now - timedelta(minutes=10), now))
+        cache.select_numpy('v', 'm', {}, TimeRange(now - timedelta(minutes=10), now))
+        # the settled part is cached, only the newly settled gap and the recent part are fetched again
+        self.assertEqual(len(db.queries), 4)
+        begin, end = db.queries[2]
+        self.assertLess(end - begin, timedelta(seconds=1))
+        self.assertGreater(db.queries[3][1] - db.queries[3][0], timedelta(seconds=59))
+
+    def testInsertLines(self):
+        db = FakeDatabase()
+        cache = CachedTimeSeriesDatabase(db)
+        self.select(cache, 10, 20, 'a b')
+        self.select(cache, 10, 20, 'c')
+        cache.insert_lines(['a\\ b,source=a v=1 1667692810000000000', ''])
+        self.select(cache, 10, 20, 'a b')
+        self.select(cache, 10, 20, 'c')
+        # only the inserted measurement is fetched again
+        self.assertEqual(len(db.queries), 3)
+
+    def testColumnarDatabase(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = ColumnarTimeSeriesDatabase(tmp)
+            db.connect()
+            cache = CachedTimeSeriesDatabase(db)
+            self.assertFalse(hasattr(cache, 'insert_lines'))
+            sink = InfluxDBDataSink(cache, source='a')
+            sink.on_data(DataPoint('m', self.base, {'v': 0}, [], {}))
+            sink.on_batch([DataPoint('m', self.base + timedelta(seconds=i), {'v': i}, [], {}) for i in range(1, 10)])
+            sink.finish(None)
+            self.assertEqual(self.select(cache, 0, 5), list(range(5)))
+            db.disconnect()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from coffee.data import InfluxDBDataSink, LineSpool, SpoolDrainer, DataPoint
+
+
+class FakeDatabase:
+    def __init__(self, fail_at=-1):
+        self.lines = []
+        self.pending = []
+        self.fail_at = fail_at
+
+    def insert_lines(self, lines):
+        self.pending.extend(lines)
+
+    def finish(self):
+        pending, self.pending = self.pending, []
+        if 0 <= self.fail_at < len(self.lines) + len(pending):
+            self.fail_at = -1
+            raise ConnectionError('database is restarting')
+        self.lines.extend(pending)
+
+
+class LineSpoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spool = LineSpool(self.tmp.name, segment_size=100)
+        self.lines = [f'm,source=a v={i}i {i}' for i in range(50)]
+
+    def tearDown(self) -> None:
+        self.spool.close()
+        self.tmp.cleanup()
+
+    def testDrain(self):
+        for i in range(0, 50, 5):
+            self.spool.append(self.lines[i:i + 5])
+        self.spool.flush()
+        self.assertGreater(len(self.spool.segments()), 1)
+
+        db = FakeDatabase(fail_at=20)
+        drainer = SpoolDrainer(self.spool, db, read_size=64)
+        with self.assertRaises(ConnectionError):
+            drainer.drain_once()
+        # restart from the checkpoint
+        drainer = SpoolDrainer(self.spool, db, read_size=64)
+        drainer.drain_once()
+        self.assertEqual(db.lines, self.lines)
+        self.assertEqual(drainer.pending(), 0)
+
+        # another database replays the spool from the beginning
+        second = FakeDatabase()
+        SpoolDrainer(self.spool, second, name='second', remove_drained=True).drain_once()
+        self.assertEqual(second.lines, self.lines)
+        self.assertEqual(len(self.spool.segments()), 1)
+
+    def testBackground(self):
+        db = FakeDatabase()
+        drainer = SpoolDrainer(self.spool, db, interval=0.01)
+        drainer.start()
+        self.spool.append(self.lines)
+        self.spool.flush()
+        self.assertTrue(drainer.join(5))
+        drainer.stop()
+        self.assertEqual(db.lines, self.lines)
+        self.assertTrue(os.path.exists(drainer.checkpoint_path))
+
+    def testLongLines(self):
+        lines = [f'm,source=a v="{"x" * 200}",i={i}i {i}' for i in range(6)]
+        for i in range(0, 6, 2):
+            self.spool.append(lines[i:i + 2])
+        self.spool.flush()
+        self.assertGreater(len(self.spool.segments()), 1)
+
+        db = FakeDatabase()
+        SpoolDrainer(self.spool, db, read_size=16).drain_once()
+        self.assertEqual(db.lines, lines)
+
+    def testSinkError(self):
+        class BrokenDatabase(FakeDatabase):
+            precision = 'u'
+
+            def finish(self):
+                raise ConnectionError('database is down')
+
+        sink = InfluxDBDataSink(BrokenDatabase(), spool=self.spool, drain_timeout=0.2)
+        # the drainer may be waiting by the old interval already
+        sink.drainer.stop()
+        sink.drainer.interval = 0.01
+        sink.drainer.start()
+        sink.write_lines(self.lines)
+        with self.assertRaises(ConnectionError):
+            sink.finish(None)
+
+    def testSinkFlush(self):
+        class CountingSpool(LineSpool):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+                super().flush()
+
+        db = FakeDatabase()
+        db.precision = 'u'
+        spool = CountingSpool(os.path.join(self.tmp.name, 'sink'))
+        sink = InfluxDBDataSink(db, source='a', spool=spool, flush_interval=3600)
+        sink.drainer.interval = 0.01
+        for i in range(10):
+            sink.on_data(DataPoint('m', datetime(2022, 11, 6, 0, 0, i), {'v': i}, [], {}))
+        # single points are flushed by time
+        self.assertEqual(spool.flushes, 0)
+        sink.on_batch([DataPoint('m', datetime(2022, 11, 6, 0, 1, i), {'v': i}, [], {}) for i in range(10)])
+        self.assertEqual(spool.flushes, 1)
+        sink.finish(None)
+        self.assertEqual(len(db.lines), 20)
+        # the drainer is stopped and the spool is closed
+        self.assertIsNone(sink.drainer.thread)
+        self.assertIsNone(spool.file)
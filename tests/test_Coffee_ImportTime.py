@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import ddt
+
+HEAVY_MODULES = ['numpy', 'h5py', 'influxdb', 'grafanalib', 'requests', 'pandas']
+# budget of importing in seconds, it's about 0.1s now and more than 0.8s when everything is loaded
+IMPORT_BUDGET = 0.4
+
+SCRIPT = '''
+import sys, time
+begin = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - begin
+print(elapsed)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+@ddt.ddt
+class ImportTimeTest(unittest.TestCase):
+    def run_import(self, module):
+        with tempfile.TemporaryDirectory() as home:
+            env = dict(os.environ, HOME=home, USERPROFILE=home)
+            src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+            env['PYTHONPATH'] = os.pathsep.join([src, env.get('PYTHONPATH', '')])
+            out = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                 env=env, capture_output=True, text=True, check=True).stdout.split('\n')
+            # nothing is created in home directory at import time
+            self.assertEqual(os.listdir(home), [])
+        return float(out[0]), [m for m in out[1].split(',') if m]
+
+    @ddt.data('coffee.data', 'coffee.logkit', 'coffee.data.processor')
+    def testImport(self, module):
+        elapsed, loaded = self.run_import(module)
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, IMPORT_BUDGET)
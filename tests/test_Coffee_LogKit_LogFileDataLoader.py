@@ -0,0 +1,183 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+import ddt
+from coffee.data import RegexPattern, DataSink, DataPoint, FileSystemDataStore, DEFAULT_TS_PATTERNS
+from coffee.logkit import LogFileDataLoader
+
+
+class CollectDataSink(DataSink):
+    def __init__(self):
+        self.points = []
+
+    def on_data(self, datapoint: DataPoint) -> DataPoint:
+        self.points.append((datapoint.name, datapoint.timestamp, dict(datapoint.value)))
+        return datapoint
+
+    def finish(self, datapoint: DataPoint) -> DataPoint:
+        return datapoint
+
+
+@ddt.ddt
+class LogFileDataLoaderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.log_file = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as f:
+            f.write('no timestamp 0,0\n')
+            for i in range(500):
+                if i % 7 == 0:
+                    # lines without timestamp should inherit the previous one
+                    f.write(f'continue {i},{i + 1}\n')
+                else:
+                    f.write(f'2022-11-06 20:{i // 60 % 60:02d}:{i % 60:02d}.{i % 1000:03d} '
+                            f'data {i},{i * 2} cpu:{i % 5}\n')
+
+    def tearDown(self) -> None:
+        os.remove(self.log_file)
+
+    def load(self, **kwargs):
+        sink = CollectDataSink()
+        LogFileDataLoader(self.log_file, **kwargs).add_pattern(
+            RegexPattern('a_pattern', r'(\d+),(\d+)', {'a': int, 'b': int})
+        ).add_pattern(
+            RegexPattern('cpu_pattern', r'cpu:(\d+)', {'cpu': int})
+        ).add_sink(sink).start()
+        return sink.points
+
+    def testSequential(self):
+        points = self.load()
+        self.assertEqual(len(points), 499 + 428)
+        self.assertEqual(points[0][0], 'a_pattern')
+        self.assertEqual(points[0][2], {'a': 1, 'b': 2})
+
+    @ddt.data(64, 1024, 1024 * 1024)
+    def testParallel(self, chunk_size):
+        self.assertEqual(self.load(workers=2, chunk_size=chunk_size), self.load())
+
+    @ddt.data((0, 64), (0, 1024 * 1024), (2, 1024))
+    @ddt.unpack
+    def testMmap(self, workers, chunk_size):
+        self.assertEqual(self.load(use_mmap=True, workers=workers, chunk_size=chunk_size), self.load())
+
+    @ddt.data(('\r\n', 'ascii'), ('\n', 'unicode'), ('\r\n', 'unicode'))
+    @ddt.unpack
+    def testMmapText(self, newline, content):
+        with open(self.log_file, 'w', encoding='utf-8', newline='') as f:
+            for i in range(300):
+                name = f'user{i}' if content == 'ascii' else f'usér{i}'
+                digits = str(i) if content == 'ascii' or i % 3 else chr(0x660 + i % 10)
+                f.write(f'2022-11-06 20:{i // 60:02d}:{i % 60:02d}.000 data {digits},{i} name={name}{newline}')
+
+        def load(**kwargs):
+            sink = CollectDataSink()
+            LogFileDataLoader(self.log_file, **kwargs).add_pattern(
+                RegexPattern('a_pattern', r'(\d+),(\d+)', {'a': int, 'b': int})
+            ).add_pattern(
+                RegexPattern('name_pattern', r'name=(\w+)$', {'name': str})
+            ).add_pattern(
+                RegexPattern('tail_pattern', r'(\S+)$', {'tail': str})
+            ).add_sink(sink).start()
+            return sink.points
+
+        expected = load()
+        self.assertEqual(len(expected), 900)
+        self.assertEqual(load(use_mmap=True), expected)
+        self.assertEqual(load(use_mmap=True, workers=2, chunk_size=1024), expected)
+
+    @ddt.data(1, 7, 1000)
+    def testBatch(self, batch_size):
+        self.assertEqual(self.load(batch_size=batch_size), self.load(batch_size=1))
+
+    def testCache(self):
+        store = FileSystemDataStore(tempfile.mkdtemp())
+        try:
+            expected = self.load()
+            self.assertEqual(self.load(cache=store), expected)
+
+            # points are replayed without parsing
+            sink = CollectDataSink()
+            patterns = [RegexPattern('a_pattern', r'(\d+),(\d+)', {'a': int, 'b': int}),
+                        RegexPattern('cpu_pattern', r'cpu:(\d+)', {'cpu': int}),
+                        RegexPattern('data_pattern', r'data (\d+)', {'data': str})]
+            LogFileDataLoader(self.log_file, cache=store).set_patterns(patterns[:2]).add_sink(sink).start()
+            self.assertEqual(sink.points, expected)
+            self.assertEqual([p.get_match_count() for p in patterns[:2]], [0, 0])
+
+            # only the new pattern is parsed
+            sink.points = []
+            LogFileDataLoader(self.log_file, cache=store).set_patterns(patterns).add_sink(sink).start()
+            self.assertEqual([p.get_match_count() for p in patterns], [0, 0, 428])
+            self.assertEqual([p for p in sink.points if p[0] != 'data_pattern'], expected)
+            self.assertEqual(sink.points[2], ('data_pattern', sink.points[0][1], {'data': '1'}))
+
+            # a changed pattern or log is parsed again
+            patterns[1].version = '2'
+            with open(self.log_file, 'a') as f:
+                f.write('2022-11-06 21:00:00.000 data 1,2 cpu:4\n')
+            self.assertEqual(len(self.load(cache=store)), 499 + 428 + 2)
+            self.assertEqual(len(os.listdir(os.path.join(store.path, LogFileDataLoader.CACHE_TYPE))), 2 + 1 + 2)
+        finally:
+            shutil.rmtree(store.path)
+
+    def testCacheProcessors(self):
+        def load(store, processor):
+            sink = CollectDataSink()
+            pattern = RegexPattern('a_pattern', r'(\d+),(\d+)', {'a': int, 'b': int}, processors=[processor])
+            LogFileDataLoader(self.log_file, cache=store).add_pattern(pattern).add_sink(sink).start()
+            return pattern.get_match_count(), sink.points[2][2]
+
+        class Unstable:
+            __slots__ = ()
+
+            def process(self, name, kv):
+                return kv
+
+        store = FileSystemDataStore(tempfile.mkdtemp())
+        try:
+            scale = 2
+            self.assertEqual(load(store, lambda name, kv: {'a': kv['a'] * scale}), (501, {'a': 6}))
+            self.assertEqual(load(store, lambda name, kv: {'a': kv['a'] * scale}), (0, {'a': 6}))
+            # changed code or closure values are parsed again
+            self.assertEqual(load(store, lambda name, kv: {'a': kv['a'] + scale}), (501, {'a': 5}))
+            scale = 3
+            self.assertEqual(load(store, lambda name, kv: {'a': kv['a'] * scale}), (501, {'a': 9}))
+            # objects without stable state are never cached
+            self.assertEqual(load(store, Unstable()), (501, {'a': 3, 'b': 6}))
+            self.assertEqual(load(store, Unstable()), (501, {'a': 3, 'b': 6}))
+        finally:
+            shutil.rmtree(store.path)
+
+    @ddt.data({}, {'use_mmap': True}, {'workers': 2, 'chunk_size': 64})
+    def testCacheOrder(self, kwargs):
+        with open(self.log_file, 'w') as f:
+            for second in (3, 1, 2, 2, 1):
+                f.write(f'2022-11-06 20:00:0{second}.000 data {second},0 cpu:{second}\n')
+        store = FileSystemDataStore(tempfile.mkdtemp())
+        try:
+            expected = self.load()
+            self.load(cache=store, **kwargs)
+            # replayed in log order even if timestamps go backwards
+            points = self.load(cache=store)
+            self.assertEqual(points, expected)
+            self.assertEqual([p[1].second for p in points], [3, 3, 1, 1, 2, 2, 2, 2, 1, 1])
+            self.assertEqual([p[0] for p in points[:2]], ['a_pattern', 'cpu_pattern'])
+        finally:
+            shutil.rmtree(store.path)
+
+    def testCacheBaseDate(self):
+        loader = LogFileDataLoader(self.log_file).add_pattern(
+            RegexPattern('a_pattern', r'(\d+),(\d+)', {'a': int, 'b': int}))
+        # time-only timestamps take the date of today
+        ids = loader.cache_ids()
+        loader.base_datetime -= timedelta(days=1)
+        self.assertNotEqual(loader.cache_ids(), ids)
+        loader.base_datetime = (loader.base_datetime + timedelta(days=1)).replace(microsecond=0)
+        self.assertEqual(loader.cache_ids(), ids)
+
+        # with dates in all timestamps, the date of today doesn't matter
+        loader.set_ts_patterns(DEFAULT_TS_PATTERNS[:1])
+        ids = loader.cache_ids()
+        loader.base_datetime -= timedelta(days=1)
+        self.assertEqual(loader.cache_ids(), ids)